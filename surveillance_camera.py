@@ -8,116 +8,3280 @@ Version: 1.0
 import os
 import pwd
 import time
+_IMPORT_STARTED = time.perf_counter()  # Début du chargement du module (rapport de démarrage)
 import threading
 import signal
 import sys
-from datetime import datetime, timedelta
-from flask import Flask, render_template_string, Response, jsonify, request
-from picamera2 import Picamera2
-from picamera2.encoders import H264Encoder
-from picamera2.outputs import FileOutput
+import asyncio
+import io
+import itertools
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+from flask import Flask, render_template_string, Response, jsonify, request, send_file
+from werkzeug.serving import make_server
+from werkzeug.utils import safe_join
 import cv2
 import numpy as np
-from PIL import Image
 import json
 import logging
+import multiprocessing
+import queue
+import sqlite3
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+from urllib.parse import parse_qsl, unquote
+
+try:
+    from picamera2 import Picamera2
+    from picamera2.encoders import H264Encoder
+    from picamera2.outputs import FileOutput, Output
+except ImportError:
+    # Hors Raspberry Pi : seul le backend simulé (FakeCamera) est utilisable
+    Picamera2 = None
+
+    class Output:
+        """Équivalent minimal de picamera2.outputs.Output"""
+
+        def __init__(self, pts=None):
+            self.recording = False
+
+        def start(self):
+            self.recording = True
+
+        def stop(self):
+            self.recording = False
+
+        def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+            pass
+
+    class FileOutput(Output):
+        """Équivalent minimal de picamera2.outputs.FileOutput"""
+
+        def __init__(self, file=None, pts=None):
+            super().__init__(pts)
+            self.fileoutput = open(file, 'wb') if isinstance(file, str) else file
+            self._firstframe = True
+
+        def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+            if self.fileoutput is not None and self.recording:
+                # Comme Picamera2 : rien n'est écrit avant la première image clé
+                if self._firstframe:
+                    if not keyframe:
+                        return
+                    self._firstframe = False
+                self.fileoutput.write(frame)
+
+        def stop(self):
+            super().stop()
+            if self.fileoutput is not None:
+                self.fileoutput.close()
+
+    class H264Encoder:
+        """Équivalent minimal de picamera2.encoders.H264Encoder (paramètres seulement)"""
+
+        def __init__(self, bitrate=None, repeat=False, iperiod=None, **kwargs):
+            self.bitrate = bitrate
+            self.repeat = repeat
+            self.iperiod = iperiod
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Taille d'image à laquelle `motion_threshold` est exprimé (ancien flux de prévisualisation)
+MOTION_THRESHOLD_REFERENCE_SIZE = (640, 480)
+
+def _format_labels(labels, extra=None):
+    """Formate des étiquettes Prometheus : {cle="valeur",...}"""
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+class Counter:
+    """Compteur monotone"""
+
+    kind = 'counter'
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name):
+        return [f'{name}{_format_labels(self.labels)} {self.value}']
+
+
+class Gauge:
+    """Valeur instantanée, éventuellement lue à la volée via `read`"""
+
+    kind = 'gauge'
+
+    def __init__(self, labels, read=None):
+        self.labels = labels
+        self.value = 0
+        self.read = read
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name):
+        value = self.read() if self.read is not None else self.value
+        return [f'{name}{_format_labels(self.labels)} {value}']
+
+
+class Histogram:
+    """Histogramme à seaux fixes ; une observation coûte une recherche dichotomique"""
+
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, labels, buckets=None):
+        self.labels = labels
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Mesure la durée d'un bloc `with`"""
+        return _HistogramTimer(self)
+
+    def render(self, name):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_format_labels(self.labels, {"le": bound})} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(self.labels, {"le": "+Inf"})} {count}')
+        lines.append(f'{name}_sum{_format_labels(self.labels)} {total}')
+        lines.append(f'{name}_count{_format_labels(self.labels)} {count}')
+        return lines
+
+
+class _HistogramTimer:
+    """Gestionnaire de contexte de Histogram.time()"""
+
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class MetricsRegistry:
+    """Registre des métriques exposées au format texte Prometheus sur /metrics"""
+
+    def __init__(self):
+        self._families = {}  # nom -> (type, aide, {étiquettes: métrique})
+        self._lock = threading.Lock()
+
+    def _get(self, factory, name, help_text, labels, **kwargs):
+        labels = labels or {}
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, (factory.kind, help_text, {}))
+            metric = family[2].get(key)
+            if metric is None:
+                metric = factory(labels, **kwargs)
+                family[2][key] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=None):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=None, read=None):
+        return self._get(Gauge, name, help_text, labels, read=read)
+
+    def histogram(self, name, help_text, labels=None, buckets=None):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        """Texte au format d'exposition Prometheus"""
+        lines = []
+        with self._lock:
+            families = sorted(self._families.items())
+        for name, (kind, help_text, metrics) in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for metric in list(metrics.values()):
+                lines.extend(metric.render(name))
+        return '\n'.join(lines) + '\n'
+
+
+# Métriques des chemins critiques (quelques µs par mesure)
+METRICS = MetricsRegistry()
+CAPTURE_SECONDS = {
+    stream: METRICS.histogram('surveillance_capture_seconds', "Durée de capture_array par flux", {'stream': stream})
+    for stream in ('lores', 'motion', 'photo')
+}
+STREAM_STAGE_SECONDS = {
+    stage: METRICS.histogram('surveillance_stream_stage_seconds', "Durée des étapes de préparation du flux", {'stage': stage})
+    for stage in ('convert', 'resize', 'overlay', 'encode')
+}
+MOTION_DETECT_SECONDS = METRICS.histogram('surveillance_motion_detect_seconds', "Durée de detect_motion")
+RECORD_START_SECONDS = METRICS.histogram('surveillance_record_start_seconds', "Latence demande -> première frame écrite")
+RECORD_STOP_SECONDS = METRICS.histogram('surveillance_record_stop_seconds', "Durée de l'arrêt d'un enregistrement")
+RECORD_IO_SECONDS = {
+    operation: METRICS.histogram('surveillance_record_io_seconds', "Durée des écritures et fsync des enregistrements",
+                                 {'operation': operation})
+    for operation in ('write', 'fsync')
+}
+RECORD_IO_STALLS = METRICS.counter('surveillance_record_io_stalls_total', "Écritures ou fsync anormalement lents")
+PHOTO_ENCODE_SECONDS = METRICS.histogram('surveillance_photo_encode_seconds', "Encodage JPEG et écriture d'une photo")
+FILE_LIST_SECONDS = METRICS.histogram('surveillance_file_list_seconds', "Durée de get_file_list")
+DROPPED_FRAMES = METRICS.counter('surveillance_stream_dropped_frames_total', "Frames sautées par des clients lents")
+RECORDINGS_STARTED = METRICS.counter('surveillance_recordings_started_total', "Enregistrements démarrés")
+RECORDED_BYTES = METRICS.counter('surveillance_recorded_bytes_total', "Octets vidéo écrits sur le disque")
+
+class StartupReport:
+    """Durée des phases de démarrage (import, ouverture de la caméra, première image...).
+
+    `listening` et `ready` sont comptés depuis le début de l'import : délai
+    avant que le serveur écoute et avant la première image exploitable.
+    Chaque caméra a son propre bilan, exposé dans /status ; seul celui du
+    processus (`STARTUP`, rattaché à la caméra de create_app) est publié sur
+    /metrics (`surveillance_startup_seconds{phase="..."}`), pour que les
+    caméras des mesures de performance ne l'écrasent pas. Le bilan est
+    journalisé une fois la caméra prête.
+    """
+
+    def __init__(self, publish=False):
+        self.phases = OrderedDict()
+        self.error = None
+        self.publish = publish
+
+    def record(self, phase, seconds):
+        self.phases[phase] = round(seconds, 3)
+        if self.publish:
+            METRICS.gauge('surveillance_startup_seconds', "Durée des phases de démarrage",
+                          {'phase': phase}).set(self.phases[phase])
+
+    def summary(self):
+        return ', '.join(f"{phase} {seconds:.2f} s" for phase, seconds in self.phases.items())
+
+    def as_dict(self):
+        return dict(self.phases, error=self.error)
+
+
+STARTUP = StartupReport(publish=True)
+
+
+class FrameBroadcaster:
+    """Diffuse la dernière frame produite à tous les clients abonnés.
+
+    Un seul thread producteur appelle `produce_frame` ; chaque client attend
+    simplement la version suivante. Un client lent saute les frames
+    intermédiaires au lieu de les accumuler. Si `produce_frame` retourne
+    None, rien n'est publié pour cette itération.
+    """
+
+    def __init__(self, produce_frame, interval=0.1, name='broadcaster'):
+        self.produce_frame = produce_frame
+        self.interval = interval
+        self.name = name
+        self._condition = threading.Condition()
+        self._frame = None
+        self._version = 0
+        self._clients = 0
+        self._running = False
+        self._thread = None
+        self.frames_produced = 0
+        self.published_at = None
+
+    @property
+    def clients(self):
+        return self._clients
+
+    def subscribe(self):
+        """Enregistre un client et démarre le producteur si nécessaire"""
+        with self._condition:
+            self._clients += 1
+            self._running = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._produce_loop, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unsubscribe(self):
+        """Désenregistre un client ; le producteur s'arrête sans client"""
+        with self._condition:
+            self._clients = max(0, self._clients - 1)
+            if self._clients == 0:
+                self._running = False
+                self._condition.notify_all()
+
+    def wait_frame(self, last_version, timeout=1.0):
+        """Attend une frame plus récente que `last_version`"""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._version != last_version or not self._running,
+                timeout=timeout
+            )
+            return self._version, self._frame
+
+    def frames(self):
+        """Générateur des frames successives pour un client"""
+        self.subscribe()
+        try:
+            version = 0
+            while True:
+                new_version, frame = self.wait_frame(version)
+                if new_version == version or frame is None:
+                    continue
+                if version and new_version > version + 1:
+                    DROPPED_FRAMES.inc(new_version - version - 1)
+                version = new_version
+                yield frame
+        finally:
+            self.unsubscribe()
+
+    def _produce_loop(self):
+        """Boucle du thread producteur, cadencée sur des échéances régulières"""
+        next_deadline = time.monotonic()
+        while True:
+            with self._condition:
+                if not self._running:
+                    self._thread = None
+                    return
+
+            try:
+                frame = self.produce_frame()
+            except Exception as e:
+                logger.error(f"Erreur lors de la production des frames ({self.name}): {e}")
+                frame = None
+                time.sleep(max(self.interval, 0.1))
+
+            if frame is not None:
+                with self._condition:
+                    self._frame = frame
+                    self._version += 1
+                    self.frames_produced += 1
+                    self.published_at = time.monotonic()
+                    self._condition.notify_all()
+
+            # Cadencement : on vise l'échéance suivante sans accumuler de retard
+            next_deadline += self.interval
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_deadline = time.monotonic()
+
+
+class EventBus:
+    """Diffuse les changements d'état (enregistrement, mouvement, fichiers) aux clients Server-Sent Events.
+
+    `publish` ne bloque jamais : chaque abonné fournit une fonction de
+    livraison non bloquante (file bornée d'un thread Flask ou file asyncio).
+    Les derniers événements sont conservés pour qu'un client reconnecté
+    reprenne après son `Last-Event-ID`.
+    """
+
+    KEEPALIVE_SECONDS = 15
+
+    def __init__(self, history=100):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._next_token = 0
+        self._history = deque(maxlen=history)
+        self._next_id = 1
+        self.published = 0
+
+    @property
+    def clients(self):
+        return len(self._subscribers)
+
+    def publish(self, kind, data):
+        """Publie un événement à tous les abonnés"""
+        with self._lock:
+            event = (self._next_id, kind, json.dumps(data))
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers.values())
+            self.published += 1
+        for deliver in subscribers:
+            try:
+                deliver(event)
+            except Exception as e:
+                logger.error(f"Erreur lors de la livraison d'un événement: {e}")
+
+    def subscribe(self, deliver, last_id=None):
+        """Abonne `deliver` ; retourne (jeton, événements manqués depuis `last_id`)"""
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subscribers[token] = deliver
+            missed = [event for event in self._history if last_id is not None and event[0] > last_id]
+        return token, missed
+
+    def unsubscribe(self, token):
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    @staticmethod
+    def format(event):
+        """Message au format text/event-stream"""
+        event_id, kind, data = event
+        return f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n"
+
+    def stream(self, last_id=None):
+        """Générateur text/event-stream pour un client (un thread par client avec Flask)"""
+        events = queue.Queue(maxsize=100)
+
+        def deliver(event):
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass  # Client bloqué : il se resynchronisera à la reconnexion
+
+        token, missed = self.subscribe(deliver, last_id)
+        try:
+            yield "retry: 3000\n\n"
+            for event in missed:
+                yield self.format(event)
+            while True:
+                try:
+                    yield self.format(events.get(timeout=self.KEEPALIVE_SECONDS))
+                except queue.Empty:
+                    # Commentaire périodique : détecte les clients partis
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(token)
+
+
+StreamProfile = namedtuple('StreamProfile', ['width', 'height', 'quality', 'fps'])
+
+
+class StreamHub:
+    """Partage la capture entre les profils de flux, un encodeur par profil actif.
+
+    Les frames brutes sont capturées une seule fois ; chaque profil utilisé
+    (résolution, qualité JPEG, images/s) a son propre encodeur partagé par
+    tous ses clients, supprimé dès qu'il n'a plus de client. Les profils
+    étant choisis par les clients, au plus `max_profiles` sont actifs en
+    même temps (un thread d'encodage chacun).
+    """
+
+    def __init__(self, capture_frame, annotate_frame, max_profiles=4):
+        self.annotate_frame = annotate_frame
+        self.max_profiles = max_profiles
+        self.source = FrameBroadcaster(capture_frame, interval=0, name='capture')
+        self._lock = threading.Lock()
+        self._encoders = {}  # profil -> [FrameBroadcaster, nombre de clients]
+
+    def accepts(self, profile):
+        """True si le profil est déjà actif ou peut encore être créé"""
+        with self._lock:
+            return profile in self._encoders or len(self._encoders) < self.max_profiles
+
+    def frames(self, profile, with_capture_time=False):
+        """Générateur des frames JPEG d'un profil pour un client (vide si trop de profils sont actifs)"""
+        with self._lock:
+            entry = self._encoders.get(profile)
+            if entry is None:
+                if len(self._encoders) >= self.max_profiles:
+                    logger.warning(f"Profil de flux refusé, {self.max_profiles} profils déjà actifs: {profile}")
+                    return
+                entry = [self._create_encoder(profile), 0]
+                self._encoders[profile] = entry
+                self._update_capture_rate()
+            entry[1] += 1
+
+        try:
+            for captured_at, jpeg in entry[0].frames():
+                yield (captured_at, jpeg) if with_capture_time else jpeg
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._encoders[profile]
+                    self.source.unsubscribe()
+                    self._update_capture_rate()
+
+    def _create_encoder(self, profile):
+        """Crée l'encodeur JPEG d'un profil, abonné à la capture"""
+        last_version = [0]
+
+        def encode():
+            version, frame = self.source.wait_frame(last_version[0])
+            if version == last_version[0] or frame is None:
+                return None
+            last_version[0] = version
+            captured_at = self.source.published_at
+
+            # La frame source est partagée : toujours travailler sur une copie
+            height, width = frame.shape[:2]
+            with STREAM_STAGE_SECONDS['resize'].time():
+                if (width, height) != (profile.width, profile.height):
+                    frame = cv2.resize(frame, (profile.width, profile.height), interpolation=cv2.INTER_AREA)
+                else:
+                    frame = frame.copy()
+
+            with STREAM_STAGE_SECONDS['overlay'].time():
+                self.annotate_frame(frame)
+            with STREAM_STAGE_SECONDS['encode'].time():
+                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, profile.quality])
+            return captured_at, buffer.tobytes()
+
+        self.source.subscribe()
+        name = f"stream-{profile.width}x{profile.height}-q{profile.quality}-{profile.fps}fps"
+        return FrameBroadcaster(encode, interval=1.0 / profile.fps, name=name)
+
+    def _update_capture_rate(self):
+        """Capture au rythme du profil le plus exigeant"""
+        if self._encoders:
+            self.source.interval = 1.0 / max(profile.fps for profile in self._encoders)
+
+    def get_stats(self):
+        """Retourne les profils actifs et leur nombre de clients"""
+        with self._lock:
+            return [{
+                'width': profile.width,
+                'height': profile.height,
+                'quality': profile.quality,
+                'fps': profile.fps,
+                'clients': clients,
+                'frames_encoded': broadcaster.frames_produced
+            } for profile, (broadcaster, clients) in self._encoders.items()]
+
+
+class OverlayLayer:
+    """Couche d'incrustation, redessinée uniquement quand sa clé change"""
+
+    def key(self, state):
+        """Valeur dont le changement impose de redessiner la couche"""
+        return None
+
+    def draw(self, canvas, mask, state):
+        """Dessine la couche sur `canvas` (couleurs) et `mask` (pixels couverts)"""
+        raise NotImplementedError
+
+    @staticmethod
+    def put_text(canvas, mask, text, origin, scale, color, thickness):
+        cv2.putText(canvas, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+        cv2.putText(mask, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness)
+
+
+class TimestampLayer(OverlayLayer):
+    """Date et heure, en haut à gauche"""
+
+    def key(self, state):
+        return int(state['time'])
+
+    def draw(self, canvas, mask, state):
+        timestamp = datetime.fromtimestamp(int(state['time'])).strftime("%Y-%m-%d %H:%M:%S")
+        self.put_text(canvas, mask, timestamp, (10, 30), 0.7, (255, 255, 255), 2)
+
+
+class RecordingLayer(OverlayLayer):
+    """Indicateur REC, en haut à droite"""
+
+    def key(self, state):
+        return state['recording']
+
+    def draw(self, canvas, mask, state):
+        if not state['recording']:
+            return
+        width = canvas.shape[1]
+        self.put_text(canvas, mask, "REC", (width - 80, 30), 0.7, (0, 0, 255), 2)
+        cv2.circle(canvas, (width - 100, 25), 5, (0, 0, 255), -1)
+        cv2.circle(mask, (width - 100, 25), 5, 255, -1)
+
+
+class MotionStatusLayer(OverlayLayer):
+    """État de la détection de mouvement, en bas à gauche"""
+
+    def key(self, state):
+        return state['motion_active'], state['motion_detected']
+
+    def draw(self, canvas, mask, state):
+        if not state['motion_active']:
+            return
+        status = "MOTION DETECTED" if state['motion_detected'] else "MONITORING"
+        color = (0, 255, 0) if state['motion_detected'] else (255, 255, 0)
+        self.put_text(canvas, mask, status, (10, canvas.shape[0] - 20), 0.5, color, 1)
+
+
+class TextLayer(OverlayLayer):
+    """Texte fixe (nom de la caméra...), position en pixels"""
+
+    def __init__(self, text, position=(10, 60), scale=0.6, color=(255, 255, 255), thickness=1):
+        self.text = text
+        self.position = tuple(position)
+        self.scale = scale
+        self.color = tuple(color)
+        self.thickness = thickness
+
+    def draw(self, canvas, mask, state):
+        self.put_text(canvas, mask, self.text, self.position, self.scale, self.color, self.thickness)
+
+
+class ZonesLayer(OverlayLayer):
+    """Contours de zones, coordonnées relatives (0 à 1) à la taille de l'image"""
+
+    def __init__(self, zones, color=(0, 255, 255), thickness=1):
+        self.zones = zones
+        self.color = tuple(color)
+        self.thickness = thickness
+
+    def draw(self, canvas, mask, state):
+        height, width = canvas.shape[:2]
+        polygons = [np.array([(x * width, y * height) for x, y in zone], dtype=np.int32)
+                    for zone in self.zones]
+        cv2.polylines(canvas, polygons, True, self.color, self.thickness)
+        cv2.polylines(mask, polygons, True, 255, self.thickness)
+
+
+OVERLAY_LAYER_TYPES = {
+    'timestamp': TimestampLayer,
+    'recording': RecordingLayer,
+    'motion': MotionStatusLayer,
+    'text': TextLayer,
+    'zones': ZonesLayer
+}
+
+
+def build_overlay_layers(specs):
+    """Construit les couches à partir de la configuration, ex. {'type': 'text', 'text': 'Entrée'}"""
+    layers = []
+    for spec in specs:
+        options = dict(spec)
+        layer_type = options.pop('type')
+        layers.append(OVERLAY_LAYER_TYPES[layer_type](**options))
+    return layers
+
+
+class OverlayCompositor:
+    """Applique des couches d'incrustation mises en cache.
+
+    Chaque couche n'est rastérisée que lorsque sa clé (seconde courante,
+    état d'enregistrement ou de mouvement...) ou la taille de l'image
+    change ; seul le rectangle qu'elle couvre est conservé puis recopié
+    (via son masque) sur chaque frame, sans aucun rendu de texte par frame.
+    """
+
+    MAX_CACHE_ENTRIES = 64
+
+    def __init__(self, layers):
+        self.layers = layers
+        self._cache = {}  # (index de couche, forme de l'image) -> (clé, rectangle, patch, masque)
+        self.renders = 0
+
+    def apply(self, frame, state):
+        """Incruste toutes les couches sur `frame` (modifiée sur place)"""
+        for index, layer in enumerate(self.layers):
+            key = layer.key(state)
+            cache_key = (index, frame.shape)
+            cached = self._cache.get(cache_key)
+            if cached is None or cached[0] != key:
+                if len(self._cache) >= self.MAX_CACHE_ENTRIES:
+                    self._cache.clear()
+                cached = (key,) + self._rasterize(layer, frame.shape, state)
+                self._cache[cache_key] = cached
+
+            _, (x, y, width, height), patch, patch_mask = cached
+            if width and height:
+                cv2.copyTo(patch, patch_mask, frame[y:y + height, x:x + width])
+
+    def _rasterize(self, layer, shape, state):
+        """Dessine une couche et retourne le rectangle couvert, son contenu et son masque"""
+        canvas = np.zeros(shape, dtype=np.uint8)
+        mask = np.zeros(shape[:2], dtype=np.uint8)
+        layer.draw(canvas, mask, state)
+        self.renders += 1
+
+        x, y, width, height = cv2.boundingRect(mask)
+        patch = canvas[y:y + height, x:x + width].copy()
+        patch_mask = mask[y:y + height, x:x + width].copy()
+        return (x, y, width, height), patch, patch_mask
+
+
+class MotionDetector:
+    """Détection de mouvement sur un modèle de fond moyenné, par zones, avec hystérésis.
+
+    Le fond est une moyenne glissante des images (cv2.accumulateWeighted) ;
+    une frame est « active » si une zone dépasse son seuil de pixels
+    modifiés. L'état de mouvement ne s'enclenche qu'après
+    `motion_trigger_frames` frames actives consécutives et ne retombe
+    qu'après `motion_release_seconds` sans activité (au-dessus d'un seuil
+    de relâchement plus bas) et au moins `motion_min_event_seconds` de
+    durée. Un changement d'éclairage global réinitialise le fond.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.background = None
+        self._zone_masks = None
+        self._zone_shape = None
+        self.active = False
+        self._consecutive = 0
+        self._event_started = None
+        self._last_activity = None
+        self.last_pixels = {}
+        self.last_bbox = None  # Boîte englobante relative (x1, y1, x2, y2) des pixels modifiés
+        self.last_score = None  # Pixels modifiés / seuil de déclenchement, pour la zone la plus active
+        self.stats = {'last_ms': 0.0, 'average_ms': 0.0, 'max_ms': 0.0, 'frames': 0, 'lighting_resets': 0}
+
+    def reset(self):
+        """Oublie le fond et l'état courant"""
+        self.background = None
+        self.active = False
+        self._consecutive = 0
+        self._event_started = None
+
+    def _zones(self, shape):
+        """Zones (nom, masque ou None pour l'image entière, seuil) à la taille analysée"""
+        if self._zone_shape != shape:
+            height, width = shape
+            zones = []
+            for zone in self.config['motion_zones']:
+                mask = np.zeros(shape, dtype=np.uint8)
+                polygon = np.array([(x * width, y * height) for x, y in zone['polygon']], dtype=np.int32)
+                cv2.fillPoly(mask, [polygon], 255)
+                zones.append((zone.get('name', f'zone{len(zones) + 1}'), mask, zone.get('threshold')))
+            self._zone_masks = zones or [('global', None, None)]
+            self._zone_shape = shape
+        return self._zone_masks
+
+    def process(self, gray, timestamp=None):
+        """Analyse une frame en niveaux de gris et retourne l'état de mouvement"""
+        started = time.perf_counter()
+        now = time.monotonic() if timestamp is None else timestamp
+
+        # Lissage léger contre le bruit du capteur
+        measured = self.measure(cv2.GaussianBlur(gray, (3, 3), 0))
+        self.last_bbox = None
+        self.last_score = None
+        if measured is None:
+            self._record_time(started)
+            return self.active
+        pixels, thresh = measured
+        self.last_pixels = pixels
+        if self.decide(pixels, thresh.shape, now):
+            x, y, width, height = cv2.boundingRect(thresh)
+            rows, columns = thresh.shape
+            self.last_bbox = (round(x / columns, 3), round(y / rows, 3),
+                              round((x + width) / columns, 3), round((y + height) / rows, 3))
+
+        self._record_time(started)
+        return self.active
+
+    def measure(self, blurred):
+        """Compare une frame lissée au fond et le met à jour.
+
+        Retourne (pixels modifiés par zone, masque binaire), ou None si le
+        fond vient d'être (ré)initialisé. Ne dépend que des paramètres de
+        pixel (`motion_pixel_threshold`, `motion_learning_rate`,
+        `motion_lighting_ratio`), pas des seuils de déclenchement.
+        """
+        config = self.config
+        if self.background is None or self.background.shape != blurred.shape:
+            self.background = blurred.astype(np.float32)
+            return None
+
+        # Pixels qui s'écartent du fond
+        frame_diff = cv2.absdiff(blurred, cv2.convertScaleAbs(self.background))
+        _, thresh = cv2.threshold(frame_diff, config['motion_pixel_threshold'], 255, cv2.THRESH_BINARY)
+
+        # Mise à jour du fond (moyenne glissante) : rapide sur les pixels de fond,
+        # lente sur les pixels en mouvement pour ne pas laisser de traînée, mais
+        # assez pour absorber un objet qui s'immobilise
+        learning_rate = config['motion_learning_rate']
+        cv2.accumulateWeighted(blurred, self.background, learning_rate / 10)
+        cv2.accumulateWeighted(blurred, self.background, learning_rate, mask=cv2.bitwise_not(thresh))
+
+        changed = cv2.countNonZero(thresh)
+        if changed > thresh.size * config['motion_lighting_ratio']:
+            # Variation globale (éclairage, exposition) : on repart du fond courant
+            self.background = blurred.astype(np.float32)
+            self.stats['lighting_resets'] += 1
+            return None
+
+        pixels = {}
+        for name, mask, threshold in self._zones(thresh.shape):
+            pixels[name] = changed if mask is None else cv2.countNonZero(cv2.bitwise_and(thresh, mask))
+        return pixels, thresh
+
+    def decide(self, pixels, shape, now):
+        """Applique les seuils par zone et l'hystérésis ; retourne True si la frame est active"""
+        config = self.config
+
+        # Seuils par zone, exprimés en pixels à 640x480 et ramenés à la taille analysée
+        ref_width, ref_height = MOTION_THRESHOLD_REFERENCE_SIZE
+        scale = shape[0] * shape[1] / (ref_width * ref_height)
+        release_ratio = config['motion_release_ratio'] if self.active else 1.0
+        frame_active = False
+        score = 0.0
+        for name, mask, threshold in self._zones(shape):
+            limit = (threshold or config['motion_threshold']) * scale
+            score = max(score, pixels[name] / limit)
+            if pixels[name] > limit * release_ratio:
+                frame_active = True
+        self.last_score = score
+
+        # Hystérésis : déclenchement et relâchement
+        if frame_active:
+            self._consecutive += 1
+            self._last_activity = now
+            if not self.active and self._consecutive >= config['motion_trigger_frames']:
+                self.active = True
+                self._event_started = now
+        else:
+            self._consecutive = 0
+            if (self.active
+                    and now - self._last_activity >= config['motion_release_seconds']
+                    and now - self._event_started >= config['motion_min_event_seconds']):
+                self.active = False
+                self._event_started = None
+        return frame_active
+
+    def _record_time(self, started):
+        """Met à jour les statistiques de temps de traitement par frame"""
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats = self.stats
+        stats['frames'] += 1
+        stats['last_ms'] = round(elapsed_ms, 3)
+        stats['max_ms'] = round(max(stats['max_ms'], elapsed_ms), 3)
+        # Moyenne glissante exponentielle
+        stats['average_ms'] = round(stats['average_ms'] * 0.95 + elapsed_ms * 0.05
+                                    if stats['frames'] > 1 else elapsed_ms, 3)
+
+    def get_stats(self):
+        return dict(self.stats, active=self.active, pixels=self.last_pixels)
+
+
+class MotionScheduler:
+    """Cadence adaptative des analyses de mouvement, pilotée par les frames de la caméra.
+
+    Au repos, une frame est examinée toutes les `motion_idle_interval`
+    secondes, sous-échantillonnée `motion_idle_downscale` fois de plus et
+    comparée à la précédente : le détecteur complet n'est lancé que si
+    l'écart dépasse `motion_candidate_ratio` du seuil, ou toutes les
+    `motion_background_refresh` secondes pour que le fond suive
+    l'éclairage. Au premier candidat, l'intervalle passe immédiatement à
+    `motion_active_interval` ; après `motion_backoff_delay` secondes sans
+    activité, il s'allonge à chaque analyse selon `motion_backoff_curve`
+    ('exponential' : × `motion_backoff_factor`, 'linear' : +
+    `motion_backoff_step`) jusqu'à l'intervalle de repos. Sans
+    `motion_adaptive`, l'intervalle reste `motion_check_interval`.
+
+    `on_frame` est appelé à chaque frame (post_callback de Picamera2) et
+    réveille le thread d'analyse via `ready` quand une analyse est due.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.adaptive = config['motion_adaptive']
+        if self.adaptive:
+            self.min_interval = config['motion_active_interval']
+            self.max_interval = config['motion_idle_interval']
+        else:
+            self.min_interval = self.max_interval = config['motion_check_interval']
+        # Une demi-frame de tolérance : l'analyse tombe sur la frame la plus proche de l'échéance
+        self._tolerance = 0.5 / config['framerate']
+        # Seuil le plus bas (global ou zones), en pixels à 640x480
+        self._candidate_threshold = config['motion_candidate_ratio'] * min(
+            [zone['threshold'] for zone in config['motion_zones'] if zone.get('threshold')]
+            + [config['motion_threshold']])
+        self.ready = threading.Event()
+        self.reset()
+
+    def reset(self, now=None):
+        """Repart au rythme de repos (démarrage de la détection)"""
+        self.interval = self.max_interval
+        self._started = time.monotonic() if now is None else now
+        self._last_check = None
+        self._last_full = None
+        self._last_activity = None
+        self._reference = None
+        self._last_frame = None
+        self.ready.clear()
+        self.stats = {'frames': 0, 'checks': 0, 'full_checks': 0, 'candidates': 0,
+                      'cpu_seconds': 0.0, 'full_cpu_seconds': 0.0}
+
+    def time_until_due(self, now):
+        if self._last_check is None:
+            return 0.0
+        return max(0.0, self._last_check + self.interval - self._tolerance - now)
+
+    def due(self, now):
+        return self.time_until_due(now) == 0.0
+
+    def frame_driven(self, now):
+        """True si la caméra appelle on_frame (callback reçu récemment)"""
+        return self._last_frame is not None and now - self._last_frame < 0.5
+
+    def on_frame(self, now=None):
+        """Frame disponible (callback de la caméra) : réveille l'analyse si elle est due"""
+        now = time.monotonic() if now is None else now
+        self._last_frame = now
+        self.stats['frames'] += 1
+        if self.due(now):
+            self.ready.set()
+
+    def begin_check(self, gray, now):
+        """Enregistre une analyse ; retourne True si le détecteur complet doit tourner"""
+        self._last_check = now
+        self.stats['checks'] += 1
+        if not self.adaptive:
+            self.stats['full_checks'] += 1
+            return True
+
+        if self._last_activity is None or now - self._last_activity >= self.config['motion_backoff_delay']:
+            if self.config['motion_backoff_curve'] == 'linear':
+                interval = self.interval + self.config['motion_backoff_step']
+            else:
+                interval = self.interval * self.config['motion_backoff_factor']
+            self.interval = min(interval, self.max_interval)
+
+        # Au repos, comparaison grossière ; au premier candidat, cadence maximale
+        if self.interval < self.max_interval:
+            self._reference = None
+        elif self._is_candidate(gray):
+            self.stats['candidates'] += 1
+            self.observe(True, now)
+
+        # Détecteur complet hors du repos, sur un candidat, ou pour rafraîchir le fond
+        full = (self.interval < self.max_interval or self._last_full is None
+                or now - self._last_full >= self.config['motion_background_refresh'])
+        if full:
+            self._last_full = now
+            self.stats['full_checks'] += 1
+        return full
+
+    def _is_candidate(self, gray):
+        """Comparaison grossière avec la frame examinée précédemment"""
+        step = self.config['motion_idle_downscale']
+        coarse = np.ascontiguousarray(gray[::step, ::step]) if step > 1 else gray.copy()
+        reference, self._reference = self._reference, coarse
+        if reference is None or reference.shape != coarse.shape:
+            return False
+
+        _, changed = cv2.threshold(cv2.absdiff(coarse, reference), self.config['motion_pixel_threshold'],
+                                   255, cv2.THRESH_BINARY)
+        ref_width, ref_height = MOTION_THRESHOLD_REFERENCE_SIZE
+        scale = coarse.shape[0] * coarse.shape[1] / (ref_width * ref_height)
+        return cv2.countNonZero(changed) > self._candidate_threshold * scale
+
+    def observe(self, active, now):
+        """Activité constatée (candidat ou frame active du détecteur) : cadence maximale"""
+        if active:
+            self._last_activity = now
+            self.interval = self.min_interval
+
+    def record_cpu(self, full, seconds):
+        """Temps CPU d'une analyse (capture incluse)"""
+        self.stats['cpu_seconds'] += seconds
+        if full:
+            self.stats['full_cpu_seconds'] += seconds
+
+    def get_stats(self, now=None):
+        """Cadence courante et CPU économisé par rapport à une analyse complète à cadence maximale"""
+        stats = self.stats
+        now = time.monotonic() if now is None else now
+        elapsed = max(now - self._started, 1e-6)
+        cpu_ms_per_s = stats['cpu_seconds'] / elapsed * 1000
+        baseline = None
+        if stats['full_checks'] and self.min_interval > 0:
+            baseline = stats['full_cpu_seconds'] / stats['full_checks'] / self.min_interval * 1000
+        return {
+            'adaptive': self.adaptive,
+            'frame_driven': self.frame_driven(now),
+            'interval_s': round(self.interval, 3),
+            'rate_hz': round(1 / self.interval, 2) if self.interval > 0 else None,
+            'frames': stats['frames'],
+            'checks': stats['checks'],
+            'full_checks': stats['full_checks'],
+            'candidates': stats['candidates'],
+            'checks_per_s': round(stats['checks'] / elapsed, 2),
+            'cpu_ms_per_s': round(cpu_ms_per_s, 3),
+            'baseline_cpu_ms_per_s': round(baseline, 3) if baseline is not None else None,
+            'cpu_saved_percent': round(100 * (1 - cpu_ms_per_s / baseline), 1) if baseline else None
+        }
+
+
+class BitratePolicy:
+    """Débit H.264 des enregistrements adapté à l'activité de la scène.
+
+    Le score de mouvement (pixels modifiés / seuil) est retenu comme un pic
+    qui décroît linéairement sur `bitrate_motion_window` secondes. Le débit
+    est interpolé entre `bitrate * bitrate_min_ratio` (scène calme) et
+    `bitrate` (pic au niveau du seuil). Sans mesure récente (détection
+    arrêtée), le débit maximal est conservé. Picamera2 ne change pas le
+    débit d'un encodeur en marche : `needs_restart` indique quand l'écart
+    (au moins `bitrate_restart_step` du maximum) justifie de le redémarrer.
+    """
+
+    def __init__(self, config):
+        self.adaptive = config['bitrate_adaptive']
+        self.min_ratio = config['bitrate_min_ratio']
+        self.window = config['bitrate_motion_window']
+        self.restart_step = config['bitrate_restart_step']
+        self._peak = 0.0
+        self._peak_time = None
+        self._last_observed = None
+        self.last_bitrate = None
+
+    def observe(self, score, now=None):
+        """Score de mouvement d'une frame analysée (None si le fond vient d'être réinitialisé)"""
+        if score is None:
+            return
+        now = time.monotonic() if now is None else now
+        self._last_observed = now
+        if score >= self.level(now):
+            self._peak, self._peak_time = score, now
+
+    def level(self, now=None):
+        """Activité récente, de 0 (calme) à 1 (seuil atteint)"""
+        if self._peak_time is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        age = now - self._peak_time
+        if age >= self.window:
+            return 0.0
+        return min(self._peak * (1 - age / self.window), 1.0)
+
+    def target(self, maximum, now=None):
+        """Débit adapté à l'activité actuelle"""
+        now = time.monotonic() if now is None else now
+        if not self.adaptive or self._last_observed is None or now - self._last_observed > self.window:
+            return maximum
+        return int(maximum * (self.min_ratio + (1 - self.min_ratio) * self.level(now)))
+
+    def choose(self, maximum, now=None):
+        """Débit à donner à un encodeur qui démarre"""
+        self.last_bitrate = self.target(maximum, now)
+        return self.last_bitrate
+
+    def needs_restart(self, current, maximum, now=None):
+        """True si un encodeur au débit `current` est trop loin du débit visé"""
+        return self.adaptive and abs(self.target(maximum, now) - current) >= self.restart_step * maximum
+
+    def get_stats(self):
+        return {'adaptive': self.adaptive, 'level': round(self.level(), 3), 'last_bitrate': self.last_bitrate}
+
+
+class SharedFrameRing:
+    """Buffer circulaire de frames en niveaux de gris en mémoire partagée.
+
+    Chaque emplacement a un en-tête (séquence de début, séquence de fin,
+    timestamp) : l'écrivain met à jour la séquence de début, les pixels,
+    puis la séquence de fin ; le lecteur copie la frame et vérifie que les
+    deux séquences correspondent toujours, sinon elle a été écrasée pendant
+    la lecture. Seuls des numéros de séquence transitent entre processus.
+    """
+
+    def __init__(self, shape, slots=4):
+        self.shape = tuple(shape)
+        self.slots = slots
+        header_bytes = slots * 3 * 8
+        self._shm = shared_memory.SharedMemory(create=True, size=header_bytes + slots * self.shape[0] * self.shape[1])
+        self._map()
+        self.header[:] = -1
+        self.sequence = 0
+
+    def _map(self):
+        """Vues numpy sur la mémoire partagée"""
+        header_bytes = self.slots * 3 * 8
+        self.header = np.ndarray((self.slots, 3), dtype=np.float64, buffer=self._shm.buf)
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=self._shm.buf,
+                                 offset=header_bytes)
+
+    def __getstate__(self):
+        # Transmis au processus d'analyse par son nom : les pixels ne sont pas copiés
+        return {'shape': self.shape, 'slots': self.slots, 'name': self._shm.name, 'sequence': self.sequence}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.slots = state['slots']
+        self.sequence = state['sequence']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._map()
+
+    def write(self, gray, timestamp):
+        """Copie une frame dans l'emplacement suivant et retourne son numéro de séquence"""
+        self.sequence += 1
+        slot = self.header[self.sequence % self.slots]
+        slot[0] = self.sequence
+        self.frames[self.sequence % self.slots] = gray
+        slot[2] = timestamp
+        slot[1] = self.sequence
+        return self.sequence
+
+    def read(self, sequence):
+        """Retourne (frame, timestamp), ou None si l'emplacement a été réécrit"""
+        slot = self.header[sequence % self.slots]
+        if slot[1] != sequence:
+            return None
+        frame = self.frames[sequence % self.slots].copy()
+        timestamp = slot[2]
+        if slot[0] != sequence:
+            return None
+        return frame, timestamp
+
+    def close(self):
+        """Libère la mémoire partagée (appelé par le processus créateur)"""
+        self.header = None
+        self.frames = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _motion_worker_main(ring, config, sequences, events, stop_event, counters):
+    """Boucle du processus d'analyse : lit les frames du buffer partagé et renvoie les événements"""
+    # Le processus parent gère les signaux ; un seul thread OpenCV pour laisser les cœurs au flux
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    cv2.setNumThreads(0)
+    
+    detector = MotionDetector(config)
+    state = False
+    last_report = time.monotonic()
+    while not stop_event.is_set():
+        try:
+            sequence = sequences.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        
+        # N'analyser que la frame la plus récente si le processus a pris du retard
+        while True:
+            try:
+                sequence = sequences.get_nowait()
+                counters[1] += 1
+            except queue.Empty:
+                break
+        
+        item = ring.read(sequence)
+        if item is None:
+            counters[1] += 1
+            continue
+        gray, timestamp = item
+        active = detector.process(gray, timestamp)
+        counters[0] += 1
+        
+        now = time.monotonic()
+        # Chaque frame en mouvement est remontée (pic et boîte englobante de l'événement)
+        if active or active != state or now - last_report >= 1.0:
+            events.put({
+                'motion': active,
+                'changed': active != state,
+                'pixels': max(detector.last_pixels.values(), default=0),
+                'bbox': detector.last_bbox,
+                'score': detector.last_score,
+                'detector': detector.get_stats()
+            })
+            state = active
+            last_report = now
+
+
+class MotionWorker:
+    """Analyse de mouvement dans un processus séparé.
+
+    Les frames sont copiées dans un SharedFrameRing ; le processus d'analyse
+    exécute MotionDetector et renvoie les changements d'état et les frames en
+    mouvement, plus un bilan chaque seconde, par une file. Un thread du
+    processus principal les transmet à `on_event`. Le processus est lancé
+    par un forkserver (spawn à défaut) et non par fork : le processus
+    principal a déjà des threads, dont les verrous ne doivent pas être hérités.
+    """
+
+    def __init__(self, config, on_event, slots=4):
+        self.config = config
+        self.on_event = on_event
+        self.slots = slots
+        self.ring = None
+        self.process = None
+        self.submitted = 0
+        self.dropped = 0
+        self.last_event = None
+        self._sequences = None
+        self._events = None
+        self._stop_event = None
+        self._listener = None
+        self._counters = None  # Frames analysées, frames sautées (mémoire partagée)
+
+    def start(self, shape):
+        """Crée le buffer partagé et lance le processus d'analyse"""
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.ring = SharedFrameRing(shape, self.slots)
+        self._sequences = context.Queue(maxsize=self.slots)
+        self._events = context.Queue()
+        self._stop_event = context.Event()
+        self._counters = context.Array('Q', 2, lock=False)
+        self.process = context.Process(target=_motion_worker_main, name='motion-worker',
+                                       args=(self.ring, dict(self.config), self._sequences,
+                                             self._events, self._stop_event, self._counters))
+        self.process.daemon = True
+        self.process.start()
+        
+        self._listener = threading.Thread(target=self._listen, name='motion-worker-events')
+        self._listener.daemon = True
+        self._listener.start()
+        logger.info(f"Processus d'analyse de mouvement démarré (pid {self.process.pid})")
+
+    def submit(self, gray):
+        """Publie une frame pour analyse, sans attendre le processus"""
+        if self.process is None:
+            self.start(gray.shape)
+        sequence = self.ring.write(gray, time.monotonic())
+        self.submitted += 1
+        try:
+            self._sequences.put_nowait(sequence)
+        except queue.Full:
+            self.dropped += 1
+
+    def _listen(self):
+        """Relaie les événements du processus d'analyse"""
+        while self.process is not None:
+            try:
+                event = self._events.get(timeout=0.5)
+            except (queue.Empty, OSError, EOFError, ValueError):
+                continue
+            self.last_event = event
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.error(f"Erreur lors du traitement d'un événement de mouvement: {e}")
+
+    def stop(self):
+        """Arrête le processus d'analyse et libère la mémoire partagée"""
+        process = self.process
+        if process is None:
+            return
+        self._stop_event.set()
+        process.join(timeout=2)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=1)
+        self.process = None
+        self._listener.join(timeout=1)
+        for channel in (self._sequences, self._events):
+            channel.cancel_join_thread()
+            channel.close()
+        self.ring.close()
+        self.ring = None
+        logger.info("Processus d'analyse de mouvement arrêté")
+
+    def get_stats(self):
+        counters = self._counters or (0, 0)
+        return {
+            'pid': self.process.pid if self.process else None,
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'processed': counters[0],
+            'skipped': counters[1]
+        }
+
+
+class WriteBehindFile(io.BufferedIOBase):
+    """Fichier en écriture différée pour les enregistrements sur carte SD.
+
+    write() copie les données dans un buffer mémoire borné et rend la main ;
+    un thread dédié les écrit par blocs de `chunk_bytes` (multiples de 4 Kio,
+    donc alignés dans le fichier) et regroupe les fsync tous les
+    `fsync_bytes` octets ou `fsync_seconds` secondes. Un ralentissement de
+    la carte est absorbé par le buffer au lieu de bloquer l'encodeur ;
+    au-delà de `max_bytes`, write() attend le thread d'écriture (compté
+    dans les statistiques, comme les écritures lentes).
+    """
+
+    ALIGN = 4096
+    STALL_SECONDS = 0.25  # Écriture ou fsync considéré comme un blocage de la carte
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, chunk_bytes=1024 * 1024,
+                 fsync_bytes=8 * 1024 * 1024, fsync_seconds=2.0):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.chunk_bytes = max(chunk_bytes // self.ALIGN, 1) * self.ALIGN
+        self.fsync_bytes = fsync_bytes
+        self.fsync_seconds = fsync_seconds
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._queued_bytes = 0    # En attente du thread d'écriture
+        self._buffered_bytes = 0  # Pas encore sur la carte (file + bloc en préparation)
+        self._closing = False
+        self.error = None
+        self.stats = {'high_water_bytes': 0, 'writes': 0, 'bytes_written': 0, 'max_write_ms': 0.0,
+                      'fsyncs': 0, 'max_fsync_ms': 0.0, 'stalls': 0, 'producer_waits': 0, 'producer_wait_ms': 0.0}
+        self._thread = threading.Thread(target=self._run, name='write-behind')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        size = len(data)
+        with self._condition:
+            if self.error is not None or self._closing:
+                return size  # Carte en erreur : données abandonnées (erreur déjà journalisée)
+            if self._buffered_bytes and self._buffered_bytes + size > self.max_bytes:
+                # Buffer plein : dernier recours, on attend la carte
+                waited = time.perf_counter()
+                self.stats['producer_waits'] += 1
+                while self._buffered_bytes and self._buffered_bytes + size > self.max_bytes and self.error is None:
+                    self._condition.wait()
+                self.stats['producer_wait_ms'] = round(self.stats['producer_wait_ms']
+                                                       + (time.perf_counter() - waited) * 1000, 1)
+            self._queue.append(bytes(data))
+            self._queued_bytes += size
+            self._buffered_bytes += size
+            self.stats['high_water_bytes'] = max(self.stats['high_water_bytes'], self._buffered_bytes)
+            if self._queued_bytes >= self.chunk_bytes:
+                self._condition.notify_all()
+        return size
+
+    def flush(self):
+        """Rien à attendre : FileOutput appelle flush() après chaque frame"""
+
+    def close(self):
+        """Écrit le reste du buffer, fsync, puis ferme le fichier"""
+        if self.closed:
+            return
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        os.close(self._fd)
+        super().close()
+
+    def _run(self):
+        """Thread d'écriture : gros blocs alignés, fsync groupés"""
+        block = bytearray()
+        last_write = last_fsync = time.monotonic()
+        unsynced = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closing or self._queued_bytes >= self.chunk_bytes,
+                                         timeout=self.fsync_seconds)
+                closing = self._closing
+                while self._queue:
+                    block += self._queue.popleft()
+                self._queued_bytes = 0
+            
+            now = time.monotonic()
+            if closing:
+                size = len(block)
+            elif len(block) >= self.chunk_bytes:
+                size = len(block) // self.chunk_bytes * self.chunk_bytes
+            elif now - last_write >= self.fsync_seconds:
+                # Débit faible : on écrit quand même ce qui remplit des blocs de 4 Kio
+                size = len(block) // self.ALIGN * self.ALIGN
+            else:
+                size = 0
+            
+            try:
+                if size and self.error is None:
+                    self._write(memoryview(block)[:size])
+                    unsynced += size
+                    last_write = now
+                if unsynced and (closing or unsynced >= self.fsync_bytes or now - last_fsync >= self.fsync_seconds):
+                    self._timed('fsync', os.fsync, self._fd)
+                    unsynced = 0
+                    last_fsync = time.monotonic()
+            except OSError as e:
+                self.error = e
+                unsynced = 0
+                # Bloc abandonné (remplacé : le traceback garde des vues sur l'ancien)
+                size = len(block)
+                block = bytearray()
+                logger.error(f"Erreur d'écriture de {self.path}: {e}")
+            if size:
+                del block[:size]
+                with self._condition:
+                    self._buffered_bytes -= size
+                    self._condition.notify_all()
+            if closing:
+                return
+
+    def _write(self, view):
+        """Écrit tout le bloc (os.write peut écrire partiellement)"""
+        while len(view):
+            written = self._timed('write', os.write, self._fd, view)
+            view = view[written:]
+            self.stats['writes'] += 1
+            self.stats['bytes_written'] += written
+
+    def _timed(self, operation, function, *args):
+        """Exécute une écriture ou un fsync en mesurant sa durée"""
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - started
+        RECORD_IO_SECONDS[operation].observe(elapsed)
+        key = 'max_write_ms' if operation == 'write' else 'max_fsync_ms'
+        self.stats[key] = round(max(self.stats[key], elapsed * 1000), 3)
+        if operation == 'fsync':
+            self.stats['fsyncs'] += 1
+        if elapsed >= self.STALL_SECONDS:
+            self.stats['stalls'] += 1
+            RECORD_IO_STALLS.inc()
+            logger.warning(f"Carte SD lente: {operation} de {elapsed * 1000:.0f} ms sur {os.path.basename(self.path)}")
+        return result
+
+    def get_stats(self):
+        with self._condition:
+            buffered = self._buffered_bytes
+        writes = self.stats['writes']
+        return dict(self.stats, buffered_bytes=buffered, max_bytes=self.max_bytes, chunk_bytes=self.chunk_bytes,
+                    average_write_bytes=self.stats['bytes_written'] // writes if writes else 0,
+                    error=str(self.error) if self.error else None)
+
+
+class PreRollOutput(Output):
+    """Sortie H.264 qui garde en mémoire les dernières secondes encodées.
+
+    Le buffer circulaire est borné en durée et en octets. `start_file` y vide
+    le buffer (à partir de la première image clé) puis écrit le flux en direct
+    dans le fichier, de sorte que l'enregistrement commence avant l'événement.
+    """
+
+    def __init__(self, seconds=3, max_bytes=8 * 1024 * 1024):
+        super().__init__()
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._frames = deque()  # (timestamp en µs, image clé, données)
+        self._keyframes = deque()  # Timestamps des images clés présentes
+        self._buffered_bytes = 0
+        self._file = None
+        self._file_bytes = 0
+        self._writing = False  # Première image clé écrite dans le fichier en cours
+        self._keyframe_index = None
+        self._on_first_frame = None
+        self.peak_bytes = 0
+        self.keep_open = False  # Encodeur redémarré (changement de débit) : stop() ne ferme rien
+        self.last_keyframe_at = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        """Reçoit une frame encodée du H264Encoder"""
+        if timestamp is None:
+            timestamp = int(time.monotonic() * 1000000)
+        data = bytes(frame)  # Le buffer de l'encodeur est réutilisé
+        if keyframe:
+            self.last_keyframe_at = time.monotonic()
+
+        with self._lock:
+            # Un fichier H.264 lisible doit commencer par une image clé : sans image clé
+            # dans le buffer, les frames en direct sont ignorées jusqu'à la suivante
+            if self._file is not None and (self._writing or keyframe):
+                self._writing = True
+                self._write(data, keyframe, timestamp)
+                RECORDED_BYTES.inc(len(data))
+                self._notify_first_frame()
+
+            self._frames.append((timestamp, keyframe, data))
+            self._buffered_bytes += len(data)
+            if keyframe:
+                self._keyframes.append(timestamp)
+
+            # Limite mémoire stricte
+            while self._frames and self._buffered_bytes > self.max_bytes:
+                self._pop_frame()
+
+            # Limite en durée : un GOP n'est retiré que si le suivant couvre encore la durée
+            max_age = self.seconds * 1000000
+            while len(self._keyframes) > 1 and timestamp - self._keyframes[1] >= max_age:
+                next_gop = self._keyframes[1]
+                while self._frames[0][0] < next_gop:
+                    self._pop_frame()
+
+            self.peak_bytes = max(self.peak_bytes, self._buffered_bytes)
+
+    def _pop_frame(self):
+        """Retire la frame la plus ancienne du buffer"""
+        timestamp, keyframe, data = self._frames.popleft()
+        self._buffered_bytes -= len(data)
+        if keyframe and self._keyframes and self._keyframes[0] == timestamp:
+            self._keyframes.popleft()
+
+    def _write(self, data, keyframe, timestamp):
+        """Écrit une frame dans le fichier en cours en indexant les images clés"""
+        if keyframe and self._keyframe_index is not None:
+            self._keyframe_index.add(self._file_bytes, timestamp)
+        self._file.write(data)
+        self._file_bytes += len(data)
+
+    def _notify_first_frame(self):
+        """Signale la première frame écrite dans le fichier en cours"""
+        if self._on_first_frame is not None:
+            callback, self._on_first_frame = self._on_first_frame, None
+            callback()
+
+    def start_file(self, file, on_first_frame=None, keyframe_index=None):
+        """Vide le buffer dans `file` (fichier ouvert, ex. WriteBehindFile) puis y écrit le flux en direct"""
+        with self._lock:
+            self._file = file
+            self._file_bytes = 0
+            self._keyframe_index = keyframe_index
+            self._on_first_frame = on_first_frame
+
+            # Le buffer est vidé à partir de sa première image clé
+            flushed = 0
+            started = False
+            for timestamp, keyframe, data in self._frames:
+                started = started or keyframe
+                if started:
+                    self._write(data, keyframe, timestamp)
+                    flushed += len(data)
+            self._writing = started
+            RECORDED_BYTES.inc(flushed)
+            if flushed:
+                self._notify_first_frame()
+            return flushed
+
+    def stop_file(self):
+        """Ferme le fichier en cours ; le buffer continue d'être alimenté"""
+        with self._lock:
+            file, self._file = self._file, None
+            keyframe_index, self._keyframe_index = self._keyframe_index, None
+            self._writing = False
+            self._on_first_frame = None
+        # Hors du verrou : la fin d'écriture du fichier ne retarde pas l'encodeur
+        if file is not None:
+            file.close()
+        if keyframe_index is not None:
+            keyframe_index.close()
+
+    def stop(self):
+        if self.keep_open:
+            return
+        self.stop_file()
+        super().stop()
+
+    def get_stats(self):
+        """Retourne l'occupation mémoire du buffer"""
+        with self._lock:
+            if self._frames:
+                duration = (self._frames[-1][0] - self._frames[0][0]) / 1000000
+            else:
+                duration = 0
+            return {
+                'frames': len(self._frames),
+                'buffered_bytes': self._buffered_bytes,
+                'buffered_seconds': round(duration, 2),
+                'peak_bytes': self.peak_bytes,
+                'max_bytes': self.max_bytes,
+                'max_seconds': self.seconds
+            }
+
+
+class RecordingOutput(FileOutput):
+    """FileOutput qui signale l'écriture de la première frame et indexe les images clés"""
+
+    def __init__(self, file, on_first_frame=None, keyframe_index=None):
+        super().__init__(file)
+        self._file = file  # Picamera2 ne ferme pas un fichier qu'il n'a pas ouvert
+        self._on_first_frame = on_first_frame
+        self._keyframe_index = keyframe_index
+        self._file_bytes = 0
+        self._writing = False  # Première image clé écrite
+        self.keep_open = False  # Encodeur redémarré (changement de débit) : stop() ne ferme rien
+        self.last_keyframe_at = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if keyframe:
+            self.last_keyframe_at = time.monotonic()
+        # FileOutput n'écrit rien hors enregistrement ni avant la première image clé :
+        # positions, index et compteurs ne suivent que les frames réellement écrites
+        written = self.recording and (self._writing or keyframe)
+        if written and keyframe and self._keyframe_index is not None:
+            self._keyframe_index.add(self._file_bytes, timestamp or 0)
+        super().outputframe(frame, keyframe, timestamp, *args, **kwargs)
+        if not written:
+            return
+        self._writing = True
+        self._file_bytes += len(frame)
+        RECORDED_BYTES.inc(len(frame))
+        if self._on_first_frame is not None:
+            callback, self._on_first_frame = self._on_first_frame, None
+            callback()
+
+    def stop(self):
+        if self.keep_open:
+            return
+        super().stop()
+        self._file.close()
+        if self._keyframe_index is not None:
+            self._keyframe_index.close()
+
+
+class KeyframeIndex:
+    """Index des images clés d'un enregistrement H.264, dans un fichier annexe compact.
+
+    En-tête (signature, largeur, hauteur, images/s) puis 16 octets par image
+    clé : timestamp en µs et position dans le fichier. Écrit pendant
+    l'enregistrement, il permet d'extraire un passage en ne lisant que les
+    octets concernés.
+    """
+
+    MAGIC = b'KFI1'
+    HEADER = struct.Struct('<4sHHf')
+    RECORD = struct.Struct('<QQ')
+
+    def __init__(self, video_path, width, height, framerate):
+        path = self.path_for(video_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'wb')
+        self._file.write(self.HEADER.pack(self.MAGIC, width, height, framerate))
+        self.keyframes = 0
+
+    @staticmethod
+    def path_for(video_path):
+        """Chemin du fichier d'index d'une vidéo (sous-dossier `keyframes`, ignoré par l'index des médias)"""
+        return os.path.join(os.path.dirname(video_path), 'keyframes', os.path.basename(video_path) + '.kfi')
+
+    def add(self, offset, timestamp):
+        """Enregistre une image clé écrite à `offset`"""
+        if self._file is not None:
+            self._file.write(self.RECORD.pack(timestamp, offset))
+            self.keyframes += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @classmethod
+    def load(cls, video_path):
+        """Retourne (largeur, hauteur, images/s, [(timestamp, position)])"""
+        with open(cls.path_for(video_path), 'rb') as f:
+            data = f.read()
+        magic, width, height, framerate = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("Index d'images clés invalide")
+        count = (len(data) - cls.HEADER.size) // cls.RECORD.size
+        entries = [cls.RECORD.unpack_from(data, cls.HEADER.size + index * cls.RECORD.size) for index in range(count)]
+        return width, height, framerate, entries
+
+
+def _split_nal_units(data):
+    """NAL units (sans code de démarrage) d'un flux H.264 Annex B"""
+    units = []
+    start = data.find(b'\x00\x00\x01')
+    while start != -1:
+        start += 3
+        end = data.find(b'\x00\x00\x01', start)
+        # Les zéros de fin appartiennent au code de démarrage suivant (00 00 00 01)
+        unit = data[start:end].rstrip(b'\x00') if end != -1 else data[start:]
+        if unit:
+            units.append(unit)
+        start = end
+    return units
+
+
+def _access_units(data):
+    """Regroupe les NAL units par image : [(NAL units, image clé)]"""
+    frames = []
+    current = []
+    has_slice = False
+    for unit in _split_nal_units(data):
+        unit_type = unit[0] & 0x1F
+        # Une image commence par SEI/SPS/PPS/AUD ou par une tranche dont first_mb_in_slice vaut 0
+        first_slice = unit_type in (1, 5) and len(unit) > 1 and unit[1] & 0x80
+        if has_slice and (unit_type in (6, 7, 8, 9) or first_slice):
+            frames.append((current, any(u[0] & 0x1F == 5 for u in current)))
+            current = []
+            has_slice = False
+        current.append(unit)
+        has_slice = has_slice or unit_type in (1, 5)
+    if current:
+        frames.append((current, any(u[0] & 0x1F == 5 for u in current)))
+    return frames
+
+
+def _mp4_box(kind, *payloads):
+    body = b''.join(payloads)
+    return struct.pack('>I', 8 + len(body)) + kind + body
+
+
+def _mp4_full_box(kind, version, flags, *payloads):
+    return _mp4_box(kind, struct.pack('>I', version << 24 | flags), *payloads)
+
+
+def _mp4_moov(width, height, timescale, sps, pps, sizes, durations, sync_samples, chunk_offset):
+    """Boîte moov d'une piste vidéo H.264 dont les échantillons forment un seul bloc"""
+    duration = sum(durations)
+    matrix = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+    mvhd = _mp4_full_box(b'mvhd', 0, 0, struct.pack('>IIIIIH10x', 0, 0, timescale, duration, 0x00010000, 0x0100),
+                         matrix, bytes(24), struct.pack('>I', 2))
+    tkhd = _mp4_full_box(b'tkhd', 0, 3, struct.pack('>IIIII8xHHH2x', 0, 0, 1, 0, duration, 0, 0, 0),
+                         matrix, struct.pack('>II', width << 16, height << 16))
+    mdhd = _mp4_full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, duration, 0x55C4, 0))
+    hdlr = _mp4_full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'vide'), b'VideoHandler\x00')
+    vmhd = _mp4_full_box(b'vmhd', 0, 1, bytes(8))
+    dinf = _mp4_box(b'dinf', _mp4_full_box(b'dref', 0, 0, struct.pack('>I', 1), _mp4_full_box(b'url ', 0, 1)))
+    avcc = _mp4_box(b'avcC', bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]), struct.pack('>H', len(sps)), sps,
+                    bytes([1]), struct.pack('>H', len(pps)), pps)
+    avc1 = _mp4_box(b'avc1', bytes(6), struct.pack('>H', 1), bytes(16),
+                    struct.pack('>HHIIIH32sHh', width, height, 0x00480000, 0x00480000, 0, 1, b'', 0x0018, -1), avcc)
+    stsd = _mp4_full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1)
+    
+    # Durées regroupées en plages identiques
+    runs = []
+    for delta in durations:
+        if runs and runs[-1][1] == delta:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, delta])
+    stts = _mp4_full_box(b'stts', 0, 0, struct.pack('>I', len(runs)), b''.join(struct.pack('>II', *run) for run in runs))
+    stss = _mp4_full_box(b'stss', 0, 0, struct.pack(f'>I{len(sync_samples)}I', len(sync_samples), *sync_samples))
+    stsc = _mp4_full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, len(sizes), 1))
+    stsz = _mp4_full_box(b'stsz', 0, 0, struct.pack(f'>II{len(sizes)}I', 0, len(sizes), *sizes))
+    stco = _mp4_full_box(b'stco', 0, 0, struct.pack('>II', 1, chunk_offset))
+    
+    stbl = _mp4_box(b'stbl', stsd, stts, stss, stsc, stsz, stco)
+    minf = _mp4_box(b'minf', vmhd, dinf, stbl)
+    mdia = _mp4_box(b'mdia', mdhd, hdlr, minf)
+    return _mp4_box(b'moov', mvhd, _mp4_box(b'trak', tkhd, mdia))
+
+
+def export_clip(video_path, start, end, output_path):
+    """Copie le passage [start, end] (secondes depuis le début) d'un enregistrement H.264 dans un MP4.
+
+    Sans réencodage : le passage commence à l'image clé qui précède `start`
+    et seuls les octets jusqu'à l'image clé suivant `end` sont lus, grâce
+    à l'index des images clés. Retourne les statistiques de l'extraction.
+    """
+    started = time.perf_counter()
+    width, height, framerate, entries = KeyframeIndex.load(video_path)
+    if not entries:
+        raise ValueError("Aucune image clé indexée")
+    origin = entries[0][0]
+    times = [(timestamp - origin) / 1000000 for timestamp, _ in entries]
+    file_size = os.path.getsize(video_path)
+    
+    # Durée indexée : dernière image clé plus les images de son GOP (seul passage relu)
+    with open(video_path, 'rb') as source:
+        source.seek(entries[-1][1])
+        duration = times[-1] + len(_access_units(source.read(file_size - entries[-1][1]))) / framerate
+    if start < 0 or start >= end or start >= duration:
+        raise ValueError(f"Intervalle invalide (durée de la vidéo: {duration:.1f} s)")
+    end = min(end, duration)
+    first = max(bisect_left(times, start + 0.000001) - 1, 0)
+    last = max(bisect_left(times, end), first + 1)
+    
+    timescale = 90000
+    sps = pps = None
+    sizes, durations, sync_samples = [], [], []
+    bytes_read = 0
+    with open(video_path, 'rb') as source, open(output_path, 'wb') as out:
+        out.write(_mp4_box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isomiso2avc1mp41'))
+        mdat_offset = out.tell()
+        out.write(struct.pack('>I', 0) + b'mdat')
+        
+        for gop in range(first, min(last, len(entries))):
+            gop_start = entries[gop][1]
+            gop_end = entries[gop + 1][1] if gop + 1 < len(entries) else file_size
+            source.seek(gop_start)
+            data = source.read(gop_end - gop_start)
+            bytes_read += len(data)
+            frames = _access_units(data)
+            # Images réparties uniformément entre deux images clés
+            if gop + 1 < len(entries) and frames:
+                frame_seconds = (times[gop + 1] - times[gop]) / len(frames)
+            else:
+                frame_seconds = 1 / framerate
+            
+            for index, (units, keyframe) in enumerate(frames):
+                if times[gop] + index * frame_seconds >= end:
+                    break  # Les images après `end` ne sont référencées par aucune autre conservée
+                sample = bytearray()
+                for unit in units:
+                    unit_type = unit[0] & 0x1F
+                    if unit_type == 7:
+                        sps = sps or unit
+                    elif unit_type == 8:
+                        pps = pps or unit
+                    elif unit_type != 9:
+                        sample += struct.pack('>I', len(unit)) + unit
+                out.write(sample)
+                sizes.append(len(sample))
+                durations.append(max(round(frame_seconds * timescale), 1))
+                if keyframe:
+                    sync_samples.append(len(sizes))
+        
+        if sps is None or pps is None:
+            raise ValueError("SPS/PPS introuvables dans le passage (encodeur sans repeat=True ?)")
+        mdat_size = out.tell() - mdat_offset
+        out.write(_mp4_moov(width, height, timescale, sps, pps, sizes, durations, sync_samples, mdat_offset + 8))
+        out.seek(mdat_offset)
+        out.write(struct.pack('>I', mdat_size))
+    
+    return {
+        'frames': len(sizes),
+        'start': round(times[first], 3),
+        'duration': round(sum(durations) / timescale, 3),
+        'bytes_read': bytes_read,
+        'file_bytes': file_size,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+def _mpeg_crc32(data):
+    """CRC-32/MPEG-2 des tables PSI"""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+class TransportStreamWriter:
+    """Multiplexeur MPEG-TS minimal pour un flux H.264 seul (segments HLS).
+
+    Une frame de l'encodeur (unité d'accès Annex B) devient un paquet PES
+    avec PTS, précédé d'un délimiteur d'unité d'accès ; le PCR est porté
+    par le premier paquet TS de chaque frame.
+    """
+
+    PMT_PID = 0x1000
+    VIDEO_PID = 0x100
+    ACCESS_UNIT_DELIMITER = b'\x00\x00\x00\x01\x09\xf0'
+    PTS_OFFSET = 9000  # 100 ms d'avance du PTS sur le PCR
+
+    def __init__(self, file):
+        self.file = file
+        self._continuity = {}
+        pat = bytes([0x00, 0xB0, 13, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01,
+                     0xE0 | self.PMT_PID >> 8, self.PMT_PID & 0xFF])
+        pmt = bytes([0x02, 0xB0, 18, 0x00, 0x01, 0xC1, 0x00, 0x00,
+                     0xE0 | self.VIDEO_PID >> 8, self.VIDEO_PID & 0xFF, 0xF0, 0x00,
+                     0x1B, 0xE0 | self.VIDEO_PID >> 8, self.VIDEO_PID & 0xFF, 0xF0, 0x00])
+        self._pat = b'\x00' + pat + _mpeg_crc32(pat).to_bytes(4, 'big')
+        self._pmt = b'\x00' + pmt + _mpeg_crc32(pmt).to_bytes(4, 'big')
+
+    def _packets(self, pid, payload, pcr=None, random_access=False):
+        """Découpe un payload en paquets TS de 188 octets"""
+        out = bytearray()
+        position = 0
+        first = True
+        while first or position < len(payload):
+            adaptation = None
+            if first and (pcr is not None or random_access):
+                adaptation = bytearray([(0x40 if random_access else 0) | (0x10 if pcr is not None else 0)])
+                if pcr is not None:
+                    base = pcr & 0x1FFFFFFFF
+                    adaptation += (base >> 1).to_bytes(4, 'big') + (((base & 1) << 15) | 0x7E00).to_bytes(2, 'big')
+            room = 184 - (len(adaptation) + 1 if adaptation is not None else 0)
+            chunk = payload[position:position + room]
+            missing = room - len(chunk)
+            if missing:
+                # Bourrage dans le champ d'adaptation du dernier paquet
+                if adaptation is not None:
+                    adaptation += b'\xff' * missing
+                else:
+                    adaptation = bytearray(b'\x00' + b'\xff' * (missing - 2)) if missing > 1 else bytearray()
+            counter = self._continuity.get(pid, 0)
+            self._continuity[pid] = (counter + 1) & 0x0F
+            out += bytes([0x47, (0x40 if first else 0) | pid >> 8, pid & 0xFF,
+                          (0x30 if adaptation is not None else 0x10) | counter])
+            if adaptation is not None:
+                out.append(len(adaptation))
+                out += adaptation
+            out += chunk
+            position += len(chunk)
+            first = False
+        return out
+
+    def write_tables(self):
+        """PAT et PMT, en tête de chaque segment"""
+        self.file.write(self._packets(0, self._pat) + self._packets(self.PMT_PID, self._pmt))
+
+    def write_frame(self, data, timestamp_us, keyframe):
+        """Écrit une frame H.264 horodatée (µs)"""
+        clock = timestamp_us * 9 // 100
+        pts = clock + self.PTS_OFFSET
+        header = b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05' + bytes([
+            0x21 | (pts >> 29) & 0x0E, (pts >> 22) & 0xFF, ((pts >> 14) & 0xFE) | 1,
+            (pts >> 7) & 0xFF, ((pts << 1) & 0xFE) | 1])
+        self.file.write(self._packets(self.VIDEO_PID, header + self.ACCESS_UNIT_DELIMITER + bytes(data),
+                                      pcr=clock, random_access=keyframe))
+
+
+class SegmentedRecordingOutput(Output):
+    """Sortie H.264 découpée en segments MPEG-TS alignés sur les images clés (HLS).
+
+    `outputframe` (thread de l'encodeur) dépose seulement la frame dans une
+    file bornée ; un thread d'écriture multiplexe et ouvre un nouveau
+    segment à la première image clé après `segment_seconds`. Si le disque
+    ne suit pas, les frames sont abandonnées jusqu'à l'image clé suivante
+    au lieu de bloquer l'encodeur. Un segment n'apparaît dans `directory`
+    qu'une fois terminé, nommé d'après son heure de début et sa durée.
+    """
+
+    def __init__(self, directory, segment_seconds=6, list_size=6, on_segment=None, max_queued_frames=120):
+        super().__init__()
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.list_size = list_size
+        self.on_segment = on_segment
+        self._partial_dir = os.path.join(directory, 'partial')
+        os.makedirs(self._partial_dir, exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_queued_frames)
+        self._lock = threading.Lock()
+        self._playlist = deque(maxlen=list_size)  # (nom, durée) des derniers segments
+        self._media_sequence = 0
+        self._resync = False
+        self._thread = None
+        self._file = None
+        self._muxer = None
+        self._segment_start = None  # Timestamp (µs) de la première frame du segment
+        self._segment_started_at = None
+        self._last_timestamp = None
+        self._frame_interval = 0
+        self.segments_written = 0
+        self.dropped_frames = 0
+        self.queue_peak = 0
+        self.keep_open = False  # Encodeur redémarré (changement de débit) : ni nouveau thread ni fermeture
+        self.last_keyframe_at = None
+
+    def start(self):
+        if self.keep_open:
+            return
+        super().start()
+        self._thread = threading.Thread(target=self._writer_loop, name='segment-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self.keep_open:
+            return
+        super().stop()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if keyframe:
+            self.last_keyframe_at = time.monotonic()
+        if self._resync:
+            if not keyframe:
+                self.dropped_frames += 1
+                return
+            self._resync = False
+        try:
+            self._queue.put_nowait((bytes(frame), keyframe, timestamp))
+        except queue.Full:
+            # Le segment reprendra proprement à la prochaine image clé
+            self.dropped_frames += 1
+            self._resync = True
+            return
+        self.queue_peak = max(self.queue_peak, self._queue.qsize())
+        RECORDED_BYTES.inc(len(frame))
+
+    def _writer_loop(self):
+        """Multiplexe les frames et change de segment sur les images clés"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            data, keyframe, timestamp = item
+            try:
+                # Tolérance de 50 ms : une image clé par seconde ne tombe pas à la µs près
+                if keyframe and (self._file is None
+                                 or timestamp - self._segment_start >= self.segment_seconds * 1000000 - 50000):
+                    self._finish_segment(timestamp)
+                    self._open_segment(timestamp)
+                if self._file is None:
+                    continue  # Un segment commence toujours par une image clé
+                self._muxer.write_frame(data, timestamp, keyframe)
+                if self._last_timestamp is not None:
+                    self._frame_interval = timestamp - self._last_timestamp
+                self._last_timestamp = timestamp
+            except OSError as e:
+                logger.error(f"Erreur lors de l'écriture d'un segment: {e}")
+                # Segment abandonné : le descripteur est libéré même si la fermeture échoue (carte pleine)
+                try:
+                    if self._file is not None:
+                        self._file.close()
+                except OSError:
+                    pass
+                finally:
+                    self._file = None
+        self._finish_segment(None if self._last_timestamp is None
+                             else self._last_timestamp + self._frame_interval)
+
+    def _open_segment(self, timestamp):
+        self._segment_start = timestamp
+        self._segment_started_at = datetime.now()
+        self._file = open(os.path.join(self._partial_dir, 'current.ts'), 'wb')
+        self._muxer = TransportStreamWriter(self._file)
+        self._muxer.write_tables()
+
+    def _finish_segment(self, end_timestamp):
+        """Ferme le segment en cours et le publie dans le dossier et la playlist"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        duration = max(end_timestamp - self._segment_start, 0) / 1000000 if end_timestamp else 0
+        started = self._segment_started_at
+        name = f"seg_{started.strftime('%Y%m%d_%H%M%S')}_{started.microsecond // 1000:03d}_{int(duration * 1000)}.ts"
+        path = os.path.join(self.directory, name)
+        os.replace(os.path.join(self._partial_dir, 'current.ts'), path)
+        with self._lock:
+            if len(self._playlist) == self.list_size:
+                self._media_sequence += 1
+            self._playlist.append((name, duration))
+        self.segments_written += 1
+        if self.on_segment is not None:
+            self.on_segment(path)
+
+    def playlist(self):
+        """Playlist HLS glissante des derniers segments"""
+        with self._lock:
+            items = list(self._playlist)
+            sequence = self._media_sequence
+        return build_hls_playlist(items, self.segment_seconds, sequence, ended=not self.recording)
+
+    def get_stats(self):
+        return {
+            'segments_written': self.segments_written,
+            'dropped_frames': self.dropped_frames,
+            'queued_frames': self._queue.qsize(),
+            'queue_peak': self.queue_peak,
+            'segment_seconds': self.segment_seconds
+        }
+
+
+def parse_segment_name(name):
+    """(début, durée en secondes) d'un segment d'après son nom, ou None"""
+    try:
+        _, day, clock, millis, duration = os.path.splitext(name)[0].split('_')
+        start = datetime.strptime(f"{day}_{clock}", "%Y%m%d_%H%M%S").timestamp() + int(millis) / 1000
+        return start, int(duration) / 1000
+    except ValueError:
+        return None
+
+
+def build_hls_playlist(items, segment_seconds, media_sequence=0, ended=False, discontinuities=()):
+    """Texte d'une playlist HLS à partir de (nom, durée)"""
+    target = max([segment_seconds] + [duration for _, duration in items])
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{int(target + 0.999)}',
+             f'#EXT-X-MEDIA-SEQUENCE:{media_sequence}']
+    if ended:
+        lines.append('#EXT-X-PLAYLIST-TYPE:VOD')
+    for index, (name, duration) in enumerate(items):
+        if index in discontinuities:
+            lines.append('#EXT-X-DISCONTINUITY')
+        lines.append(f'#EXTINF:{duration:.3f},')
+        lines.append(name)
+    if ended:
+        lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+class MediaIndex:
+    """Index persistant (SQLite) des vidéos et photos enregistrées.
+
+    Les fichiers créés par l'application sont ajoutés directement ; le
+    contenu des dossiers n'est relu que lorsque leur date de modification
+    change (ajout ou suppression externe), sans stat de chaque fichier.
+    """
+
+    DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+    SORT_COLUMNS = {'date': 'created', 'name': 'name', 'size': 'size'}
+
+    def __init__(self, db_path, directories, on_change=None):
+        self.directories = directories  # {'videos': dossier, 'photos': dossier, 'segments': dossier}
+        self.on_change = on_change  # Appelé avec (action, type, nom, taille) après chaque modification
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            "kind TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (kind, name))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS media_created ON media (kind, created)")
+        self._conn.commit()
+        self._dir_mtimes = {}
+        # Le numéro de génération évite de réutiliser un ETag après redémarrage
+        self._generation = int(time.time())
+        self.version = 0
+
+    @property
+    def etag(self):
+        return f"{self._generation}-{self.version}"
+
+    def add(self, kind, path):
+        """Ajoute ou met à jour un fichier dans l'index"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return self.remove(kind, os.path.basename(path))
+        name = os.path.basename(path)
+        with self._lock:
+            known = self._conn.execute("SELECT 1 FROM media WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (kind, name, size, created) VALUES (?, ?, ?, ?)",
+                (kind, name, st.st_size, st.st_ctime)
+            )
+            self._conn.commit()
+            self.version += 1
+        self._notify('updated' if known else 'added', kind, name, st.st_size)
+
+    def _notify(self, action, kind, name, size=None):
+        if self.on_change is not None:
+            self.on_change(action, kind, name, size)
+
+    def remove(self, kind, name):
+        """Retire un fichier de l'index"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM media WHERE kind = ? AND name = ?", (kind, name))
+            self._conn.commit()
+            if cursor.rowcount:
+                self.version += 1
+        if cursor.rowcount:
+            self._notify('deleted', kind, name)
+
+    def reconcile(self):
+        """Resynchronise l'index avec les dossiers modifiés depuis le dernier passage"""
+        for kind, directory in self.directories.items():
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if self._dir_mtimes.get(kind) == mtime:
+                continue
+
+            with os.scandir(directory) as entries:
+                on_disk = {entry.name: entry for entry in entries if entry.is_file()}
+            with self._lock:
+                indexed = {row[0] for row in self._conn.execute(
+                    "SELECT name FROM media WHERE kind = ?", (kind,))}
+                removed = indexed - on_disk.keys()
+                added = on_disk.keys() - indexed
+                self._conn.executemany("DELETE FROM media WHERE kind = ? AND name = ?",
+                                       [(kind, name) for name in removed])
+                rows = []
+                for name in added:
+                    try:
+                        st = on_disk[name].stat()
+                    except FileNotFoundError:
+                        continue
+                    rows.append((kind, name, st.st_size, st.st_ctime))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO media (kind, name, size, created) VALUES (?, ?, ?, ?)", rows)
+                self._conn.commit()
+                if removed or added:
+                    self.version += 1
+            self._dir_mtimes[kind] = mtime
+            
+            # Modifications faites hors de l'application
+            for name in removed:
+                self._notify('deleted', kind, name)
+            for _, name, size, _ in rows:
+                self._notify('added', kind, name, size)
+
+    def query(self, kind, since=None, until=None, sort='date', order='desc', limit=None, offset=0):
+        """Retourne (nombre total, fichiers) pour un type, filtrés et paginés"""
+        conditions = ["kind = ?"]
+        params = [kind]
+        if since is not None:
+            conditions.append("created >= ?")
+            params.append(since.timestamp())
+        if until is not None:
+            conditions.append("created < ?")
+            params.append(until.timestamp())
+        where = " AND ".join(conditions)
+        column = self.SORT_COLUMNS.get(sort, 'created')
+        direction = 'ASC' if order == 'asc' else 'DESC'
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM media WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT name, size, created FROM media WHERE {where} "
+                f"ORDER BY {column} {direction} LIMIT ? OFFSET ?",
+                params + [limit if limit is not None else -1, offset]
+            ).fetchall()
+
+        return total, [{
+            'name': name,
+            'size': size,
+            'date': datetime.fromtimestamp(created).strftime(self.DATE_FORMAT)
+        } for name, size, created in rows]
+
+    def oldest(self, limit, offset=0):
+        """Retourne les fichiers les plus anciens, tous types confondus"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT kind, name, size, created FROM media ORDER BY created ASC, name ASC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+
+    def total_size(self):
+        """Retourne la taille cumulée des fichiers indexés"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MotionEventLog:
+    """Journal persistant des événements de mouvement (SQLite, en ajout seul).
+
+    `observe` est appelé à chaque analyse et ne met à jour que l'événement
+    en cours, en mémoire. Un événement terminé (début, fin, pic de pixels,
+    boîte englobante, vidéo associée) est écrit par un thread dédié, qui
+    tient à jour au même moment un agrégat par heure : les statistiques
+    horaires ne parcourent pas les événements.
+    """
+
+    DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS motion_events ("
+            "id INTEGER PRIMARY KEY, start REAL NOT NULL, end REAL NOT NULL, "
+            "peak_pixels INTEGER NOT NULL, x1 REAL, y1 REAL, x2 REAL, y2 REAL, recording TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS motion_events_start ON motion_events (start)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS motion_hours ("
+            "hour INTEGER PRIMARY KEY, events INTEGER NOT NULL, seconds REAL NOT NULL, "
+            "peak_pixels INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        self._event_lock = threading.Lock()
+        self.current = None
+        self.written = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer_loop, name='motion-events')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def observe(self, active, pixels=0, bbox=None):
+        """Met à jour l'événement en cours après une analyse (sans accès disque)"""
+        now = time.time()
+        with self._event_lock:
+            event = self.current
+            if active:
+                if event is None:
+                    event = self.current = {'start': now, 'end': now, 'peak_pixels': 0,
+                                            'bbox': None, 'recording': None}
+                event['end'] = now
+                event['peak_pixels'] = max(event['peak_pixels'], pixels)
+                if bbox is not None:
+                    previous = event['bbox'] or bbox
+                    event['bbox'] = (min(previous[0], bbox[0]), min(previous[1], bbox[1]),
+                                     max(previous[2], bbox[2]), max(previous[3], bbox[3]))
+            elif event is not None:
+                event['end'] = now
+                self.current = None
+                self._queue.put(event)
+
+    def link_recording(self, filename):
+        """Associe la vidéo qui démarre à l'événement en cours"""
+        with self._event_lock:
+            if self.current is not None and self.current['recording'] is None:
+                self.current['recording'] = os.path.basename(filename)
+
+    def _writer_loop(self):
+        """Écrit les événements terminés"""
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            try:
+                self._write(event)
+            except sqlite3.Error as e:
+                logger.error(f"Erreur lors de l'écriture d'un événement de mouvement: {e}")
+
+    def _write(self, event):
+        x1, y1, x2, y2 = event['bbox'] or (None, None, None, None)
+        hour = int(event['start'] // 3600) * 3600
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO motion_events (start, end, peak_pixels, x1, y1, x2, y2, recording) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (event['start'], event['end'], event['peak_pixels'], x1, y1, x2, y2, event['recording'])
+            )
+            self._conn.execute(
+                "INSERT INTO motion_hours (hour, events, seconds, peak_pixels) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT (hour) DO UPDATE SET events = events + 1, seconds = seconds + excluded.seconds, "
+                "peak_pixels = MAX(peak_pixels, excluded.peak_pixels)",
+                (hour, event['end'] - event['start'], event['peak_pixels'])
+            )
+            self._conn.commit()
+            self.written += 1
+
+    def _format_event(self, event, event_id=None):
+        bbox = event['bbox']
+        return {
+            'id': event_id,
+            'start': datetime.fromtimestamp(event['start']).strftime(self.DATE_FORMAT),
+            'end': datetime.fromtimestamp(event['end']).strftime(self.DATE_FORMAT),
+            'duration': round(event['end'] - event['start'], 1),
+            'peak_pixels': event['peak_pixels'],
+            'bbox': list(bbox) if bbox is not None else None,
+            'recording': event['recording']
+        }
+
+    def query(self, since=None, until=None, order='desc', limit=None, offset=0):
+        """Retourne (nombre total, événements) ayant commencé dans l'intervalle"""
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("start >= ?")
+            params.append(since.timestamp())
+        if until is not None:
+            conditions.append("start < ?")
+            params.append(until.timestamp())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = 'ASC' if order == 'asc' else 'DESC'
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM motion_events {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT id, start, end, peak_pixels, x1, y1, x2, y2, recording FROM motion_events {where} "
+                f"ORDER BY start {direction} LIMIT ? OFFSET ?",
+                params + [limit if limit is not None else -1, offset]
+            ).fetchall()
+
+        return total, [self._format_event({
+            'start': start, 'end': end, 'peak_pixels': peak,
+            'bbox': (x1, y1, x2, y2) if x1 is not None else None, 'recording': recording
+        }, event_id) for event_id, start, end, peak, x1, y1, x2, y2, recording in rows]
+
+    def hourly(self, since=None, until=None):
+        """Nombre d'événements, durée cumulée et pic par heure (depuis l'agrégat)"""
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("hour >= ?")
+            params.append(int(since.timestamp() // 3600) * 3600)
+        if until is not None:
+            conditions.append("hour < ?")
+            params.append(until.timestamp())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT hour, events, seconds, peak_pixels FROM motion_hours {where} ORDER BY hour ASC", params
+            ).fetchall()
+        return [{
+            'hour': datetime.fromtimestamp(hour).strftime("%Y-%m-%d %H:00"),
+            'events': events,
+            'seconds': round(seconds, 1),
+            'peak_pixels': peak
+        } for hour, events, seconds, peak in rows]
+
+    def get_ongoing(self):
+        """Événement en cours, ou None"""
+        with self._event_lock:
+            return self._format_event(self.current) if self.current is not None else None
+
+    def close(self):
+        """Termine l'événement en cours et attend l'écriture des derniers événements"""
+        self.observe(False)
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        with self._lock:
+            self._conn.close()
+
+
+class RetentionService:
+    """Supprime en continu les fichiers les plus anciens selon plusieurs limites.
+
+    Limites : âge maximal, volume total maximal et espace libre minimal sur
+    le disque. Les suppressions se font par petits lots séparés de pauses
+    pour ne pas concurrencer les écritures de l'enregistrement.
+    """
+
+    def __init__(self, media_index, config, protected_files=None):
+        self.media_index = media_index
+        self.config = config
+        self.protected_files = protected_files or (lambda: set())
+        self._stop_event = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self.last_run = None
+        self.deleted_files_total = 0
+        self.freed_bytes_total = 0
+
+    def start(self):
+        """Démarre le service en arrière-plan"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name='retention')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Service de conservation des fichiers démarré")
+
+    def stop(self):
+        """Arrête le service (attend la fin du lot en cours)"""
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _loop(self):
+        """Boucle du service"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Erreur dans le service de conservation: {e}")
+            self._stop_event.wait(self.config['retention_interval'])
+
+    def _free_bytes(self):
+        """Espace disque disponible sur la partition des vidéos"""
+        st = os.statvfs(self.config['video_dir'])
+        return st.f_bavail * st.f_frsize
+
+    def run_once(self):
+        """Applique les limites une fois et retourne les statistiques"""
+        with self._run_lock:
+            started = time.monotonic()
+            self.media_index.reconcile()
+
+            directories = self.media_index.directories
+            cutoff = time.time() - self.config['cleanup_days'] * 86400
+            max_bytes = self.config['max_storage_bytes']
+            min_free = self.config['min_free_bytes']
+            total = self.media_index.total_size()
+            free = self._free_bytes()
+            stats = {'deleted_files': 0, 'freed_bytes': 0,
+                     'reasons': {'age': 0, 'quota': 0, 'free_space': 0}}
+
+            # Du plus ancien au plus récent, par lots, tant qu'une limite est dépassée.
+            # Les fichiers conservés (protégés ou non supprimables) restent en tête
+            # de l'index : les lots suivants commencent après eux.
+            skipped = 0
+            done = False
+            while not done and not self._stop_event.is_set():
+                batch = self.media_index.oldest(self.config['retention_batch_size'], skipped)
+                if not batch:
+                    break
+                protected = self.protected_files()
+                deleted_in_batch = 0
+                for kind, name, size, created in batch:
+                    path = os.path.join(directories[kind], name)
+                    if path in protected:
+                        skipped += 1
+                        continue
+                    if created < cutoff:
+                        reason = 'age'
+                    elif max_bytes and total > max_bytes:
+                        reason = 'quota'
+                    elif min_free and free < min_free:
+                        reason = 'free_space'
+                    else:
+                        done = True
+                        break
+
+                    if kind == 'videos':
+                        # Index des images clés supprimé même si la vidéo a déjà disparu
+                        try:
+                            os.remove(KeyframeIndex.path_for(path))
+                        except OSError:
+                            pass
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.error(f"Impossible de supprimer {name}: {e}")
+                        skipped += 1
+                        continue
+                    self.media_index.remove(kind, name)
+                    logger.info(f"Fichier supprimé ({reason}): {name}")
+
+                    total -= size
+                    free += size
+                    deleted_in_batch += 1
+                    stats['deleted_files'] += 1
+                    stats['freed_bytes'] += size
+                    stats['reasons'][reason] += 1
+
+                # Pause entre deux lots pour laisser passer les écritures vidéo
+                if deleted_in_batch and not done:
+                    self._stop_event.wait(self.config['retention_batch_pause'])
+
+            self.deleted_files_total += stats['deleted_files']
+            self.freed_bytes_total += stats['freed_bytes']
+            stats.update({
+                'deleted_files_total': self.deleted_files_total,
+                'freed_bytes_total': self.freed_bytes_total,
+                'finished_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'duration_ms': round((time.monotonic() - started) * 1000, 1),
+                'total_bytes': total,
+                'free_bytes': self._free_bytes()
+            })
+            self.last_run = stats
+            return stats
+
+
+class ThumbnailCache:
+    """Cache disque des miniatures : image de couverture des vidéos, photos réduites.
+
+    Les miniatures sont générées à la demande dans un petit pool de threads,
+    une seule fois même si plusieurs requêtes les attendent. Leur nom dépend
+    du fichier source, de sa taille et de sa date de modification. Au-delà
+    de `max_bytes`, les moins récemment servies sont supprimées (LRU).
+    """
+
+    def __init__(self, directory, max_bytes=32 * 1024 * 1024, width=320, workers=1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.width = width
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # Nom -> taille, du moins au plus récemment servi
+        self._pending = {}  # Nom -> Future des miniatures en cours de génération
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.failures = 0
+        
+        # Reprise du cache existant : la date de modification suit le dernier accès
+        os.makedirs(directory, exist_ok=True)
+        with os.scandir(directory) as entries:
+            existing = sorted((entry.stat().st_mtime, entry.name, entry.stat().st_size)
+                              for entry in entries if entry.is_file() and entry.name.endswith('.jpg'))
+        for _, name, size in existing:
+            self._entries[name] = size
+            self.total_bytes += size
+
+    def _cache_name(self, kind, path):
+        st = os.stat(path)
+        base = os.path.basename(path)
+        key = f"{kind}/{base}:{st.st_size}:{st.st_mtime_ns}"
+        return f"{os.path.splitext(base)[0]}-{zlib.crc32(key.encode()):08x}.jpg"
+
+    def get(self, kind, path, timeout=10):
+        """Chemin de la miniature (générée si besoin), ou None si le fichier n'a pas pu être décodé"""
+        name = self._cache_name(kind, path)
+        target = os.path.join(self.directory, name)
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                future = None
+            else:
+                future = self._pending.get(name)
+                if future is None:
+                    self.misses += 1
+                    future = self._executor.submit(self._generate, kind, path, target, name)
+                    self._pending[name] = future
+        if future is None:
+            try:
+                os.utime(target)  # Ordre LRU conservé au redémarrage
+                return target
+            except FileNotFoundError:
+                # Supprimée hors du cache : on l'oublie et on la régénère
+                with self._lock:
+                    self.total_bytes -= self._entries.pop(name, 0)
+                return self.get(kind, path, timeout)
+        return future.result(timeout)
+
+    def _generate(self, kind, path, target, name):
+        try:
+            if kind != 'photos':
+                image = self._video_poster(path)
+            else:
+                # Décodage JPEG directement au quart de la taille
+                image = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+            if image is None:
+                self.failures += 1
+                return None
+            
+            height, width = image.shape[:2]
+            if width > self.width:
+                image = cv2.resize(image, (self.width, max(height * self.width // width, 1)),
+                                   interpolation=cv2.INTER_AREA)
+            ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 75])
+            if not ok:
+                self.failures += 1
+                return None
+            temporary = target + '.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(jpeg.tobytes())
+            os.replace(temporary, target)
+            
+            with self._lock:
+                self._entries[name] = len(jpeg)
+                self.total_bytes += len(jpeg)
+                self._evict()
+            return target
+        except Exception as e:
+            logger.error(f"Erreur lors de la création de la miniature de {os.path.basename(path)}: {e}")
+            self.failures += 1
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def _video_poster(self, path):
+        """Première image décodable de la vidéo"""
+        capture = cv2.VideoCapture(path)
+        try:
+            ok, frame = capture.read()
+            return frame if ok else None
+        finally:
+            capture.release()
+
+    def _evict(self):
+        """Supprime les miniatures les moins récemment servies (verrou tenu)"""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self):
+        return {
+            'entries': len(self._entries),
+            'total_bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'failures': self.failures
+        }
+
+
+class PhotoService:
+    """Prises de vue en arrière-plan, une par une ou en rafale.
+
+    Les demandes sont mises en file et numérotées ; un seul thread capture
+    le flux principal (pleine résolution) de la configuration en cours, sans
+    interrompre le flux ni l'enregistrement. L'encodage JPEG et l'écriture
+    sur disque se font dans un pool de threads. Les derniers travaux restent
+    consultables par leur identifiant.
+    """
+
+    MAX_JOBS = 50
+
+    def __init__(self, capture_frame, photos_dir, on_saved=None, workers=2, quality=90):
+        self.capture_frame = capture_frame
+        self.photos_dir = photos_dir
+        self.on_saved = on_saved
+        self.quality = quality
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._next_id = 1
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photo-writer')
+        self._thread = threading.Thread(target=self._capture_loop, name='photo-capture')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, count=1, interval=0.0):
+        """Met en file une prise de vue de `count` images espacées de `interval` secondes"""
+        with self._lock:
+            job = {
+                'id': self._next_id,
+                'status': 'queued',
+                'count': count,
+                'interval': interval,
+                'captured': 0,
+                'files': [],
+                'requested_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'capture_fps': None,
+                'fps': None,
+                'elapsed_s': None,
+                'error': None
+            }
+            self._next_id += 1
+            self._jobs[job['id']] = job
+            while len(self._jobs) > self.MAX_JOBS:
+                self._jobs.popitem(last=False)
+        self._queue.put(job)
+        return dict(job)
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, files=list(job['files'])) if job else None
+
+    def _capture_loop(self):
+        """Capture les images des travaux dans l'ordre, à cadence fixe pour les rafales"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            job['status'] = 'capturing'
+            started = time.monotonic()
+            pending = []
+            try:
+                for index in range(job['count']):
+                    # Cadence fixe : les captures sont calées sur l'heure de début
+                    delay = started + index * job['interval'] - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    with CAPTURE_SECONDS['photo'].time():
+                        frame = self.capture_frame()
+                    captured_at = datetime.now()
+                    job['captured'] += 1
+                    pending.append(self._executor.submit(self._save, job, frame, captured_at, index))
+                capture_seconds = time.monotonic() - started
+                job['status'] = 'encoding'
+                for future in pending:
+                    future.result()
+                total_seconds = time.monotonic() - started
+                # Débit des captures seules, puis de bout en bout (fichiers écrits)
+                job['capture_fps'] = round(job['count'] / capture_seconds, 2)
+                job['fps'] = round(job['count'] / total_seconds, 2)
+                job['elapsed_s'] = round(total_seconds, 3)
+                job['status'] = 'done'
+                logger.info(f"Photo(s) prise(s): {len(job['files'])} (travail {job['id']})")
+            except Exception as e:
+                job['status'] = 'error'
+                job['error'] = str(e)
+                logger.error(f"Erreur lors de la prise de photo: {e}")
+
+    def _save(self, job, frame, captured_at, index):
+        """Encode une image en JPEG et l'écrit (thread du pool)"""
+        with PHOTO_ENCODE_SECONDS.time():
+            if frame.ndim == 3 and frame.shape[2] == 4:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+            ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise RuntimeError("Encodage JPEG impossible")
+        suffix = f"_{index + 1:03d}" if job['count'] > 1 else ''
+        filename = os.path.join(self.photos_dir,
+                                f"photo_{captured_at.strftime('%Y%m%d_%H%M%S')}_{captured_at.microsecond // 1000:03d}{suffix}.jpg")
+        with open(filename, 'wb') as f:
+            f.write(jpeg.tobytes())
+        with self._lock:
+            job['files'].append(os.path.basename(filename))
+        if self.on_saved is not None:
+            self.on_saved(filename)
+        return filename
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=True)
+
+    def get_stats(self):
+        with self._lock:
+            active = [job['id'] for job in self._jobs.values() if job['status'] in ('queued', 'capturing', 'encoding')]
+        return {'queued_jobs': self._queue.qsize(), 'active_jobs': active}
+
+
+class FakeCamera:
+    """Backend caméra simulé, compatible avec la partie de l'API Picamera2 utilisée ici.
+
+    Les images sont synthétiques (bruit fixe et rectangle qui se déplace) ou
+    rejouées depuis une vidéo ou un dossier d'images. Les captures sont
+    cadencées au framerate comme sur une vraie caméra, `post_callback` est
+    appelé à chaque frame en temps réel, et les encodeurs produisent des
+    frames H.264 factices au débit demandé.
+    """
+
+    def __init__(self, source=None, framerate=30, realtime=True):
+        self.source = source
+        self.framerate = framerate
+        self.realtime = realtime
+        self.camera_config = None
+        self.started = False
+        self.post_callback = None
+        self._clock = None
+        self._start_time = time.monotonic()
+        self._frame_index = 0
+        self._lock = threading.Lock()
+        self._backgrounds = {}
+        self._replay = None
+        self._replay_files = None
+        self._encoders = {}  # encodeur -> (thread, événement d'arrêt, sortie)
+
+        if source and os.path.isdir(source):
+            self._replay_files = sorted(
+                os.path.join(source, name) for name in os.listdir(source)
+                if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))
+            )
+        elif source:
+            self._replay = cv2.VideoCapture(source)
+
+    def create_video_configuration(self, main=None, lores=None, **kwargs):
+        return dict(kwargs, main=main or {'size': (1920, 1080)}, lores=lores)
+
+    create_preview_configuration = create_video_configuration
+    create_still_configuration = create_video_configuration
+
+    def configure(self, config):
+        self.camera_config = config
+
+    def start(self):
+        self.started = True
+        self._start_time = time.monotonic()
+        if self.realtime and (self._clock is None or not self._clock.is_alive()):
+            self._clock = threading.Thread(target=self._clock_loop, name='fake-camera-clock')
+            self._clock.daemon = True
+            self._clock.start()
+
+    def stop(self):
+        self.started = False
+
+    def _clock_loop(self):
+        """Appelle post_callback à chaque frame, comme la boucle d'événements de Picamera2"""
+        while self.started and self.realtime:
+            self._wait_next_frame()
+            callback = self.post_callback
+            if callback is not None:
+                callback(None)
+
+    def close(self):
+        self.stop_encoder()
+        self.stop()
+        if self._replay is not None:
+            self._replay.release()
+
+    def _wait_next_frame(self):
+        """Attend la prochaine frame du capteur simulé et retourne son numéro"""
+        if not self.realtime:
+            with self._lock:
+                self._frame_index += 1
+                return self._frame_index
+        elapsed = time.monotonic() - self._start_time
+        index = int(elapsed * self.framerate) + 1
+        time.sleep(max(0, self._start_time + index / self.framerate - time.monotonic()))
+        return index
+
+    def _scene(self, index, size):
+        """Image BGR de la scène pour le numéro de frame donné"""
+        width, height = size
+        if self._replay is not None:
+            with self._lock:
+                ok, frame = self._replay.read()
+                if not ok:
+                    self._replay.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    ok, frame = self._replay.read()
+            if ok:
+                return cv2.resize(frame, (width, height))
+        if self._replay_files:
+            frame = cv2.imread(self._replay_files[index % len(self._replay_files)])
+            if frame is not None:
+                return cv2.resize(frame, (width, height))
+
+        background = self._backgrounds.get(size)
+        if background is None:
+            rng = np.random.default_rng(0)
+            background = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+            self._backgrounds[size] = background
+        frame = background.copy()
+
+        # Un rectangle traverse l'image en 4 secondes, puis la scène reste calme 4 secondes
+        period = self.framerate * 8
+        position = index % period
+        if position < period // 2:
+            box = max(width // 8, 2)
+            x = position * (width - box) // (period // 2)
+            y = height // 3
+            cv2.rectangle(frame, (x, y), (x + box, y + box), (230, 230, 230), -1)
+        return frame
+
+    def capture_array(self, name='main'):
+        """Capture une image du flux demandé (BGRA pour main, I420 pour YUV420)"""
+        stream = self.camera_config[name]
+        index = self._wait_next_frame()
+        frame = self._scene(index, tuple(stream['size']))
+        if stream.get('format') == 'YUV420':
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)
+
+    def capture_file(self, filename, name='main', **kwargs):
+        """Enregistre une image du flux principal"""
+        index = self._wait_next_frame()
+        cv2.imwrite(filename, self._scene(index, tuple(self.camera_config[name]['size'])))
+
+    def capture_metadata(self):
+        index = self._wait_next_frame()
+        return {'SensorTimestamp': int(index * 1000000000 / self.framerate),
+                'FrameDuration': int(1000000 / self.framerate)}
+
+    def start_encoder(self, encoder, output, **kwargs):
+        """Démarre un encodeur simulé qui alimente `output`"""
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self._encoder_loop, args=(encoder, output, stop_event),
+                                  name='fake-encoder')
+        thread.daemon = True
+        output.start()
+        self._encoders[encoder] = (thread, stop_event, output)
+        thread.start()
+
+    def stop_encoder(self, encoders=None):
+        """Arrête un encodeur simulé (ou tous)"""
+        if encoders is None:
+            encoders = list(self._encoders)
+        elif not isinstance(encoders, (list, tuple, set)):
+            encoders = [encoders]
+        for encoder in encoders:
+            entry = self._encoders.pop(encoder, None)
+            if entry is None:
+                continue
+            thread, stop_event, output = entry
+            stop_event.set()
+            thread.join()
+            output.stop()
+
+    def start_recording(self, encoder, output, **kwargs):
+        self.start_encoder(encoder, output)
+        self.start()
+
+    def stop_recording(self):
+        self.stop_encoder()
+        self.stop()
+
+    def _encoder_loop(self, encoder, output, stop_event):
+        """Produit des frames H.264 factices au débit et au framerate configurés"""
+        bitrate = getattr(encoder, 'bitrate', None) or 10000000
+        iperiod = getattr(encoder, 'iperiod', None) or self.framerate
+        frame_size = max(int(bitrate / 8 / self.framerate), 16)
+        interframe = bytes(frame_size)
+        keyframe_data = bytes(frame_size * 4)
+
+        count = 0
+        next_frame = time.monotonic()
+        while not stop_event.is_set():
+            keyframe = count % iperiod == 0
+            timestamp = int((time.monotonic() - self._start_time) * 1000000)
+            output.outputframe(keyframe_data if keyframe else interframe, keyframe, timestamp)
+            count += 1
+            next_frame += 1.0 / self.framerate
+            stop_event.wait(max(0, next_frame - time.monotonic()))
+
+
+def create_camera_backend(backend='picamera2', framerate=30):
+    """Crée le backend caméra : 'picamera2', 'fake' ou chemin d'une vidéo / d'un dossier d'images à rejouer"""
+    if backend == 'picamera2':
+        if Picamera2 is None:
+            raise RuntimeError("picamera2 introuvable (utiliser SURVEILLANCE_CAMERA=fake hors Raspberry Pi)")
+        return Picamera2()
+    if backend == 'fake':
+        return FakeCamera(framerate=framerate)
+    return FakeCamera(source=backend, framerate=framerate)
+
+
+def default_config():
+    """Configuration par défaut (détection automatique du répertoire utilisateur)"""
+    username = pwd.getpwuid(os.getuid()).pw_name
+    base_dir = f'/home/{username}/surveillance'
+    
+    return {
+        'video_dir': f'{base_dir}/videos',
+        'photos_dir': f'{base_dir}/photos',
+        'index_path': f'{base_dir}/media_index.db',
+        'events_path': f'{base_dir}/motion_events.db',
+        'thumbnails_dir': f'{base_dir}/thumbnails',
+        'photo_quality': 90,        # Qualité JPEG des photos
+        'photo_burst_max': 100,     # Images maximales par rafale
+        'thumbnail_cache_bytes': 32 * 1024 * 1024,  # Taille maximale du cache de miniatures
+        'thumbnail_width': 320,                      # Largeur des miniatures
+        'max_video_duration': 300,  # 5 minutes max par vidéo
+        'motion_threshold': 1000,   # Seuil de détection de mouvement (pixels à 640x480)
+        'motion_downscale': 4,      # Sous-échantillonnage du plan Y lores avant comparaison
+        'motion_pixel_threshold': 30,       # Écart de luminosité au fond pour qu'un pixel compte
+        'motion_learning_rate': 0.05,       # Vitesse d'adaptation du modèle de fond
+        'motion_lighting_ratio': 0.6,       # Part de l'image modifiée considérée comme un changement d'éclairage
+        'motion_trigger_frames': 2,         # Frames actives consécutives pour déclencher
+        'motion_release_ratio': 0.5,        # Seuil de relâchement (fraction du seuil de déclenchement)
+        'motion_release_seconds': 3,        # Calme nécessaire avant de relâcher
+        'motion_min_event_seconds': 2,      # Durée minimale d'un événement
+        # Zones optionnelles (coordonnées relatives), ex. {'name': 'porte', 'polygon': [(0, 0), (0.5, 0), (0.5, 1), (0, 1)], 'threshold': 500}
+        'motion_zones': [],
+        'motion_check_interval': 0.5,       # Secondes entre deux analyses (cadence fixe, sans motion_adaptive)
+        'motion_adaptive': True,            # Cadence et taille des analyses selon l'activité (MotionScheduler)
+        'motion_idle_interval': 1.0,        # Secondes entre deux analyses sur une scène calme
+        'motion_active_interval': 0.1,      # Secondes entre deux analyses pendant un mouvement
+        'motion_idle_downscale': 2,         # Sous-échantillonnage supplémentaire des analyses au repos
+        'motion_candidate_ratio': 0.25,     # Part du seuil qui suffit à passer en cadence rapide
+        'motion_backoff_delay': 2.0,        # Secondes sans activité avant de ralentir
+        'motion_backoff_curve': 'exponential',  # 'exponential' ou 'linear'
+        'motion_backoff_factor': 1.5,       # Intervalle multiplié à chaque analyse calme (exponential)
+        'motion_backoff_step': 0.1,         # Secondes ajoutées à chaque analyse calme (linear)
+        'motion_background_refresh': 2.0,   # Analyse complète minimale au repos (suivi de l'éclairage)
+        'motion_worker_process': False,     # Analyse dans un processus séparé (mémoire partagée)
+        'cleanup_days': 7,          # Supprime les fichiers de plus de 7 jours
+        'max_storage_bytes': None,              # Volume maximal des vidéos et photos (None = illimité)
+        'min_free_bytes': 500 * 1024 * 1024,    # Espace libre minimal à préserver sur la carte SD
+        'retention_interval': 60,               # Secondes entre deux passages du service de conservation
+        'retention_batch_size': 10,             # Fichiers supprimés par lot
+        'retention_batch_pause': 0.2,           # Pause entre deux lots (secondes)
+        'resolution': (1920, 1080), # Résolution vidéo (flux principal, encodé en H.264)
+        'lores_size': (640, 360),   # Flux lores YUV420 pour le streaming et le mouvement
+        'stream_quality': 80,       # Qualité JPEG par défaut du flux
+        'stream_fps': 10,           # Images par seconde par défaut du flux
+        'stream_max_profiles': 4,   # Profils de flux (taille, qualité, images/s) encodés simultanément
+        'async_max_connections': 64,    # Connexions simultanées maximales (serveur --async)
+        'async_client_queue': 2,        # Frames en attente par client avant abandon des plus anciennes
+        # Couches incrustées sur le flux, ex. {'type': 'text', 'text': 'Entrée', 'position': (10, 60)}
+        # ou {'type': 'zones', 'zones': [[(0.1, 0.5), (0.5, 0.5), (0.5, 0.9)]]}
+        'overlay_layers': [{'type': 'timestamp'}, {'type': 'recording'}, {'type': 'motion'}],
+        'framerate': 30,
+        'bitrate': 10000000,
+        'bitrate_adaptive': True,       # Débit des enregistrements réduit quand la scène est calme
+        'bitrate_min_ratio': 0.25,      # Part minimale du débit (scène immobile)
+        'bitrate_motion_window': 10,    # Secondes pendant lesquelles un mouvement maintient le débit
+        'bitrate_restart_step': 0.25,   # Écart (part du maximum) qui fait redémarrer un encodeur au nouveau débit
+        'record_buffer_bytes': 16 * 1024 * 1024,   # Buffer mémoire des écritures vidéo (au-delà, l'encodeur attend)
+        'record_write_chunk': 1024 * 1024,         # Taille des blocs écrits sur la carte SD
+        'record_fsync_bytes': 8 * 1024 * 1024,     # fsync après ce volume écrit...
+        'record_fsync_seconds': 2.0,               # ... ou après ce délai
+        'camera_backend': os.environ.get('SURVEILLANCE_CAMERA', 'picamera2'),  # 'picamera2', 'fake' ou fichier à rejouer
+        'camera_warmup_timeout': 2.0,          # Attente maximale de la convergence de l'exposition (secondes)
+        'preroll_seconds': 3,                  # Secondes conservées avant un mouvement (0 = désactivé)
+        'preroll_max_bytes': 8 * 1024 * 1024,  # Mémoire maximale du buffer de pré-enregistrement
+        'continuous_recording': False,  # Enregistrement continu en segments (archive et direct HLS)
+        'segments_dir': f'{base_dir}/segments',
+        'segment_seconds': 6,           # Durée visée d'un segment (coupé sur l'image clé suivante)
+        'segment_stream': 'lores',      # Flux encodé en continu : 'lores' (léger) ou 'main'
+        'segment_bitrate': 1500000,
+        'hls_list_size': 6              # Segments dans la playlist du direct
+    }
+
+
 class SurveillanceCamera:
-    def __init__(self):
+    def __init__(self, config=None, open_camera=True, startup=None):
         self.picam2 = None
+        self.startup = startup or StartupReport()  # Bilan de démarrage propre à cette caméra
+        self.camera_ready = threading.Event()  # Capteur ouvert et première image reçue
         self.is_recording = False
         self.motion_detection_active = False
         self.last_motion_time = None
         self.recording_thread = None
         self.motion_thread = None
-        
-        # Configuration (détection automatique du répertoire utilisateur)
-        import pwd
-        username = pwd.getpwuid(os.getuid()).pw_name
-        base_dir = f'/home/{username}/surveillance'
-        
-        self.config = {
-            'video_dir': f'{base_dir}/videos',
-            'photos_dir': f'{base_dir}/photos',
-            'max_video_duration': 300,  # 5 minutes max par vidéo
-            'motion_threshold': 1000,   # Seuil de détection de mouvement
-            'cleanup_days': 7,          # Supprime les fichiers de plus de 7 jours
-            'resolution': (1920, 1080), # Résolution vidéo
-            'framerate': 30
+        self.current_recording_file = None
+        self.recording_trigger = None  # 'manual' ou 'motion' (enregistrement en cours)
+        self.started_at = datetime.now()
+        self._started_monotonic = time.monotonic()
+        self.preroll_encoder = None
+        self.preroll_output = None
+        self.recording_encoder = None
+        self.recording_output = None
+        self.recording_file = None
+        self.segment_encoder = None
+        self.segment_output = None
+        self._encoder_lock = threading.Lock()  # Arrêts d'encodeurs et redémarrages au nouveau débit
+        self._bitrate_restart = None
+        self.bitrate_restarts = 0
+        self._record_start_requested = None
+        self.recording_latency = {
+            'last_start_ms': None,  # Demande -> première frame écrite dans le fichier
+            'last_stop_ms': None,
+            'average_start_ms': None,
+            'starts_measured': 0
         }
         
+        # Configuration par défaut, puis surcharges éventuelles (tests de performance, backend simulé...)
+        self.config = default_config()
+        self.config.update(config or {})
+        
         # Création des dossiers
         os.makedirs(self.config['video_dir'], exist_ok=True)
         os.makedirs(self.config['photos_dir'], exist_ok=True)
+        os.makedirs(self.config['segments_dir'], exist_ok=True)
+        
+        # Changements d'état poussés aux pages ouvertes (Server-Sent Events)
+        self.events = EventBus()
+        
+        # Index des fichiers enregistrés (évite de parcourir les dossiers à chaque requête)
+        self.media_index = MediaIndex(self.config['index_path'], {
+            'videos': self.config['video_dir'],
+            'photos': self.config['photos_dir'],
+            'segments': self.config['segments_dir']
+        }, on_change=self._on_media_change)
+        
+        # Conservation des fichiers (le fichier en cours d'enregistrement est protégé)
+        self.retention = RetentionService(
+            self.media_index, self.config,
+            lambda: {self.current_recording_file} if self.is_recording else set()
+        )
+        
+        # Journal des événements de mouvement
+        self.motion_events = MotionEventLog(self.config['events_path'])
+        
+        # Prises de vue en arrière-plan (file de captures, encodage dans un pool)
+        self.photos = PhotoService(self.capture_photo_frame, self.config['photos_dir'],
+                                   on_saved=lambda path: self.media_index.add('photos', path),
+                                   quality=self.config['photo_quality'])
+        
+        # Miniatures des vidéos et photos, générées à la demande
+        self.thumbnails = ThumbnailCache(self.config['thumbnails_dir'], self.config['thumbnail_cache_bytes'],
+                                         self.config['thumbnail_width'])
         
-        # Initialisation de la caméra
-        self.init_camera()
+        # Incrustations mises en cache
+        self.overlay = OverlayCompositor(build_overlay_layers(self.config['overlay_layers']))
+        
+        # Une seule capture, puis un encodeur par profil de flux pour tous ses clients
+        self.stream_hub = StreamHub(self.capture_stream_frame, self.add_overlay, self.config['stream_max_profiles'])
+        
+        # Métriques lues à la volée
+        METRICS.gauge('surveillance_stream_clients', "Clients connectés au flux vidéo",
+                      read=lambda: sum(entry['clients'] for entry in self.stream_hub.get_stats()))
+        METRICS.gauge('surveillance_event_clients', "Pages abonnées aux événements (/updates)",
+                      read=lambda: self.events.clients)
+        METRICS.gauge('surveillance_recording', "1 si un enregistrement est en cours",
+                      read=lambda: int(self.is_recording))
+        METRICS.gauge('surveillance_uptime_seconds', "Secondes depuis le démarrage",
+                      read=lambda: round(time.monotonic() - self._started_monotonic))
         
         # Variables pour la détection de mouvement
-        self.previous_frame = None
+        self.motion_detector = MotionDetector(self.config)
+        self.motion_scheduler = MotionScheduler(self.config)
+        self.bitrate_policy = BitratePolicy(self.config)
         self.motion_detected = False
+        self.motion_worker = None
+        METRICS.gauge('surveillance_motion_check_rate', "Analyses de mouvement prévues par seconde",
+                      read=lambda: self.motion_scheduler.get_stats()['rate_hz'] or 0)
+        
+        # Initialisation de la caméra (ou plus tard via open_camera_async)
+        if open_camera:
+            self.init_camera()
         
     def init_camera(self):
-        """Initialise la caméra Pi"""
+        """Initialise la caméra Pi (ou le backend simulé)"""
         try:
-            self.picam2 = Picamera2()
-            
-            # Configuration de prévisualisation
-            preview_config = self.picam2.create_preview_configuration(
-                main={"size": (640, 480)},
-                lores={"size": (320, 240), "format": "YUV420"}
-            )
-            self.picam2.configure(preview_config)
+            opened = time.perf_counter()
+            self.picam2 = create_camera_backend(self.config['camera_backend'], self.config['framerate'])
             
-            # Configuration vidéo pour l'enregistrement
+            # Configuration unique et permanente : le flux principal alimente
+            # l'encodeur H.264, le flux lores sert au streaming et au mouvement.
+            # Les enregistrements s'y greffent sans arrêter la caméra.
             self.video_config = self.picam2.create_video_configuration(
                 main={"size": self.config['resolution']},
-                lores={"size": (320, 240), "format": "YUV420"}
+                lores={"size": self.config['lores_size'], "format": "YUV420"}
             )
+            self.picam2.configure(self.video_config)
             
             self.picam2.start()
-            time.sleep(2)
-            logger.info("Caméra initialisée avec succès")
+            self.startup.record('camera_open', time.perf_counter() - opened)
+            self._wait_sensor_ready()
+            self.startup.record('ready', time.perf_counter() - _IMPORT_STARTED)
+            self.camera_ready.set()
+            self.events.publish('camera', {'ready': True})
+            logger.info(f"Caméra initialisée avec succès ({self.startup.summary()})")
             
         except Exception as e:
+            self.startup.error = str(e)
             logger.error(f"Erreur lors de l'initialisation de la caméra: {e}")
             raise
     
-    def generate_frames(self):
-        """Générateur de frames pour le streaming"""
-        while True:
+    def _wait_sensor_ready(self):
+        """Attend la première image, puis la convergence de l'exposition (au lieu d'une pause fixe)"""
+        started = time.perf_counter()
+        metadata = self.picam2.capture_metadata()
+        self.startup.record('first_frame', time.perf_counter() - started)
+        
+        # AeLocked (ou AeState == 2 sur les libcamera récentes) ; absent du backend simulé
+        started = time.perf_counter()
+        deadline = started + self.config['camera_warmup_timeout']
+        while time.perf_counter() < deadline:
+            if 'AeLocked' in metadata:
+                converged = metadata['AeLocked']
+            else:
+                converged = metadata.get('AeState', 2) == 2
+            if converged:
+                break
+            metadata = self.picam2.capture_metadata()
+        else:
+            logger.warning("Exposition non stabilisée à la fin du délai de préchauffage")
+        self.startup.record('exposure', time.perf_counter() - started)
+    
+    def open_camera_async(self, on_ready=None, on_error=None):
+        """Ouvre la caméra en arrière-plan : le serveur web répond pendant l'initialisation"""
+        def run():
             try:
-                # Capture d'une frame
-                frame = self.picam2.capture_array()
-                
-                # Conversion BGR vers RGB pour Flask
-                if len(frame.shape) == 3:
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                else:
-                    frame_rgb = frame
-                
-                # Ajout d'informations sur l'image
-                self.add_overlay(frame_rgb)
-                
-                # Encodage JPEG
-                _, buffer = cv2.imencode('.jpg', frame_rgb)
-                frame_bytes = buffer.tobytes()
-                
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                
-                time.sleep(0.1)  # Limite le framerate pour économiser les ressources
-                
+                self.init_camera()
             except Exception as e:
-                logger.error(f"Erreur lors de la génération des frames: {e}")
-                break
+                if on_error:
+                    on_error(e)
+                return
+            if on_ready:
+                on_ready()
+        
+        thread = threading.Thread(target=run, name='camera-init')
+        thread.daemon = True
+        thread.start()
+        return thread
+    
+    def capture_stream_frame(self):
+        """Capture une frame du flux lores pour le streaming"""
+        self.camera_ready.wait()  # Les spectateurs connectés pendant l'initialisation attendent la caméra
+        with CAPTURE_SECONDS['lores'].time():
+            yuv = self.picam2.capture_array("lores")
+        
+        # Conversion YUV420 vers BGR pour l'encodage JPEG
+        with STREAM_STAGE_SECONDS['convert'].time():
+            return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+    
+    def stream_profile(self, width=None, height=None, quality=None, fps=None):
+        """Construit un profil de flux valide à partir de paramètres optionnels"""
+        lores_width, lores_height = self.config['lores_size']
+        
+        # Jamais plus grand que le flux lores ; rapport largeur/hauteur conservé si besoin
+        if width and not height:
+            height = width * lores_height // lores_width
+        elif height and not width:
+            width = height * lores_width // lores_height
+        width = min(max(int(width or lores_width), 16), lores_width) // 2 * 2
+        height = min(max(int(height or lores_height), 16), lores_height) // 2 * 2
+        
+        quality = min(max(int(quality or self.config['stream_quality']), 10), 95)
+        fps = min(max(int(fps or self.config['stream_fps']), 1), self.config['framerate'])
+        return StreamProfile(width, height, quality, fps)
+    
+    def generate_frames(self, profile=None):
+        """Générateur de frames pour le streaming (un encodage par profil, partagé entre clients)"""
+        for frame_bytes in self.stream_hub.frames(profile or self.stream_profile()):
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
     
     def add_overlay(self, frame):
-        """Ajoute des informations sur l'image"""
+        """Ajoute des informations sur l'image (couches mises en cache)"""
+        self.overlay.apply(frame, {
+            'time': time.time(),
+            'recording': self.is_recording,
+            'motion_active': self.motion_detection_active,
+            'motion_detected': self.motion_detected
+        })
+    
+    def add_overlay_uncached(self, frame):
+        """Ajoute des informations sur l'image en les redessinant (référence pour les mesures)"""
         # Timestamp
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         cv2.putText(frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
@@ -133,30 +3297,47 @@ class SurveillanceCamera:
             color = (0, 255, 0) if self.motion_detected else (255, 255, 0)
             cv2.putText(frame, status, (10, frame.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
     
-    def start_recording(self, duration=None):
-        """Démarre l'enregistrement vidéo"""
+    def start_recording(self, duration=None, trigger='manual'):
+        """Démarre l'enregistrement vidéo (sans arrêter la caméra) ; `trigger` : 'manual' ou 'motion'"""
         if self.is_recording:
             logger.warning("Enregistrement déjà en cours")
             return False
         
+        # Jamais plus long que max_video_duration (l'archive longue relève de l'enregistrement continu)
+        duration = min(duration or self.config['max_video_duration'], self.config['max_video_duration'])
+        
         try:
-            # Reconfiguration pour l'enregistrement
-            self.picam2.stop()
-            self.picam2.configure(self.video_config)
-            
             # Nom du fichier avec timestamp
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = os.path.join(self.config['video_dir'], f"video_{timestamp}.mp4")
             
-            # Configuration de l'encodeur
-            encoder = H264Encoder(bitrate=10000000)
-            output = FileOutput(filename)
+            self._record_start_requested = time.monotonic()
+            # Index des images clés écrit en parallèle, pour l'extraction de passages
+            width, height = self.config['resolution']
+            keyframe_index = KeyframeIndex(filename, width, height, self.config['framerate'])
+            if self.preroll_output is not None:
+                # L'encodeur tourne déjà : on vide le pré-enregistrement dans le fichier
+                flushed = self.preroll_output.start_file(self._open_recording_file(filename),
+                                                         self._on_recording_first_frame, keyframe_index)
+                logger.info(f"Pré-enregistrement écrit: {flushed} octets")
+            else:
+                # Encodeur greffé sur le flux principal, la caméra continue de tourner ;
+                # une image clé par seconde avec SPS/PPS pour pouvoir extraire un passage
+                self.recording_encoder = H264Encoder(bitrate=self.bitrate_policy.choose(self.config['bitrate']),
+                                                     repeat=True, iperiod=self.config['framerate'])
+                self.recording_output = RecordingOutput(self._open_recording_file(filename),
+                                                        self._on_recording_first_frame, keyframe_index)
+                self.picam2.start_encoder(self.recording_encoder, self.recording_output)
             
-            self.picam2.start_recording(encoder, output)
             self.is_recording = True
+            self.recording_trigger = trigger
             self.current_recording_file = filename
+            self.media_index.add('videos', filename)
+            self.motion_events.link_recording(filename)
+            RECORDINGS_STARTED.inc()
             
             logger.info(f"Enregistrement démarré: {filename}")
+            self.events.publish('recording', {'active': True, 'file': os.path.basename(filename)})
             
             # Thread pour arrêter automatiquement après la durée spécifiée
             if duration:
@@ -164,172 +3345,447 @@ class SurveillanceCamera:
                     target=self._stop_recording_after_delay,
                     args=(duration,)
                 )
+                self.recording_thread.daemon = True
                 self.recording_thread.start()
             
             return True
             
         except Exception as e:
             logger.error(f"Erreur lors du démarrage de l'enregistrement: {e}")
+            self.recording_encoder = None
+            self.recording_output = None
+            return False
+    
+    def _open_recording_file(self, filename):
+        """Fichier vidéo en écriture différée (buffer mémoire, gros blocs alignés, fsync groupés)"""
+        self.recording_file = WriteBehindFile(filename, self.config['record_buffer_bytes'],
+                                              self.config['record_write_chunk'], self.config['record_fsync_bytes'],
+                                              self.config['record_fsync_seconds'])
+        return self.recording_file
+    
+    def _on_recording_first_frame(self):
+        """Mesure la latence de démarrage à la première frame écrite"""
+        if self._record_start_requested is None:
+            return
+        latency_ms = (time.monotonic() - self._record_start_requested) * 1000
+        self._record_start_requested = None
+        RECORD_START_SECONDS.observe(latency_ms / 1000)
+        
+        stats = self.recording_latency
+        count = stats['starts_measured']
+        average = stats['average_start_ms'] or 0
+        stats['last_start_ms'] = round(latency_ms, 1)
+        stats['average_start_ms'] = round((average * count + latency_ms) / (count + 1), 1)
+        stats['starts_measured'] = count + 1
+    
+    def stop_recording(self):
+        """Arrête l'enregistrement vidéo (sans arrêter la caméra)"""
+        if not self.is_recording:
+            return False
+        
+        try:
+            stop_started = time.monotonic()
+            with self._encoder_lock:
+                if self.recording_encoder is not None:
+                    self.picam2.stop_encoder(self.recording_encoder)
+                    self.recording_encoder = None
+                    self.recording_output = None
+                elif self.preroll_output is not None:
+                    # Seul le fichier est fermé, l'encodeur continue
+                    self.preroll_output.stop_file()
+            self.is_recording = False
+            self.media_index.add('videos', self.current_recording_file)
+            stop_seconds = time.monotonic() - stop_started
+            self.recording_latency['last_stop_ms'] = round(stop_seconds * 1000, 1)
+            RECORD_STOP_SECONDS.observe(stop_seconds)
+            
+            logger.info("Enregistrement arrêté")
+            self.events.publish('recording', {'active': False, 'file': os.path.basename(self.current_recording_file)})
+            
+            # Le pré-enregistrement reprend s'il avait été différé, ou s'arrête s'il
+            # n'était plus gardé que pour un enregistrement manuel
+            if self.motion_detection_active:
+                self.start_preroll()
+            elif self.preroll_output is not None:
+                self.stop_preroll()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de l'arrêt de l'enregistrement: {e}")
             return False
     
-    def stop_recording(self):
-        """Arrête l'enregistrement vidéo"""
-        if not self.is_recording:
+    def _stop_recording_after_delay(self, duration):
+        """Arrête l'enregistrement après un délai"""
+        time.sleep(duration)
+        if self.is_recording:
+            self.stop_recording()
+    
+    def take_photo(self, count=1, interval=0.0):
+        """Met en file une photo (ou une rafale) et retourne le travail correspondant"""
+        count = min(max(int(count), 1), self.config['photo_burst_max'])
+        return self.photos.submit(count, max(float(interval), 0.0))
+    
+    def capture_photo_frame(self):
+        """Image pleine résolution du flux principal, sans changer de configuration"""
+        return self.picam2.capture_array("main")
+    
+    def capture_motion_frame(self):
+        """Capture le plan de luminance (Y) du flux lores, sans conversion"""
+        with CAPTURE_SECONDS['motion'].time():
+            yuv = self.picam2.capture_array("lores")
+        
+        # En YUV420, les `height` premières lignes forment le plan Y
+        width, height = self.config['lores_size']
+        luma = yuv[:height, :width]
+        
+        # Sous-échantillonnage : la petite copie contiguë libère le buffer complet
+        step = self.config['motion_downscale']
+        if step > 1:
+            luma = np.ascontiguousarray(luma[::step, ::step])
+        return luma
+    
+    def detect_motion(self, frame):
+        """Détecte le mouvement dans une frame (BGR ou déjà en niveaux de gris)"""
+        # Conversion en niveaux de gris (inutile pour le plan Y du flux lores)
+        if frame.ndim == 3:
+            gray_current = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        else:
+            gray_current = frame
+        
+        # Modèle de fond, zones et hystérésis
+        previous = self.motion_detected
+        with MOTION_DETECT_SECONDS.time():
+            self.motion_detected = self.motion_detector.process(gray_current)
+        self.bitrate_policy.observe(self.motion_detector.last_score)
+        self._adapt_bitrates()
+        self.motion_events.observe(self.motion_detected, max(self.motion_detector.last_pixels.values(), default=0),
+                                   self.motion_detector.last_bbox)
+        if self.motion_detected:
+            self.last_motion_time = datetime.now()
+        if self.motion_detected != previous:
+            self._publish_motion()
+        return self.motion_detected
+    
+    def _publish_motion(self):
+        """Signale un début ou une fin de mouvement aux pages ouvertes"""
+        self.events.publish('motion', {
+            'detected': self.motion_detected,
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+    
+    def _on_media_change(self, action, kind, name, size):
+        """Vidéo ou photo ajoutée, mise à jour ou supprimée (les segments ne sont pas signalés)"""
+        if kind in ('videos', 'photos'):
+            self.events.publish(f'file_{action}', {'kind': kind, 'name': name, 'size': size})
+    
+    def start_continuous_recording(self):
+        """Enregistrement continu en segments MPEG-TS, publiés en HLS"""
+        if self.segment_output is not None:
             return False
-        
         try:
-            self.picam2.stop_recording()
-            self.is_recording = False
-            
-            # Retour à la configuration de prévisualisation
-            self.picam2.stop()
-            preview_config = self.picam2.create_preview_configuration(
-                main={"size": (640, 480)},
-                lores={"size": (320, 240), "format": "YUV420"}
+            # Une image clé par seconde : les segments sont coupés au plus tard 1 s après leur durée visée
+            self.segment_encoder = H264Encoder(bitrate=self.bitrate_policy.choose(self.config['segment_bitrate']),
+                                               repeat=True, iperiod=self.config['framerate'])
+            self.segment_output = SegmentedRecordingOutput(
+                self.config['segments_dir'], self.config['segment_seconds'], self.config['hls_list_size'],
+                on_segment=lambda path: self.media_index.add('segments', path)
             )
-            self.picam2.configure(preview_config)
-            self.picam2.start()
-            
-            logger.info("Enregistrement arrêté")
+            self.picam2.start_encoder(self.segment_encoder, self.segment_output, name=self.config['segment_stream'])
+            logger.info(f"Enregistrement continu démarré ({self.config['segment_seconds']} s par segment)")
             return True
-            
         except Exception as e:
-            logger.error(f"Erreur lors de l'arrêt de l'enregistrement: {e}")
+            logger.error(f"Erreur lors du démarrage de l'enregistrement continu: {e}")
+            self.segment_encoder = None
+            self.segment_output = None
             return False
     
-    def _stop_recording_after_delay(self, duration):
-        """Arrête l'enregistrement après un délai"""
-        time.sleep(duration)
-        if self.is_recording:
-            self.stop_recording()
+    def stop_continuous_recording(self):
+        """Arrête l'enregistrement continu (le dernier segment est publié)"""
+        if self.segment_output is None:
+            return False
+        with self._encoder_lock:
+            try:
+                self.picam2.stop_encoder(self.segment_encoder)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'arrêt de l'enregistrement continu: {e}")
+            self.segment_encoder = None
+            self.segment_output = None
+        logger.info("Enregistrement continu arrêté")
+        return True
     
-    def take_photo(self):
-        """Prend une photo"""
+    def start_preroll(self):
+        """Lance l'encodeur H.264 en continu vers le buffer de pré-enregistrement"""
+        if self.preroll_output is not None or self.config['preroll_seconds'] <= 0:
+            return False
+        if self.is_recording:
+            # Repris par stop_recording une fois l'encodeur libéré
+            logger.info("Pré-enregistrement différé jusqu'à la fin de l'enregistrement")
+            return False
+        
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = os.path.join(self.config['photos_dir'], f"photo_{timestamp}.jpg")
+            # Une image clé par seconde pour que le buffer puisse démarrer au plus tôt
+            self.preroll_encoder = H264Encoder(bitrate=self.bitrate_policy.choose(self.config['bitrate']),
+                                               repeat=True, iperiod=self.config['framerate'])
+            self.preroll_output = PreRollOutput(self.config['preroll_seconds'],
+                                                self.config['preroll_max_bytes'])
+            self.picam2.start_encoder(self.preroll_encoder, self.preroll_output)
             
-            # Capture haute résolution pour la photo
-            self.picam2.capture_file(filename)
-            
-            logger.info(f"Photo prise: {filename}")
-            return filename
+            logger.info(f"Pré-enregistrement actif ({self.config['preroll_seconds']} s)")
+            return True
             
         except Exception as e:
-            logger.error(f"Erreur lors de la prise de photo: {e}")
-            return None
+            logger.error(f"Erreur lors du démarrage du pré-enregistrement: {e}")
+            self.preroll_encoder = None
+            self.preroll_output = None
+            return False
     
-    def detect_motion(self, frame):
-        """Détecte le mouvement dans une frame"""
-        if self.previous_frame is None:
-            self.previous_frame = frame
+    def stop_preroll(self):
+        """Arrête l'encodeur de pré-enregistrement"""
+        if self.preroll_output is None:
             return False
         
-        # Conversion en niveaux de gris
-        gray_current = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray_previous = cv2.cvtColor(self.previous_frame, cv2.COLOR_BGR2GRAY)
-        
-        # Différence entre les frames
-        frame_diff = cv2.absdiff(gray_current, gray_previous)
-        
-        # Seuillage
-        _, thresh = cv2.threshold(frame_diff, 30, 255, cv2.THRESH_BINARY)
-        
-        # Calcul du nombre de pixels différents
-        motion_pixels = cv2.countNonZero(thresh)
-        
-        self.previous_frame = frame
+        if self.is_recording and self.recording_encoder is None:
+            # Un enregistrement manuel passe par cet encodeur : arrêt à la fin de l'enregistrement
+            logger.info("Pré-enregistrement conservé jusqu'à la fin de l'enregistrement en cours")
+            return False
         
-        if motion_pixels > self.config['motion_threshold']:
-            self.motion_detected = True
-            self.last_motion_time = datetime.now()
+        try:
+            with self._encoder_lock:
+                self.picam2.stop_encoder(self.preroll_encoder)
+                self.preroll_encoder = None
+                self.preroll_output = None
+            
+            logger.info("Pré-enregistrement arrêté")
             return True
-        else:
-            self.motion_detected = False
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de l'arrêt du pré-enregistrement: {e}")
             return False
     
+    def _live_encoders(self):
+        """Encodeurs en marche : (nom, encodeur, sortie, débit maximal, options de start_encoder)"""
+        live = []
+        if self.preroll_encoder is not None:
+            live.append(('preroll', self.preroll_encoder, self.preroll_output, self.config['bitrate'], {}))
+        if self.recording_encoder is not None:
+            live.append(('recording', self.recording_encoder, self.recording_output, self.config['bitrate'], {}))
+        if self.segment_encoder is not None:
+            live.append(('segment', self.segment_encoder, self.segment_output, self.config['segment_bitrate'],
+                         {'name': self.config['segment_stream']}))
+        return live
+    
+    def _adapt_bitrates(self):
+        """Redémarre en arrière-plan les encodeurs dont le débit ne suit plus l'activité de la scène"""
+        if self._bitrate_restart is not None and self._bitrate_restart.is_alive():
+            return
+        stale = [entry for entry in self._live_encoders()
+                 if self.bitrate_policy.needs_restart(entry[1].bitrate, entry[3])]
+        if stale:
+            self._bitrate_restart = threading.Thread(target=self._restart_encoders, args=(stale,),
+                                                     name='bitrate-restart')
+            self._bitrate_restart.daemon = True
+            self._bitrate_restart.start()
+    
+    def _restart_encoders(self, stale):
+        """Remplace chaque encodeur par un encodeur au débit visé, juste avant sa prochaine image clé.
+
+        La sortie reste ouverte (fichier, buffer de pré-enregistrement,
+        segment en cours) : le GOP en cours est complet et le nouvel encodeur
+        commence par une image clé avec SPS/PPS, le flux reste lisible.
+        """
+        gop = 1.0  # iperiod = framerate : une image clé par seconde
+        for name, encoder, output, maximum, options in stale:
+            if output.last_keyframe_at is not None:
+                wait = output.last_keyframe_at + gop - 0.5 / self.config['framerate'] - time.monotonic()
+                time.sleep(min(max(wait, 0), gop))
+            with self._encoder_lock:
+                if getattr(self, f'{name}_encoder') is not encoder:
+                    continue  # Arrêté entre-temps
+                bitrate = self.bitrate_policy.choose(maximum)
+                replacement = H264Encoder(bitrate=bitrate, repeat=True, iperiod=self.config['framerate'])
+                output.keep_open = True
+                try:
+                    self.picam2.stop_encoder(encoder)
+                    self.picam2.start_encoder(replacement, output, **options)
+                    setattr(self, f'{name}_encoder', replacement)
+                    self.bitrate_restarts += 1
+                    logger.info(f"Débit de l'encodeur {name}: {encoder.bitrate // 1000} -> {bitrate // 1000} kbit/s")
+                except Exception as e:
+                    logger.error(f"Erreur lors du changement de débit de l'encodeur {name}: {e}")
+                finally:
+                    output.keep_open = False
+    
     def start_motion_detection(self):
         """Démarre la détection de mouvement"""
+        self.motion_detector.reset()
+        self.motion_scheduler.reset()
+        if self.config['motion_worker_process']:
+            # Démarré à la première frame, dont il prend les dimensions
+            self.motion_worker = MotionWorker(self.config, self._on_worker_motion_event)
+        self.start_preroll()
         self.motion_detection_active = True
         self.motion_thread = threading.Thread(target=self._motion_detection_loop)
         self.motion_thread.daemon = True
         self.motion_thread.start()
+        # Les analyses sont cadencées par les frames de la caméra
+        self.picam2.post_callback = self._on_camera_frame
         logger.info("Détection de mouvement activée")
+        self.events.publish('motion_detection', {'active': True})
     
     def stop_motion_detection(self):
         """Arrête la détection de mouvement"""
         self.motion_detection_active = False
+        self.picam2.post_callback = None
+        self.motion_scheduler.ready.set()  # Réveille la boucle pour qu'elle se termine
+        if self.motion_thread is not None and self.motion_thread is not threading.current_thread():
+            self.motion_thread.join(timeout=2)
+        if self.motion_worker is not None:
+            self.motion_worker.stop()
+            self.motion_worker = None
+        self.motion_events.observe(False)  # Clôt l'événement en cours
+        # Seuls les enregistrements déclenchés par un mouvement s'arrêtent avec la détection
+        if self.is_recording and self.recording_trigger == 'motion':
+            self.stop_recording()
+        self.stop_preroll()
         logger.info("Détection de mouvement désactivée")
+        self.events.publish('motion_detection', {'active': False})
     
+    def _on_camera_frame(self, request=None):
+        """Callback de la caméra à chaque frame (thread de la caméra : aucun traitement ici)"""
+        self.motion_scheduler.on_frame()
+
     def _motion_detection_loop(self):
-        """Boucle de détection de mouvement"""
+        """Boucle de détection de mouvement, réveillée par le planificateur"""
+        scheduler = self.motion_scheduler
         while self.motion_detection_active:
             try:
-                frame = self.picam2.capture_array()
-                if self.detect_motion(frame):
-                    logger.info("Mouvement détecté!")
-                    # Enregistrement automatique en cas de mouvement
-                    if not self.is_recording:
-                        self.start_recording(60)  # Enregistre 1 minute
-                
-                time.sleep(0.5)  # Vérifie toutes les 0.5 secondes
+                # Réveil par le callback de frame ; le délai ne sert que si la caméra
+                # n'appelle pas post_callback (backend simulé hors temps réel)
+                now = time.monotonic()
+                timeout = scheduler.time_until_due(now)
+                scheduler.ready.wait(timeout + 0.5 if scheduler.frame_driven(now) else timeout)
+                scheduler.ready.clear()
+                now = time.monotonic()
+                if not self.motion_detection_active or not scheduler.due(now):
+                    continue
+
+                cpu_started = time.thread_time()
+                frame = self.capture_motion_frame()
+                full = scheduler.begin_check(frame, now)
+                if full and self.motion_worker is not None:
+                    # Analyse dans le processus dédié, résultat via _on_worker_motion_event
+                    self.motion_worker.submit(frame)
+                elif full:
+                    detected = self.detect_motion(frame)
+                    scheduler.observe(self.motion_detector.last_bbox is not None, now)
+                    if detected:
+                        self._on_motion()
+                scheduler.record_cpu(full, time.thread_time() - cpu_started)
                 
             except Exception as e:
                 logger.error(f"Erreur dans la détection de mouvement: {e}")
                 break
     
+    def _on_motion(self):
+        """Réaction à un mouvement détecté"""
+        logger.info("Mouvement détecté!")
+        # Enregistrement automatique en cas de mouvement
+        if not self.is_recording:
+            self.start_recording(60, trigger='motion')  # Enregistre 1 minute
+    
+    def _on_worker_motion_event(self, event):
+        """Événement renvoyé par le processus d'analyse de mouvement"""
+        self.motion_detected = event['motion']
+        self.motion_scheduler.observe(event['bbox'] is not None, time.monotonic())
+        self.bitrate_policy.observe(event['score'])
+        self._adapt_bitrates()
+        self.motion_events.observe(self.motion_detected, event['pixels'], event['bbox'])
+        if event['changed']:
+            self._publish_motion()
+        if self.motion_detected and self.motion_detection_active:
+            self.last_motion_time = datetime.now()
+            self._on_motion()
+    
     def cleanup_old_files(self):
-        """Supprime les anciens fichiers"""
-        cutoff_date = datetime.now() - timedelta(days=self.config['cleanup_days'])
-        
-        for directory in [self.config['video_dir'], self.config['photos_dir']]:
-            for filename in os.listdir(directory):
-                filepath = os.path.join(directory, filename)
-                if os.path.isfile(filepath):
-                    file_time = datetime.fromtimestamp(os.path.getctime(filepath))
-                    if file_time < cutoff_date:
-                        os.remove(filepath)
-                        logger.info(f"Fichier supprimé: {filename}")
-    
-    def get_file_list(self):
-        """Retourne la liste des fichiers enregistrés"""
-        files = {'videos': [], 'photos': []}
-        
-        # Vidéos
-        for filename in os.listdir(self.config['video_dir']):
-            filepath = os.path.join(self.config['video_dir'], filename)
-            if os.path.isfile(filepath):
-                files['videos'].append({
-                    'name': filename,
-                    'size': os.path.getsize(filepath),
-                    'date': datetime.fromtimestamp(os.path.getctime(filepath)).strftime("%Y-%m-%d %H:%M:%S")
-                })
-        
-        # Photos
-        for filename in os.listdir(self.config['photos_dir']):
-            filepath = os.path.join(self.config['photos_dir'], filename)
-            if os.path.isfile(filepath):
-                files['photos'].append({
-                    'name': filename,
-                    'size': os.path.getsize(filepath),
-                    'date': datetime.fromtimestamp(os.path.getctime(filepath)).strftime("%Y-%m-%d %H:%M:%S")
-                })
-        
-        return files
+        """Supprime les anciens fichiers (passage unique du service de conservation)"""
+        return self.retention.run_once()
+    
+    def get_file_list(self, kinds=('videos', 'photos'), since=None, until=None,
+                      sort='date', order='desc', page=None, per_page=None):
+        """Retourne la liste des fichiers enregistrés (depuis l'index)"""
+        with FILE_LIST_SECONDS.time():
+            self.media_index.reconcile()
+            
+            limit, offset = None, 0
+            if per_page:
+                limit = per_page
+                offset = (max(page or 1, 1) - 1) * per_page
+            
+            files = {'total': {}}
+            for kind in kinds:
+                total, items = self.media_index.query(kind, since, until, sort, order, limit, offset)
+                files[kind] = items
+                files['total'][kind] = total
+            
+            return files
+    
+    def close(self):
+        """Arrête les traitements en cours et libère la caméra"""
+        if self.motion_detection_active:
+            self.stop_motion_detection()
+        if self._bitrate_restart is not None:
+            self._bitrate_restart.join()
+        if self.is_recording:
+            self.stop_recording()
+        self.stop_continuous_recording()
+        self.photos.close()
+        self.retention.stop()
+        self.thumbnails.close()
+        self.motion_events.close()
+        if self.picam2:
+            self.picam2.close()
+        self.media_index.close()
+    
+    def _motion_detector_stats(self):
+        """Statistiques du détecteur, local ou dans le processus d'analyse"""
+        if self.motion_worker is None:
+            return self.motion_detector.get_stats()
+        event = self.motion_worker.last_event or {}
+        return dict(event.get('detector', {}), worker=self.motion_worker.get_stats())
     
     def get_status(self):
         """Retourne le statut du système"""
         return {
             'recording': self.is_recording,
+            'recording_trigger': self.recording_trigger if self.is_recording else None,
             'motion_detection': self.motion_detection_active,
             'motion_detected': self.motion_detected,
             'last_motion': self.last_motion_time.strftime("%Y-%m-%d %H:%M:%S") if self.last_motion_time else None,
-            'uptime': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            'preroll': self.preroll_output.get_stats() if self.preroll_output else None,
+            'recording_latency': self.recording_latency,
+            'recording_io': self.recording_file.get_stats() if self.recording_file else None,
+            'bitrate': dict(self.bitrate_policy.get_stats(), restarts=self.bitrate_restarts,
+                            encoders={name: encoder.bitrate for name, encoder, *_ in self._live_encoders()}),
+            'retention': self.retention.last_run,
+            'thumbnails': self.thumbnails.get_stats(),
+            'photos': self.photos.get_stats(),
+            'continuous_recording': self.segment_output.get_stats() if self.segment_output else None,
+            'motion_events': {'written': self.motion_events.written, 'ongoing': self.motion_events.get_ongoing()},
+            'streams': self.stream_hub.get_stats(),
+            'motion_detector': self._motion_detector_stats(),
+            'motion_scheduler': self.motion_scheduler.get_stats(),
+            'camera_ready': self.camera_ready.is_set(),
+            'startup': self.startup.as_dict(),
+            'started_at': self.started_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'uptime': round(time.monotonic() - self._started_monotonic)  # Secondes depuis le démarrage
         }
 
-# Initialisation de l'application Flask
+# Initialisation de l'application Flask (la caméra est créée par create_app)
 app = Flask(__name__)
-camera = SurveillanceCamera()
+camera = None
+
+# Routes qui pilotent le capteur : refusées tant que la caméra s'initialise
+CAMERA_ENDPOINTS = {'start_recording', 'take_photo', 'toggle_motion'}
 
 # Template HTML pour l'interface web
 HTML_TEMPLATE = '''
@@ -354,6 +3810,8 @@ HTML_TEMPLATE = '''
         .status { background: #e9ecef; padding: 15px; border-radius: 5px; margin: 20px 0; }
         .files { margin: 20px 0; }
         .file-list { background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 10px 0; }
+        .file-list li { margin: 5px 0; }
+        .thumbnail { width: 80px; vertical-align: middle; margin-right: 10px; border-radius: 3px; }
         .recording-indicator { color: red; font-weight: bold; }
         .motion-indicator { color: green; font-weight: bold; }
         .text-center { text-align: center; }
@@ -397,31 +3855,41 @@ HTML_TEMPLATE = '''
                 .then(response => response.json())
                 .then(data => {
                     let html = '<ul>';
+                    if (!data.camera_ready) {
+                        html += '<li><strong>Caméra:</strong> initialisation...</li>';
+                    }
                     html += '<li><strong>Enregistrement:</strong> ' + (data.recording ? '<span class="recording-indicator">ACTIF</span>' : 'Inactif') + '</li>';
                     html += '<li><strong>Détection de mouvement:</strong> ' + (data.motion_detection ? '<span class="motion-indicator">ACTIVE</span>' : 'Inactive') + '</li>';
                     html += '<li><strong>Mouvement détecté:</strong> ' + (data.motion_detected ? 'OUI' : 'Non') + '</li>';
                     if (data.last_motion) {
                         html += '<li><strong>Dernier mouvement:</strong> ' + data.last_motion + '</li>';
                     }
-                    html += '<li><strong>Système démarré:</strong> ' + data.uptime + '</li>';
+                    html += '<li><strong>Système démarré:</strong> ' + data.started_at + ' (depuis ' + Math.floor(data.uptime / 3600) + ' h ' + Math.floor(data.uptime % 3600 / 60) + ' min)</li>';
                     html += '</ul>';
                     document.getElementById('status-content').innerHTML = html;
                 });
         }
         
+        function fileEntry(kind, file, size) {
+            const path = kind + '/' + encodeURIComponent(file.name);
+            return '<li><img class="thumbnail" loading="lazy" src="/thumbnail/' + path + '" alt="">'
+                + '<a href="/media/' + path + '" target="_blank">' + file.name + '</a> (' + size + ') - ' + file.date
+                + ' <a href="/media/' + path + '?download=1">⬇️</a></li>';
+        }
+        
         function updateFiles() {
             fetch('/files')
                 .then(response => response.json())
                 .then(data => {
                     let html = '<div class="file-list"><h4>Vidéos (' + data.videos.length + ')</h4><ul>';
                     data.videos.forEach(file => {
-                        html += '<li>' + file.name + ' (' + Math.round(file.size/1024/1024) + ' MB) - ' + file.date + '</li>';
+                        html += fileEntry('videos', file, Math.round(file.size/1024/1024) + ' MB');
                     });
                     html += '</ul></div>';
                     
                     html += '<div class="file-list"><h4>Photos (' + data.photos.length + ')</h4><ul>';
                     data.photos.forEach(file => {
-                        html += '<li>' + file.name + ' (' + Math.round(file.size/1024) + ' KB) - ' + file.date + '</li>';
+                        html += fileEntry('photos', file, Math.round(file.size/1024) + ' KB');
                     });
                     html += '</ul></div>';
                     
@@ -444,9 +3912,21 @@ HTML_TEMPLATE = '''
         function takePhoto() {
             fetch('/take_photo', {method: 'POST'})
                 .then(response => response.json())
-                .then(data => {
-                    alert(data.message);
-                    updateFiles();
+                .then(data => waitPhotoJob(data.job_id));
+        }
+        
+        function waitPhotoJob(jobId) {
+            fetch('/photo_jobs/' + jobId)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.status === 'done') {
+                        alert('Photo prise: ' + job.files.join(', '));
+                        updateFiles();
+                    } else if (job.status === 'error') {
+                        alert('Erreur lors de la prise de photo: ' + job.error);
+                    } else {
+                        setTimeout(() => waitPhotoJob(jobId), 300);
+                    }
                 });
         }
         
@@ -456,9 +3936,35 @@ HTML_TEMPLATE = '''
                 .then(data => alert(data.message));
         }
         
-        // Mise à jour automatique toutes les 2 secondes
-        setInterval(updateStatus, 2000);
-        setInterval(updateFiles, 10000);
+        // Interrogation périodique (navigateur sans EventSource ou flux indisponible)
+        let pollingTimers = null;
+        function startPolling() {
+            if (pollingTimers) return;
+            pollingTimers = [setInterval(updateStatus, 2000), setInterval(updateFiles, 10000)];
+        }
+        function stopPolling() {
+            if (!pollingTimers) return;
+            pollingTimers.forEach(clearInterval);
+            pollingTimers = null;
+        }
+        
+        // Mises à jour poussées par le serveur dès qu'un état change
+        if (window.EventSource) {
+            const events = new EventSource('/updates');
+            events.onopen = () => {
+                stopPolling();
+                updateStatus();
+                updateFiles();
+            };
+            ['camera', 'recording', 'motion', 'motion_detection'].forEach(name => events.addEventListener(name, updateStatus));
+            ['file_added', 'file_updated', 'file_deleted'].forEach(name => events.addEventListener(name, updateFiles));
+            // Reconnexion automatique du navigateur ; en attendant, retour à l'interrogation
+            events.onerror = startPolling;
+            // Durée de fonctionnement affichée
+            setInterval(updateStatus, 60000);
+        } else {
+            startPolling();
+        }
         
         // Chargement initial
         updateStatus();
@@ -468,22 +3974,258 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+def create_app(config=None, lazy=True, on_ready=None, on_error=None):
+    """Fabrique de l'application : crée la caméra et la rattache aux routes.
+
+    Avec `lazy`, seuls la configuration, les dossiers et les index sont
+    préparés ici ; le capteur est ouvert en arrière-plan, le serveur peut
+    écouter immédiatement et `on_ready` est appelé après la première image.
+    """
+    global camera
+    camera = SurveillanceCamera(config, open_camera=not lazy, startup=STARTUP)
+    if lazy:
+        camera.open_camera_async(on_ready, on_error)
+    elif on_ready:
+        on_ready()
+    return app
+
+@app.before_request
+def check_camera():
+    if request.endpoint in ('index', 'metrics'):
+        return None
+    if camera is None:
+        return jsonify({'success': False, 'message': 'Application non initialisée (create_app)'}), 503
+    if request.endpoint in CAMERA_ENDPOINTS and not camera.camera_ready.is_set():
+        response = jsonify({'success': False, 'message': "Caméra en cours d'initialisation",
+                            'startup': camera.startup.as_dict()})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    return None
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
+def _stream_profile_from_args(cam, args):
+    """Profil de flux à partir des paramètres de requête (?width=320&quality=60&fps=5)"""
+    values = {}
+    for key in ('width', 'height', 'quality', 'fps'):
+        try:
+            values[key] = int(args.get(key)) if args.get(key) else None
+        except ValueError:
+            values[key] = None
+    return cam.stream_profile(**values)
+
 @app.route('/video_feed')
 def video_feed():
-    return Response(camera.generate_frames(),
+    profile = _stream_profile_from_args(camera, request.args)
+    if not camera.stream_hub.accepts(profile):
+        response = jsonify({'success': False, 'message': 'Trop de profils de flux actifs'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return Response(camera.generate_frames(profile),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/status')
 def status():
     return jsonify(camera.get_status())
 
+def _parse_date_arg(value):
+    """Convertit un paramètre de date (AAAA-MM-JJ[ HH:MM:SS]) en datetime"""
+    if not value:
+        return None
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"Date invalide: {value}")
+
+@app.route('/updates')
+def updates():
+    # Server-Sent Events : enregistrement, mouvement, fichiers ajoutés ou supprimés
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    return Response(camera.events.stream(last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/files')
 def files():
-    return jsonify(camera.get_file_list())
+    # L'ETag dépend de la version de l'index et des paramètres de la requête :
+    # une liste inchangée coûte un stat par dossier et une réponse 304
+    camera.media_index.reconcile()
+    etag = f"{camera.media_index.etag}-{zlib.crc32(request.query_string):08x}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    try:
+        kind = request.args.get('type')
+        if kind not in (None, 'videos', 'photos'):
+            raise ValueError(f"Type invalide: {kind}")
+        file_list = camera.get_file_list(
+            kinds=(kind,) if kind else ('videos', 'photos'),
+            since=_parse_date_arg(request.args.get('since')),
+            until=_parse_date_arg(request.args.get('until')),
+            sort=request.args.get('sort', 'date'),
+            order=request.args.get('order', 'desc'),
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', type=int)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    response = jsonify(file_list)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/events')
+def events():
+    # Événements de mouvement par date de début, ou agrégat horaire (?group=hour)
+    try:
+        since = _parse_date_arg(request.args.get('since'))
+        until = _parse_date_arg(request.args.get('until'))
+        group = request.args.get('group')
+        if group not in (None, 'hour'):
+            raise ValueError(f"Regroupement invalide: {group}")
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    if group == 'hour':
+        return jsonify({'hours': camera.motion_events.hourly(since, until)})
+    
+    per_page = request.args.get('per_page', 100, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    total, items = camera.motion_events.query(since, until, request.args.get('order', 'desc'),
+                                              per_page, (page - 1) * per_page)
+    return jsonify({
+        'total': total,
+        'events': items,
+        'ongoing': camera.motion_events.get_ongoing()
+    })
+
+@app.route('/hls/live.m3u8')
+def hls_live():
+    if camera.segment_output is None:
+        return jsonify({'success': False, 'message': 'Enregistrement continu inactif'}), 404
+    response = Response(camera.segment_output.playlist(), mimetype='application/vnd.apple.mpegurl')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/hls/archive.m3u8')
+def hls_archive():
+    # Segments archivés dans l'intervalle (dernière heure par défaut)
+    try:
+        until = _parse_date_arg(request.args.get('until'))
+        since = _parse_date_arg(request.args.get('since')) or datetime.fromtimestamp(
+            (until.timestamp() if until else time.time()) - 3600)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    camera.media_index.reconcile()
+    _, segments = camera.media_index.query('segments', since, until, sort='name', order='asc')
+    items = []
+    discontinuities = set()
+    previous_end = None
+    for segment in segments:
+        parsed = parse_segment_name(segment['name'])
+        if parsed is None:
+            continue
+        start, duration = parsed
+        # Trou entre deux segments (arrêt, redémarrage) : le lecteur doit se resynchroniser
+        if previous_end is not None and abs(start - previous_end) > 1.0:
+            discontinuities.add(len(items))
+        items.append((segment['name'], duration))
+        previous_end = start + duration
+    return Response(build_hls_playlist(items, camera.config['segment_seconds'], ended=True,
+                                       discontinuities=discontinuities),
+                    mimetype='application/vnd.apple.mpegurl')
+
+@app.route('/hls/<name>')
+def hls_segment(name):
+    path = _media_path(camera, 'segments', name)
+    if path is None:
+        return jsonify({'success': False, 'message': 'Segment introuvable'}), 404
+    return send_file(path, mimetype='video/mp2t', conditional=True, max_age=86400)
+
+def _media_path(cam, kind, name):
+    """Chemin d'une vidéo ou d'une photo, ou None (type inconnu, fichier absent ou hors du dossier)"""
+    directories = cam.media_index.directories
+    # Seuls les fichiers du dossier lui-même sont servis, pas les sous-dossiers
+    # (index des images clés `keyframes/*.kfi`, segment en cours d'écriture)
+    if kind not in directories or os.path.dirname(name):
+        return None
+    path = safe_join(directories[kind], name)
+    return path if path and os.path.isfile(path) else None
+
+@app.route('/media/<kind>/<path:name>')
+def media(kind, name):
+    # send_file gère Range, If-None-Match et If-Modified-Since ; le contenu passe
+    # par wsgi.file_wrapper (sendfile sans copie avec le serveur --async)
+    path = _media_path(camera, kind, name)
+    if path is None:
+        return jsonify({'success': False, 'message': 'Fichier introuvable'}), 404
+    return send_file(path, conditional=True, as_attachment=request.args.get('download') == '1')
+
+@app.route('/clip/<path:name>')
+def clip(name):
+    # Passage d'une vidéo en MP4, sans réencodage (?start=12&end=22, en secondes)
+    path = _media_path(camera, 'videos', name)
+    if path is None:
+        return jsonify({'success': False, 'message': 'Fichier introuvable'}), 404
+    try:
+        start = float(request.args.get('start', 0))
+        end = float(request.args.get('end', start + 10))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Intervalle invalide'}), 400
+    
+    # Préparé sur la carte SD (/tmp est souvent en RAM) et supprimé dès son
+    # ouverture : il disparaît après l'envoi. Le sous-dossier n'est ni indexé ni servi.
+    staging_dir = os.path.join(camera.config['video_dir'], '.clips')
+    os.makedirs(staging_dir, exist_ok=True)
+    handle, clip_path = tempfile.mkstemp(suffix='.mp4', prefix='clip_', dir=staging_dir)
+    os.close(handle)
+    try:
+        stats = export_clip(path, start, end, clip_path)
+        clip_file = open(clip_path, 'rb')
+    except FileNotFoundError:
+        return jsonify({'success': False, 'message': 'Index des images clés introuvable'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except (struct.error, IndexError) as e:
+        # Vidéo ou index tronqué (coupure de courant pendant l'enregistrement...)
+        logger.error(f"Extraction impossible dans {name}: {e}")
+        return jsonify({'success': False, 'message': 'Vidéo ou index des images clés corrompu'}), 500
+    finally:
+        os.remove(clip_path)
+    
+    logger.info(f"Passage extrait de {name}: {stats['duration']} s en {stats['elapsed_ms']} ms")
+    response = send_file(clip_file, mimetype='video/mp4', as_attachment=True,
+                         download_name=f"{os.path.splitext(name)[0]}_{start:g}-{end:g}.mp4")
+    response.headers['X-Clip-Start'] = str(stats['start'])
+    return response
+
+@app.route('/thumbnail/<kind>/<path:name>')
+def thumbnail(kind, name):
+    path = _media_path(camera, kind, name)
+    if path is None:
+        return jsonify({'success': False, 'message': 'Fichier introuvable'}), 404
+    try:
+        thumbnail_path = camera.thumbnails.get(kind, path)
+    except FileNotFoundError:
+        return jsonify({'success': False, 'message': 'Fichier introuvable'}), 404
+    except FutureTimeoutError:  # Distinct de TimeoutError avant Python 3.11
+        return jsonify({'success': False, 'message': 'Miniature en cours de création'}), 503
+    if thumbnail_path is None:
+        return jsonify({'success': False, 'message': 'Miniature indisponible'}), 404
+    return send_file(thumbnail_path, mimetype='image/jpeg', conditional=True, max_age=3600)
 
 @app.route('/start_recording', methods=['POST'])
 def start_recording():
@@ -504,12 +4246,25 @@ def stop_recording():
 
 @app.route('/take_photo', methods=['POST'])
 def take_photo():
-    filename = camera.take_photo()
+    # Réponse immédiate : la capture est mise en file (rafale avec {"count": 10, "interval": 0.2})
+    options = request.get_json(silent=True) or {}
+    try:
+        job = camera.take_photo(options.get('count', 1), options.get('interval', 0.0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Paramètres de rafale invalides'}), 400
     return jsonify({
-        'success': filename is not None,
-        'message': f'Photo prise: {filename}' if filename else 'Erreur lors de la prise de photo',
-        'filename': filename
-    })
+        'success': True,
+        'message': 'Photo en cours' if job['count'] == 1 else f"Rafale de {job['count']} photos en cours",
+        'job_id': job['id'],
+        'job': job
+    }), 202
+
+@app.route('/photo_jobs/<int:job_id>')
+def photo_job(job_id):
+    job = camera.photos.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Travail inconnu'}), 404
+    return jsonify(job)
 
 @app.route('/toggle_motion', methods=['POST'])
 def toggle_motion():
@@ -526,17 +4281,924 @@ def toggle_motion():
         'active': camera.motion_detection_active
     })
 
+class AsyncStreamFanout:
+    """Distribue les frames d'un profil à toutes les connexions asynchrones qui le regardent"""
+
+    def __init__(self, hub, profile, executor):
+        self.hub = hub
+        self.profile = profile
+        self.executor = executor
+        self.queues = set()
+        self.task = None
+        self.closing = False
+
+    async def run(self, on_finished):
+        """Lit les frames partagées (dans un thread) et les pousse dans chaque file client"""
+        loop = asyncio.get_running_loop()
+        frames = self.hub.frames(self.profile, with_capture_time=True)
+        try:
+            while self.queues:
+                item = await loop.run_in_executor(self.executor, next, frames, None)
+                if item is None:
+                    break
+                for client_queue in list(self.queues):
+                    # Backpressure : un client lent perd ses frames les plus anciennes
+                    if client_queue.full():
+                        client_queue.get_nowait()
+                        DROPPED_FRAMES.inc()
+                    client_queue.put_nowait(item)
+        finally:
+            # Plus aucun nouveau client ne doit rejoindre ce diffuseur
+            self.closing = True
+            on_finished(self)
+            await loop.run_in_executor(self.executor, frames.close)
+
+
+class SendfileWrapper:
+    """wsgi.file_wrapper du serveur asynchrone : le fichier est envoyé par loop.sendfile"""
+
+    def __init__(self, file, block_size=65536):
+        self.file = file
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Utilisé seulement si la réponse est consommée comme un itérable classique
+        data = self.file.read(self.block_size)
+        if data:
+            return data
+        raise StopIteration
+
+    def close(self):
+        self.file.close()
+
+
+class AsyncServer:
+    """Serveur HTTP asyncio : une coroutine par connexion au lieu d'un thread.
+
+    /video_feed est servi nativement : un seul thread par profil lit les
+    frames, chaque connexion a une file bornée (les frames les plus
+    anciennes sont abandonnées pour un client lent). Les autres routes
+    sont exécutées par l'application Flask dans un petit pool de threads.
+    Au-delà de `max_connections`, les connexions reçoivent un 503.
+    """
+
+    IDLE_TIMEOUT = 30
+    MAX_BODY_BYTES = 64 * 1024  # Les routes de l'API n'acceptent que de petits corps JSON
+
+    def __init__(self, flask_app, cam, host='0.0.0.0', port=5000):
+        self.app = flask_app
+        self.camera = cam
+        self.host = host
+        self.port = port
+        self.max_connections = cam.config['async_max_connections']
+        self.queue_size = cam.config['async_client_queue']
+        self.connections = 0
+        self.rejected = 0
+        self._fanouts = {}
+        self._server = None
+        self._api_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='async-api')
+        # Un thread bloqué en lecture par profil actif, plus de quoi fermer les diffuseurs qui se terminent
+        self._stream_executor = ThreadPoolExecutor(max_workers=2 * cam.stream_hub.max_profiles,
+                                                   thread_name_prefix='async-stream')
+        self.ready = threading.Event()
+        METRICS.gauge('surveillance_async_connections', "Connexions ouvertes (serveur asynchrone)",
+                      read=lambda: self.connections)
+
+    def run(self):
+        """Démarre le serveur (bloquant)"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.camera.startup.record('listening', time.perf_counter() - _IMPORT_STARTED)
+        self.ready.set()
+        logger.info(f"Serveur asynchrone en écoute sur le port {self.port}")
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def shutdown(self, loop):
+        """Arrête le serveur depuis un autre thread"""
+        if self._server is not None:
+            loop.call_soon_threadsafe(self._server.close)
+
+    async def _handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            await self._write_simple(writer, '503 Service Unavailable', b'Trop de connexions\n', keep_alive=False)
+            writer.close()
+            return
+
+        self.connections += 1
+        try:
+            while True:
+                request = await self._read_request(reader, writer)
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                path, _, query = target.partition('?')
+                keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close')
+
+                if path == '/video_feed' and method == 'GET':
+                    await self._serve_stream(writer, dict(parse_qsl(query)))
+                    break
+                if path == '/updates' and method == 'GET':
+                    await self._serve_events(writer, headers.get('last-event-id'))
+                    break
+                keep_alive = await self._serve_wsgi(writer, method, path, query, version, headers, body,
+                                                    writer.get_extra_info('peername'), keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logger.error(f"Erreur dans le serveur asynchrone: {e}")
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        """Lit une requête HTTP ; None si la connexion est fermée, inactive ou la requête refusée"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.IDLE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+            return None
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', 'identity').lower() != 'identity':
+            # Corps découpé (chunked) non pris en charge : il serait lu comme la requête suivante
+            await self._write_simple(writer, '411 Length Required', b'Content-Length requis\n', keep_alive=False)
+            return None
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._write_simple(writer, '400 Bad Request', b'Content-Length invalide\n', keep_alive=False)
+            return None
+        if length > self.MAX_BODY_BYTES:
+            await self._write_simple(writer, '413 Payload Too Large', b'Corps trop volumineux\n', keep_alive=False)
+            return None
+        # Un client qui n'envoie jamais le corps ne garde pas sa place indéfiniment
+        body = await asyncio.wait_for(reader.readexactly(length), self.IDLE_TIMEOUT) if length else b''
+        return method, target, version, headers, body
+
+    async def _write_simple(self, writer, status, body, keep_alive=True):
+        writer.write((f'HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n'
+                      f'Content-Length: {len(body)}\r\n'
+                      f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode() + body)
+        await writer.drain()
+
+    async def _serve_wsgi(self, writer, method, path, query, version, headers, body, peer, keep_alive):
+        """Exécute une route Flask dans le pool de threads et envoie sa réponse"""
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, encoding='latin-1'),  # PEP 3333 : octets décodés en latin-1
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0] if peer else '',
+            'CONTENT_TYPE': headers.get('content-type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.file_wrapper': SendfileWrapper,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in headers.items():
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                environ[key] = value
+
+        def call_app():
+            response = {}
+
+            def start_response(status, response_headers, exc_info=None):
+                response['status'] = status
+                response['headers'] = response_headers
+
+            result = self.app(environ, start_response)
+            # Fichier (éventuellement restreint à une plage par werkzeug) : envoyé sans copie plus bas
+            wrapper = getattr(result, 'iterable', result)
+            if isinstance(wrapper, SendfileWrapper):
+                span = (wrapper.file, getattr(result, 'start_byte', 0), getattr(result, 'byte_range', None), result)
+                return response['status'], response['headers'], b'', span
+            try:
+                payload = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            return response['status'], response['headers'], payload, None
+
+        loop = asyncio.get_running_loop()
+        status, response_headers, payload, span = await loop.run_in_executor(self._api_executor, call_app)
+
+        lines = [f'HTTP/1.1 {status}']
+        names = set()
+        for name, value in response_headers:
+            names.add(name.lower())
+            lines.append(f'{name}: {value}')
+        if 'content-length' not in names:
+            lines.append(f'Content-Length: {len(payload)}')
+        lines.append(f'Connection: {"keep-alive" if keep_alive else "close"}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload)
+        await writer.drain()
+        if span is not None:
+            file, offset, count, result = span
+            try:
+                await loop.sendfile(writer.transport, file, offset, count)
+            finally:
+                result.close()
+        return keep_alive
+
+    async def _serve_stream(self, writer, args):
+        """Flux MJPEG : abonne la connexion au diffuseur de son profil"""
+        profile = _stream_profile_from_args(self.camera, args)
+        fanout = self._fanouts.get(profile)
+        if fanout is None or fanout.closing:
+            if not self.camera.stream_hub.accepts(profile):
+                await self._write_simple(writer, '503 Service Unavailable', b'Trop de profils de flux actifs\n',
+                                         keep_alive=False)
+                return
+            fanout = AsyncStreamFanout(self.camera.stream_hub, profile, self._stream_executor)
+            self._fanouts[profile] = fanout
+        client_queue = asyncio.Queue(maxsize=self.queue_size)
+        fanout.queues.add(client_queue)
+        if fanout.task is None:
+            fanout.task = asyncio.ensure_future(fanout.run(self._fanout_finished))
+
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                     b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+        try:
+            while True:
+                captured_at, jpeg = await client_queue.get()
+                writer.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                             + f'Content-Length: {len(jpeg)}\r\nX-Timestamp: {captured_at:.6f}\r\n\r\n'.encode()
+                             + jpeg + b'\r\n')
+                await writer.drain()
+        finally:
+            fanout.queues.discard(client_queue)
+
+    async def _serve_events(self, writer, last_event_id):
+        """Server-Sent Events : une file asyncio par connexion, alimentée depuis les autres threads"""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue(maxsize=100)
+
+        def enqueue(event):
+            if not events.full():  # Client bloqué : il se resynchronisera à la reconnexion
+                events.put_nowait(event)
+
+        bus = self.camera.events
+        try:
+            last_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_id = None
+        token, missed = bus.subscribe(lambda event: loop.call_soon_threadsafe(enqueue, event), last_id)
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\nConnection: close\r\n\r\nretry: 3000\n\n'
+                         + ''.join(bus.format(event) for event in missed).encode())
+            await writer.drain()
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), bus.KEEPALIVE_SECONDS)
+                    writer.write(bus.format(event).encode())
+                except asyncio.TimeoutError:
+                    writer.write(b': ping\n\n')
+                await writer.drain()
+        finally:
+            bus.unsubscribe(token)
+
+    def _fanout_finished(self, fanout):
+        if self._fanouts.get(fanout.profile) is fanout:
+            del self._fanouts[fanout.profile]
+
+
+def benchmark_overlay(bench_camera, iterations=1000):
+    """Compare le coût par frame de l'incrustation en cache et du rendu direct"""
+    width, height = bench_camera.config['lores_size']
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    
+    results = {}
+    for name, method in [('uncached', bench_camera.add_overlay_uncached), ('cached', bench_camera.add_overlay)]:
+        method(frame)  # Préchauffage (remplit le cache)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            method(frame)
+        results[f'{name}_us_per_frame'] = round((time.perf_counter() - started) / iterations * 1000000, 1)
+    
+    results['speedup'] = round(results['uncached_us_per_frame'] / max(results['cached_us_per_frame'], 0.001), 1)
+    return results
+
+def _read_rss_kb():
+    """Mémoire résidente du processus (Linux), en Ko"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def benchmark_async_stream(bench_camera, viewers=50, duration=3.0):
+    """Charge du serveur asynchrone : mémoire, threads et latence avec de nombreux clients"""
+    server = AsyncServer(app, bench_camera, host='127.0.0.1', port=0)
+    server_loop = asyncio.new_event_loop()
+    
+    def run_server():
+        asyncio.set_event_loop(server_loop)
+        server_loop.run_until_complete(server.serve())
+    
+    server_thread = threading.Thread(target=run_server, name='bench-async-server')
+    server_thread.daemon = True
+    server_thread.start()
+    server.ready.wait(5)
+    
+    rss_before = _read_rss_kb()
+    threads_before = threading.active_count()
+    latencies = []
+    received = [0] * viewers
+    samples = {}
+    
+    async def viewer(index):
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        writer.write(b'GET /video_feed HTTP/1.1\r\nHost: bench\r\n\r\n')
+        await writer.drain()
+        await reader.readuntil(b'\r\n\r\n')
+        deadline = time.monotonic() + duration
+        try:
+            while time.monotonic() < deadline:
+                part = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+                fields = dict(line.split(': ', 1) for line in part.split('\r\n') if ': ' in line)
+                await reader.readexactly(int(fields['Content-Length']) + 2)
+                latencies.append((time.monotonic() - float(fields['X-Timestamp'])) * 1000)
+                received[index] += 1
+                if index == 0 and 'rss_kb' not in samples and received[0] > 5:
+                    samples['rss_kb'] = _read_rss_kb()
+                    samples['threads'] = threading.active_count()
+        finally:
+            writer.close()
+    
+    async def run_viewers():
+        await asyncio.gather(*(viewer(index) for index in range(viewers)))
+    
+    asyncio.run(run_viewers())
+    server.shutdown(server_loop)
+    server_thread.join(5)
+    
+    return {
+        'viewers': viewers,
+        'fps_per_viewer': round(sum(received) / viewers / duration, 2),
+        'latency_ms_mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'latency_ms_p95': round(_percentile(latencies, 0.95), 2) if latencies else None,
+        'rss_increase_kb': samples['rss_kb'] - rss_before if rss_before and samples.get('rss_kb') else None,
+        'extra_threads': samples.get('threads', threads_before) - threads_before,
+        'rejected_connections': server.rejected
+    }
+
+def _percentile(values, fraction):
+    """Percentile simple d'une liste de mesures"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def _create_bench_camera(directory, **overrides):
+    """Crée une instance de SurveillanceCamera sur le backend simulé, dans un dossier temporaire"""
+    config = {
+        'camera_backend': os.environ.get('SURVEILLANCE_BENCH_SOURCE', 'fake'),
+        'video_dir': os.path.join(directory, 'videos'),
+        'photos_dir': os.path.join(directory, 'photos'),
+        'index_path': os.path.join(directory, 'media_index.db'),
+        'events_path': os.path.join(directory, 'motion_events.db'),
+        'segments_dir': os.path.join(directory, 'segments'),
+        'thumbnails_dir': os.path.join(directory, 'thumbnails')
+    }
+    config.update(overrides)
+    return SurveillanceCamera(config)
+
+def benchmark_stream(bench_camera, client_counts=(1, 5, 20), duration=3.0):
+    """Images/s et latence capture -> client du flux MJPEG selon le nombre de clients"""
+    results = []
+    profile = bench_camera.stream_profile()
+    for count in client_counts:
+        received = [0] * count
+        latencies = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+        source_before = bench_camera.stream_hub.source.frames_produced
+        
+        def client(index):
+            frames = bench_camera.stream_hub.frames(profile, with_capture_time=True)
+            try:
+                for captured_at, _ in frames:
+                    now = time.monotonic()
+                    received[index] += 1
+                    with lock:
+                        latencies.append((now - captured_at) * 1000)
+                    if now >= deadline:
+                        break
+            finally:
+                frames.close()
+        
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        results.append({
+            'clients': count,
+            'fps_per_client': round(sum(received) / count / duration, 2),
+            'captures_per_second': round((bench_camera.stream_hub.source.frames_produced - source_before) / duration, 2),
+            'latency_ms_mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'latency_ms_p95': round(_percentile(latencies, 0.95), 2) if latencies else None
+        })
+    return results
+
+def benchmark_motion(bench_camera, frames=300):
+    """Coût de detect_motion par frame, capture incluse ou non"""
+    luma = [bench_camera.capture_motion_frame() for _ in range(min(frames, 60))]
+    bench_camera.motion_detector.reset()
+    
+    started = time.perf_counter()
+    for index in range(frames):
+        bench_camera.detect_motion(luma[index % len(luma)])
+    elapsed = time.perf_counter() - started
+    
+    return {
+        'frames': frames,
+        'frame_shape': list(luma[0].shape),
+        'us_per_frame': round(elapsed / frames * 1000000, 1),
+        'detector_average_ms': bench_camera.motion_detector.stats['average_ms']
+    }
+
+def _replay_motion_schedule(config, frames, first, last, fps, onsets=(), trace=None):
+    """Rejoue des frames en temps virtuel avec MotionScheduler et MotionDetector.
+
+    Si `trace` est une liste, chaque analyse y ajoute (instant, intervalle
+    après l'analyse, détecteur complet lancé).
+    """
+    detector = MotionDetector(config)
+    scheduler = MotionScheduler(config)
+    scheduler.reset(first / fps)
+    latencies = []
+    pending = None
+    for index in range(first, last):
+        now = index / fps
+        if index in onsets:
+            pending = None if detector.active else now
+        scheduler.on_frame(now)
+        if not scheduler.ready.is_set():
+            continue
+        scheduler.ready.clear()
+
+        cpu_started = time.thread_time()
+        gray = frames(index)
+        full = scheduler.begin_check(gray, now)
+        if full:
+            detected = detector.process(gray, now)
+            scheduler.observe(detector.last_bbox is not None, now)
+            if detected and pending is not None:
+                latencies.append(round(now - pending, 3))
+                pending = None
+        scheduler.record_cpu(full, time.thread_time() - cpu_started)
+        if trace is not None:
+            trace.append((now, scheduler.interval, full))
+
+    stats = scheduler.get_stats(last / fps)
+    return {
+        'checks_per_s': stats['checks_per_s'],
+        'full_checks': stats['full_checks'],
+        'cpu_ms_per_s': stats['cpu_ms_per_s'],
+        'latencies_s': latencies,
+        'max_latency_s': max(latencies, default=None)
+    }
+
+def benchmark_motion_scheduler(bench_camera, cycles=3, quiet_seconds=60):
+    """Rejoue la scène simulée en temps virtuel : cadence fixe ou adaptative.
+
+    Chaque cycle de la scène (8 s) commence par l'entrée d'un objet ; la
+    latence est mesurée de cette frame au déclenchement et comparée à la
+    borne intervalle de repos + (motion_trigger_frames - 1) analyses
+    rapides. Une scène calme (nuit sans passage) mesure le CPU au repos.
+    Le coût de capture (copie du flux lores) n'est pas inclus.
+    """
+    fps = bench_camera.config['framerate']
+    period = fps * 8
+    width, height = bench_camera.config['lores_size']
+    step = bench_camera.config['motion_downscale']
+
+    # Frames préparées à l'avance (plan Y sous-échantillonné, comme capture_motion_frame)
+    scene = FakeCamera(framerate=fps, realtime=False)
+    frames = [cv2.cvtColor(scene._scene(index, (width, height)), cv2.COLOR_BGR2GRAY)[::step, ::step].copy()
+              for index in range(period)]
+
+    base = bench_camera.config
+    modes = {
+        'fixed': dict(base, motion_adaptive=False),
+        'fixed_fast': dict(base, motion_adaptive=False, motion_check_interval=base['motion_active_interval']),
+        'adaptive': dict(base, motion_adaptive=True)
+    }
+    # Départ au milieu d'un cycle (scène calme) pour que le fond soit appris avant la première entrée
+    onsets = {period * cycle for cycle in range(1, cycles + 1)}
+    results = {'scene': {}, 'quiet': {}}
+    for mode, config in modes.items():
+        results['scene'][mode] = _replay_motion_schedule(config, lambda index: frames[index % period],
+                                                         period // 2, period * (cycles + 1), fps, onsets)
+        quiet = _replay_motion_schedule(config, lambda index: frames[-1], 0, quiet_seconds * fps, fps)
+        results['quiet'][mode] = {key: quiet[key] for key in ('checks_per_s', 'full_checks', 'cpu_ms_per_s')}
+
+    bound = (base['motion_idle_interval'] + (base['motion_trigger_frames'] - 1) * base['motion_active_interval']
+             + 2 / fps)
+    adaptive = results['scene']['adaptive']
+    results['latency_bound_s'] = round(bound, 3)
+    results['within_bound'] = len(adaptive['latencies_s']) == cycles and adaptive['max_latency_s'] <= bound
+
+    # CPU économisé : par rapport à la cadence rapide (même latence) et, au repos, à l'ancienne cadence fixe
+    def saved(mode, scenario):
+        reference = results[scenario][mode]['cpu_ms_per_s']
+        return round(100 * (1 - results[scenario]['adaptive']['cpu_ms_per_s'] / reference), 1) if reference else None
+    results['cpu_saved_percent'] = {
+        'scene_vs_fixed_fast': saved('fixed_fast', 'scene'),
+        'quiet_vs_fixed_fast': saved('fixed_fast', 'quiet'),
+        'quiet_vs_fixed': saved('fixed', 'quiet')
+    }
+    return results
+
+def benchmark_motion_worker(directory, viewers=3, duration=3.0):
+    """Analyses de mouvement/s et images/s du flux, analyse dans le processus principal ou dédié"""
+    results = {}
+    for mode, worker in (('single_process', False), ('worker_process', True)):
+        # Analyse en continu à pleine résolution lores, sans déclenchement d'enregistrement
+        bench_camera = _create_bench_camera(os.path.join(directory, mode), motion_worker_process=worker,
+                                            motion_adaptive=False, motion_check_interval=0, motion_downscale=1,
+                                            motion_trigger_frames=10 ** 9, preroll_seconds=0)
+        try:
+            if isinstance(bench_camera.picam2, FakeCamera):
+                bench_camera.picam2.realtime = False  # Limité par le CPU et non par la cadence simulée
+            profile = bench_camera.stream_profile(fps=bench_camera.config['framerate'])
+            received = [0] * viewers
+            stop = threading.Event()
+            
+            def viewer(index):
+                for _ in bench_camera.stream_hub.frames(profile):
+                    received[index] += 1
+                    if stop.is_set():
+                        break
+            
+            threads = [threading.Thread(target=viewer, args=(index,), daemon=True) for index in range(viewers)]
+            for thread in threads:
+                thread.start()
+            bench_camera.start_motion_detection()
+            time.sleep(0.5)  # Démarrage du processus et du flux
+            
+            checks_before = bench_camera.motion_detector.stats['frames']
+            if worker:
+                checks_before = bench_camera.motion_worker.get_stats()['processed']
+            received_before = sum(received)
+            time.sleep(duration)
+            checks = bench_camera.motion_detector.stats['frames']
+            if worker:
+                checks = bench_camera.motion_worker.get_stats()['processed']
+            frames = sum(received) - received_before
+            
+            stop.set()
+            bench_camera.stop_motion_detection()
+            for thread in threads:
+                thread.join(2)
+            results[mode] = {
+                'motion_checks_per_s': round((checks - checks_before) / duration, 1),
+                'stream_fps_per_viewer': round(frames / viewers / duration, 2)
+            }
+        finally:
+            bench_camera.close()
+    results['viewers'] = viewers
+    return results
+
+def benchmark_photos(bench_camera, burst=10):
+    """Latence de la demande de photo et débit d'une rafale pleine résolution"""
+    started = time.perf_counter()
+    job = bench_camera.take_photo(burst, 0)
+    submit_ms = (time.perf_counter() - started) * 1000
+    while bench_camera.photos.get_job(job['id'])['status'] not in ('done', 'error'):
+        time.sleep(0.01)
+    job = bench_camera.photos.get_job(job['id'])
+    return {
+        'submit_ms': round(submit_ms, 3),
+        'burst': burst,
+        'resolution': list(bench_camera.config['resolution']),
+        'capture_fps': job['capture_fps'],
+        'fps': job['fps'],
+        'status': job['status']
+    }
+
+def benchmark_file_list(directory, file_counts=(100, 1000, 5000), repeats=5):
+    """Latence de get_file_list selon le nombre de fichiers (index froid puis chaud)"""
+    results = []
+    for count in file_counts:
+        target = os.path.join(directory, f'files_{count}')
+        bench_camera = _create_bench_camera(target)
+        try:
+            for index in range(count):
+                kind_dir = bench_camera.config['video_dir'] if index % 2 else bench_camera.config['photos_dir']
+                with open(os.path.join(kind_dir, f'file_{index:06d}.bin'), 'wb') as f:
+                    f.write(b'\0' * 64)
+            
+            started = time.perf_counter()
+            bench_camera.get_file_list()
+            cold_ms = (time.perf_counter() - started) * 1000
+            
+            warm = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                bench_camera.get_file_list()
+                warm.append((time.perf_counter() - started) * 1000)
+            
+            results.append({
+                'files': count,
+                'cold_ms': round(cold_ms, 2),
+                'warm_ms_mean': round(sum(warm) / len(warm), 2)
+            })
+        finally:
+            bench_camera.close()
+    return results
+
+def benchmark_recording(bench_camera, repeats=5, record_seconds=0.5):
+    """Latence de démarrage (jusqu'à la première frame écrite) et d'arrêt des enregistrements"""
+    results = {}
+    for mode in ('direct', 'preroll'):
+        if mode == 'preroll':
+            bench_camera.start_preroll()
+            time.sleep(1.5)  # Remplit le buffer de pré-enregistrement
+        starts, stops = [], []
+        for _ in range(repeats):
+            bench_camera.recording_latency['last_start_ms'] = None
+            bench_camera.start_recording()
+            time.sleep(record_seconds)
+            bench_camera.stop_recording()
+            starts.append(bench_camera.recording_latency['last_start_ms'])
+            stops.append(bench_camera.recording_latency['last_stop_ms'])
+            time.sleep(1.1)  # Les fichiers sont horodatés à la seconde
+        if mode == 'preroll':
+            bench_camera.stop_preroll()
+        measured = [value for value in starts if value is not None]
+        results[mode] = {
+            'start_ms_mean': round(sum(measured) / len(measured), 2) if measured else None,
+            'start_ms_max': max(measured) if measured else None,
+            'stop_ms_mean': round(sum(stops) / len(stops), 2)
+        }
+    return results
+
+# Paramètres balayables par --replay : ceux qui modifient le fond et le comptage des pixels,
+# puis ceux qui ne portent que sur le déclenchement (évalués sur les mêmes comptages)
+REPLAY_SIGNAL_KEYS = ('motion_pixel_threshold', 'motion_learning_rate', 'motion_lighting_ratio')
+REPLAY_DECISION_KEYS = ('motion_threshold', 'motion_trigger_frames', 'motion_release_ratio',
+                        'motion_release_seconds', 'motion_min_event_seconds')
+
+def _read_replay_frames(source, config, interval, fps, batch_size):
+    """Lit une vidéo ou un dossier d'images par lots de frames Y sous-échantillonnées, comme le flux lores.
+
+    Seules les frames espacées d'au moins `interval` secondes sont décodées
+    (cadence des analyses sur la caméra). Génère (timestamps, tableau n x h x w).
+    """
+    width, height = config['lores_size']
+    step = config['motion_downscale']
+    if os.path.isdir(source):
+        files = sorted(os.path.join(source, name) for name in os.listdir(source)
+                       if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')))
+        capture = None
+        total = len(files)
+    else:
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"Impossible d'ouvrir {source}")
+        fps = fps or capture.get(cv2.CAP_PROP_FPS) or None
+        files, total = None, None
+    fps = fps or config['framerate']
+    
+    batch = np.empty((batch_size, (height + step - 1) // step, (width + step - 1) // step), dtype=np.uint8)
+    times = []
+    next_time = 0.0
+    index = 0
+    try:
+        while total is None or index < total:
+            timestamp = index / fps
+            wanted = timestamp >= next_time - 0.5 / fps
+            if capture is None:
+                frame = cv2.imread(files[index]) if wanted else None
+            elif wanted:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+            elif capture.grab():
+                frame = None
+            else:
+                break
+            index += 1
+            if frame is None:
+                continue
+            
+            next_time = timestamp + interval
+            gray = cv2.cvtColor(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+            batch[len(times)] = gray[::step, ::step]
+            times.append(timestamp)
+            if len(times) == batch_size:
+                yield times, batch
+                times = []
+        if times:
+            yield times, batch[:len(times)]
+    finally:
+        if capture is not None:
+            capture.release()
+
+def _blur_batch(frames):
+    """Lissage 3x3 d'un lot de frames en un appel (les frames deviennent les canaux d'une image)"""
+    blurred = cv2.GaussianBlur(np.ascontiguousarray(frames.transpose(1, 2, 0)), (3, 3), 0)
+    return np.ascontiguousarray(blurred.reshape(frames.shape[1], frames.shape[2], -1).transpose(2, 0, 1))
+
+def _replay_signal_group(frames_path, shape, times, config, signal_params, decision_combos, batch_size):
+    """Mesure les pixels modifiés une fois pour un jeu de paramètres de pixel, puis applique chaque seuil"""
+    frames = np.memmap(frames_path, dtype=np.uint8, mode='r', shape=(len(times),) + shape)
+    config = dict(config, **signal_params)
+    detector = MotionDetector(config)
+    
+    started = time.perf_counter()
+    series = []
+    for first in range(0, len(times), batch_size):
+        for blurred in _blur_batch(frames[first:first + batch_size]):
+            measured = detector.measure(blurred)
+            series.append(measured[0] if measured else None)
+    measure_seconds = time.perf_counter() - started
+    
+    runs = []
+    for combo in decision_combos:
+        decider = MotionDetector(dict(config, **combo))
+        scores, active, events = [], [], []
+        event = None
+        for timestamp, pixels in zip(times, series):
+            if pixels is None:
+                # Fond (ré)initialisé : frame sans mesure
+                scores.append(None)
+            else:
+                decider.decide(pixels, shape, timestamp)
+                scores.append(round(decider.last_score, 3))
+                if event is not None or decider.active:
+                    event = event or {'start': round(timestamp, 3), 'peak_pixels': 0}
+                    event['peak_pixels'] = max(event['peak_pixels'], max(pixels.values()))
+            active.append(int(decider.active))
+            if event is not None and not decider.active:
+                event['end'] = round(timestamp, 3)
+                events.append(event)
+                event = None
+        if event is not None:
+            event['end'] = round(times[-1], 3)
+            event['truncated'] = True  # En cours à la fin de l'enregistrement
+            events.append(event)
+        for item in events:
+            item['duration'] = round(item['end'] - item['start'], 3)
+        runs.append({
+            'params': dict(signal_params, **combo),
+            'event_count': len(events),
+            'active_seconds': round(sum(item['duration'] for item in events), 3),
+            'events': events,
+            'scores': scores,
+            'active': active
+        })
+    return {'runs': runs, 'measure_seconds': measure_seconds}
+
+def run_replay(source, config=None, sweep=None, workers=None, interval=None, fps=None, batch_size=64):
+    """Rejoue le détecteur de mouvement sur une vidéo ou un dossier d'images, aussi vite que le CPU le permet.
+
+    `sweep` associe des paramètres à des listes de valeurs ; chaque
+    combinaison est évaluée. Les paramètres de pixel (REPLAY_SIGNAL_KEYS)
+    demandent un passage complet sur les frames, réparti entre `workers`
+    processus ; les seuils de déclenchement (REPLAY_DECISION_KEYS) sont
+    appliqués aux comptages déjà mesurés. Par défaut, les frames sont
+    analysées à la cadence de la caméra (`motion_active_interval` en mode
+    adaptatif, sinon `motion_check_interval`).
+    """
+    config = dict(default_config(), **(config or {}))
+    sweep = sweep or {}
+    batch_size = min(max(int(batch_size), 1), 512)  # Une frame par canal OpenCV dans _blur_batch
+    unknown = set(sweep) - set(REPLAY_SIGNAL_KEYS) - set(REPLAY_DECISION_KEYS)
+    if unknown:
+        raise ValueError(f"Paramètres non balayables: {', '.join(sorted(unknown))}")
+    if interval is None:
+        interval = config['motion_active_interval'] if config['motion_adaptive'] else config['motion_check_interval']
+    
+    def grid(keys):
+        keys = [key for key in keys if key in sweep]
+        return [dict(zip(keys, values)) for values in itertools.product(*(sweep[key] for key in keys))]
+    signal_combos = grid(REPLAY_SIGNAL_KEYS)
+    decision_combos = grid(REPLAY_DECISION_KEYS)
+    
+    with tempfile.NamedTemporaryFile(prefix='surveillance_replay_', suffix='.y') as frames_file:
+        # Décodage unique ; les frames réduites sont relues par chaque processus (memmap)
+        started = time.perf_counter()
+        times = []
+        shape = None
+        for batch_times, batch in _read_replay_frames(source, config, interval, fps, batch_size):
+            frames_file.write(batch.tobytes())
+            times.extend(batch_times)
+            shape = batch.shape[1:]
+        frames_file.flush()
+        decode_seconds = time.perf_counter() - started
+        if not times:
+            raise ValueError(f"Aucune frame lue dans {source}")
+        
+        started = time.perf_counter()
+        workers = min(workers or os.cpu_count() or 1, len(signal_combos))
+        jobs = [(frames_file.name, shape, times, config, params, decision_combos, batch_size)
+                for params in signal_combos]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                groups = list(pool.map(_replay_signal_group, *zip(*jobs)))
+        else:
+            groups = [_replay_signal_group(*job) for job in jobs]
+        analysis_seconds = time.perf_counter() - started
+    
+    frames_analysed = len(times) * len(signal_combos)
+    return {
+        'source': source,
+        'frames': len(times),
+        'frame_shape': list(shape),
+        'interval_s': interval,
+        'duration_s': round(times[-1], 3),
+        'times': [round(timestamp, 3) for timestamp in times],
+        'runs': [run for group in groups for run in group['runs']],
+        'throughput': {
+            'workers': workers,
+            'combinations': len(signal_combos) * len(decision_combos),
+            'decode_seconds': round(decode_seconds, 3),
+            'analysis_seconds': round(analysis_seconds, 3),
+            'decode_fps': round(len(times) / decode_seconds, 1),
+            'measure_fps': round(frames_analysed / max(sum(group['measure_seconds'] for group in groups), 1e-9), 1),
+            'analysis_fps': round(frames_analysed / analysis_seconds, 1),
+            'realtime_factor': round(times[-1] / (decode_seconds + analysis_seconds), 1)
+        }
+    }
+
+def run_benchmarks(quick=False):
+    """Exécute la suite de mesures sur le backend simulé et retourne les résultats"""
+    with tempfile.TemporaryDirectory(prefix='surveillance_bench_') as directory:
+        bench_camera = _create_bench_camera(os.path.join(directory, 'main'))
+        try:
+            results = {
+                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'backend': bench_camera.config['camera_backend'],
+                'startup': bench_camera.startup.as_dict(),
+                'stream': benchmark_stream(bench_camera, (1, 5) if quick else (1, 5, 20), 1.0 if quick else 3.0),
+                'async_stream': benchmark_async_stream(bench_camera, 20 if quick else 50, 1.0 if quick else 3.0),
+                'motion': benchmark_motion(bench_camera, 100 if quick else 300),
+                'motion_scheduler': benchmark_motion_scheduler(bench_camera, 2 if quick else 4),
+                'motion_worker': benchmark_motion_worker(os.path.join(directory, 'motion_worker'),
+                                                         duration=1.0 if quick else 3.0),
+                'overlay': benchmark_overlay(bench_camera, 200 if quick else 1000),
+                'recording': benchmark_recording(bench_camera, 2 if quick else 5),
+                'photos': benchmark_photos(bench_camera, 5 if quick else 20),
+                'file_list': benchmark_file_list(directory, (100, 1000) if quick else (100, 1000, 5000))
+            }
+        finally:
+            bench_camera.close()
+    return results
+
 def signal_handler(signum, frame):
-    """Gestionnaire d'arrêt propre"""
+    """Gestionnaire d'arrêt propre (SIGTERM de systemd, Ctrl+C)"""
     logger.info(f"Signal {signum} reçu, arrêt en cours...")
-    if camera.is_recording:
-        camera.stop_recording()
-    if camera.motion_detection_active:
-        camera.stop_motion_detection()
-    if camera.picam2:
-        camera.picam2.close()
+    if camera is not None:
+        # Termine l'enregistrement, écrit les événements en attente et ferme les bases avant de quitter
+        try:
+            camera.close()
+        except Exception as e:
+            logger.error(f"Erreur lors de l'arrêt: {e}")
+    # Les threads du serveur web ne s'arrêtent pas d'eux-mêmes
     os._exit(0)
 
+STARTUP.record('import', time.perf_counter() - _IMPORT_STARTED)
+
 if __name__ == '__main__':
     import signal
     import sys
@@ -548,9 +5210,49 @@ if __name__ == '__main__':
     # Vérification des arguments de ligne de commande
     auto_start = '--auto-start' in sys.argv
     
-    try:
-        # Nettoyage des anciens fichiers au démarrage
-        camera.cleanup_old_files()
+    # Rejeu hors ligne du détecteur (réglage des seuils) : résultats en JSON puis arrêt
+    # ex. --replay videos/nuit.mp4 --sweep motion_threshold=500,1000,2000 --sweep motion_pixel_threshold=20,30,40
+    if '--replay' in sys.argv:
+        def option(name, convert=str):
+            return convert(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else None
+        
+        def parse_value(text):
+            try:
+                return json.loads(text)
+            except ValueError:
+                return text
+        
+        sweep = {}
+        for position, argument in enumerate(sys.argv):
+            if argument == '--sweep':
+                key, _, values = sys.argv[position + 1].partition('=')
+                sweep[key] = [parse_value(value) for value in values.split(',')]
+        report = json.dumps(run_replay(option('--replay'), sweep=sweep, workers=option('--workers', int),
+                                       interval=option('--interval', float), fps=option('--fps', float),
+                                       batch_size=option('--batch', int) or 64))
+        if '--output' in sys.argv:
+            with open(option('--output'), 'w') as f:
+                f.write(report)
+        else:
+            print(report, flush=True)
+        sys.exit(0)
+    
+    # Mesures de performance sur le backend simulé : résultats en JSON puis arrêt
+    if '--benchmark' in sys.argv:
+        report = json.dumps(run_benchmarks(quick='--quick' in sys.argv), indent=2)
+        if '--output' in sys.argv:
+            with open(sys.argv[sys.argv.index('--output') + 1], 'w') as f:
+                f.write(report)
+        print(report, flush=True)
+        if camera is not None:
+            camera.close()
+        sys.exit(0)
+    
+    def on_camera_ready():
+        """Traitements qui ont besoin du capteur, lancés dès la première image"""
+        # Archive continue et direct HLS
+        if '--continuous' in sys.argv or camera.config['continuous_recording']:
+            camera.start_continuous_recording()
         
         # Si mode auto-start, activer automatiquement la détection de mouvement
         if auto_start:
@@ -561,13 +5263,31 @@ if __name__ == '__main__':
             status_file = f'{os.path.dirname(os.path.abspath(__file__))}/system_active.txt'
             with open(status_file, 'w') as f:
                 f.write(f"Système démarré le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    
+    def on_camera_error(error):
+        """Caméra inutilisable : arrêt avec un code d'erreur pour que systemd relance le service"""
+        logger.error(f"Erreur fatale: {error}")
+        os._exit(1)
+    
+    try:
+        # Le serveur écoute pendant que la caméra s'ouvre en arrière-plan
+        create_app(on_ready=on_camera_ready, on_error=on_camera_error)
+        
+        # Nettoyage des anciens fichiers dès le démarrage, puis en continu (en arrière-plan)
+        camera.retention.start()
         
         # Démarrage du serveur Flask
         logger.info("Démarrage du serveur de surveillance...")
         logger.info(f"Interface web accessible sur http://[IP_RASPBERRY]:5000")
         logger.info(f"Détection de mouvement: {'ACTIVE' if auto_start else 'INACTIVE'}")
         
-        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+        if '--async' in sys.argv:
+            # Serveur asyncio : pas de thread par spectateur, connexions plafonnées
+            AsyncServer(app, camera).run()
+        else:
+            server = make_server('0.0.0.0', 5000, app, threaded=True)
+            STARTUP.record('listening', time.perf_counter() - _IMPORT_STARTED)
+            server.serve_forever()
         
     except KeyboardInterrupt:
         logger.info("Arrêt du système de surveillance (Ctrl+C)")
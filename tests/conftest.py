@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import surveillance_camera as sc  # noqa: E402
+
+
+@pytest.fixture
+def fake_camera():
+    """Caméra simulée, cadencée comme un vrai capteur"""
+    camera = sc.FakeCamera(framerate=30)
+    camera.configure(camera.create_video_configuration(main={'size': (320, 240)}))
+    camera.start()
+    yield camera
+    camera.close()
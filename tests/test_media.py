@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import surveillance_camera as sc
+
+
+def test_keyframe_sidecars_are_not_served(tmp_path):
+    camera = sc._create_bench_camera(str(tmp_path))
+    previous, sc.camera = sc.camera, camera
+    try:
+        video = tmp_path / 'videos' / 'video_1.mp4'
+        video.write_bytes(b'\0' * 10)
+        (tmp_path / 'videos' / 'keyframes').mkdir()
+        (tmp_path / 'videos' / 'keyframes' / 'video_1.mp4.kfi').write_bytes(b'KFI1')
+        client = sc.app.test_client()
+
+        assert client.get('/media/videos/video_1.mp4').status_code == 200
+        assert client.get('/media/videos/keyframes/video_1.mp4.kfi').status_code == 404
+        names = [item['name'] for item in client.get('/files').get_json()['videos']]
+        assert names == ['video_1.mp4']
+    finally:
+        sc.camera = previous
+        camera.close()
+
+
+def write_h264(video, gops=3, gop_frames=10, framerate=10):
+    """Flux H.264 Annex B factice (SPS/PPS/IDR puis tranches P) et son index d'images clés"""
+    index = sc.KeyframeIndex(str(video), 64, 48, framerate)
+    data = bytearray()
+    for gop in range(gops):
+        index.add(len(data), gop * gop_frames * 1000000 // framerate)
+        data += b'\0\0\0\1\x67\x42\xc0\x1e\xda' + b'\0\0\0\1\x68\xce\x3c\x80'
+        data += b'\0\0\0\1\x65\x88' + bytes([gop + 1]) * 20
+        for _ in range(gop_frames - 1):
+            data += b'\0\0\0\1\x41\x9a' + b'\x11' * 8
+    index.close()
+    video.write_bytes(bytes(data))
+
+
+def test_export_clip_is_validated_against_indexed_duration(tmp_path):
+    video = tmp_path / 'video.mp4'
+    write_h264(video)
+    clip = str(tmp_path / 'clip.mp4')
+
+    stats = sc.export_clip(str(video), 0.5, 1.5, clip)
+    assert stats['start'] == 0 and stats['frames'] == 15
+
+    # Fin au-delà de la vidéo (3 s indexées) : ramenée à la durée
+    assert sc.export_clip(str(video), 2.5, 100, clip)['frames'] == 10
+    for start, end in ((3.0, 4.0), (-1, 1), (2, 1)):
+        with pytest.raises(ValueError):
+            sc.export_clip(str(video), start, end, clip)
+
+
+def test_clip_route_reports_corrupt_index_as_json(tmp_path):
+    camera = sc._create_bench_camera(str(tmp_path))
+    previous, sc.camera = sc.camera, camera
+    try:
+        video = tmp_path / 'videos' / 'video_1.mp4'
+        write_h264(video)
+        client = sc.app.test_client()
+
+        response = client.get('/clip/video_1.mp4?start=0&end=1')
+        assert response.status_code == 200 and response.data[4:8] == b'ftyp'
+        response.close()
+
+        (tmp_path / 'videos' / 'keyframes' / 'video_1.mp4.kfi').write_bytes(b'KF')
+        response = client.get('/clip/video_1.mp4?start=0&end=1')
+        assert response.status_code == 500
+        assert response.get_json()['success'] is False
+        assert os.listdir(tmp_path / 'videos' / '.clips') == []
+    finally:
+        sc.camera = previous
+        camera.close()
@@ -0,0 +1,65 @@
+import cv2
+import pytest
+
+import surveillance_camera as sc
+
+
+@pytest.fixture
+def scene(fake_camera):
+    """Un cycle de la scène simulée (entrée d'un objet puis 4 s de calme), en niveaux de gris réduits"""
+    config = dict(sc.default_config(), framerate=fake_camera.framerate)
+    step = config['motion_downscale']
+    period = fake_camera.framerate * 8
+    frames = [cv2.cvtColor(fake_camera._scene(index, (320, 240)), cv2.COLOR_BGR2GRAY)[::step, ::step].copy()
+              for index in range(period)]
+    return config, frames, period
+
+
+def test_every_onset_is_detected_within_bound(scene):
+    config, frames, period = scene
+    fps, cycles = config['framerate'], 3
+    onsets = {period * cycle for cycle in range(1, cycles + 1)}
+
+    result = sc._replay_motion_schedule(config, lambda index: frames[index % period],
+                                        period // 2, period * (cycles + 1), fps, onsets)
+
+    bound = (config['motion_idle_interval'] + (config['motion_trigger_frames'] - 1) * config['motion_active_interval']
+             + 2 / fps)
+    assert len(result['latencies_s']) == cycles
+    assert result['max_latency_s'] <= bound
+
+
+def test_idle_rate_backs_off_to_minimum_on_static_scene(scene):
+    config, frames, period = scene
+    fps = config['framerate']
+    trace = []
+
+    # Le fond est appris sur la scène calme, un objet la traverse, puis plus rien ne bouge
+    def frame(index):
+        return frames[index - period] if period <= index < period * 3 // 2 else frames[-1]
+
+    sc._replay_motion_schedule(config, frame, 0, period + 30 * fps, fps, onsets={period}, trace=trace)
+
+    idle = config['motion_idle_interval']
+    assert min(interval for _, interval, _ in trace) == config['motion_active_interval']
+    assert trace[-1][1] == idle
+    gaps = [later[0] - earlier[0] for earlier, later in zip(trace[-10:], trace[-9:])]
+    assert all(gap == pytest.approx(idle, abs=1 / fps) for gap in gaps)
+
+
+def test_rate_ramps_up_on_first_candidate(scene):
+    config, frames, period = scene
+    fps = config['framerate']
+    trace = []
+
+    sc._replay_motion_schedule(config, lambda index: frames[index % period], period // 2, period + fps, fps,
+                               onsets={period}, trace=trace)
+
+    onset = period / fps
+    calm = [interval for now, interval, _ in trace if now < onset]
+    assert calm[-1] == config['motion_idle_interval']
+    first_after, next_after = [entry for entry in trace if entry[0] >= onset][:2]
+    assert first_after[0] - onset <= config['motion_idle_interval']
+    assert first_after[1] == config['motion_active_interval']
+    assert first_after[2]
+    assert next_after[0] - first_after[0] == pytest.approx(config['motion_active_interval'], abs=1 / fps)
@@ -0,0 +1,111 @@
+import time
+
+import cv2
+
+import surveillance_camera as sc
+
+
+def test_frames_before_first_keyframe_are_not_counted(tmp_path):
+    video = str(tmp_path / 'video.mp4')
+    first_frames = []
+    keyframe_index = sc.KeyframeIndex(video, 640, 360, 30)
+    output = sc.RecordingOutput(sc.WriteBehindFile(video), lambda: first_frames.append(True), keyframe_index)
+    output.start()
+
+    # L'enregistrement démarre au milieu d'un GOP : ces frames ne sont pas écrites
+    output.outputframe(b'p' * 10, keyframe=False, timestamp=1000)
+    output.outputframe(b'p' * 10, keyframe=False, timestamp=2000)
+    assert not first_frames
+    output.outputframe(b'K' * 40, keyframe=True, timestamp=3000)
+    output.outputframe(b'p' * 10, keyframe=False, timestamp=4000)
+    output.outputframe(b'K' * 40, keyframe=True, timestamp=5000)
+    output.stop()
+
+    with open(video, 'rb') as f:
+        data = f.read()
+    assert data == b'K' * 40 + b'p' * 10 + b'K' * 40
+    assert first_frames == [True]
+    _, _, _, entries = sc.KeyframeIndex.load(video)
+    assert entries == [(3000, 0), (5000, 50)]
+    for timestamp, offset in entries:
+        assert data[offset:offset + 1] == b'K'
+
+
+def test_preroll_with_empty_buffer_starts_on_next_keyframe(tmp_path):
+    video = str(tmp_path / 'video.mp4')
+    first_frames = []
+    output = sc.PreRollOutput(seconds=3)
+    output.start()
+
+    assert output.start_file(sc.WriteBehindFile(video), lambda: first_frames.append(True)) == 0
+    for timestamp in (1000, 2000):
+        output.outputframe(b'P' * 5, keyframe=False, timestamp=timestamp)
+    assert not first_frames
+    output.outputframe(b'K' * 5, keyframe=True, timestamp=3000)
+    output.outputframe(b'P' * 5, keyframe=False, timestamp=4000)
+    output.stop()
+
+    with open(video, 'rb') as f:
+        assert f.read() == b'KKKKKPPPPP'
+    assert first_frames == [True]
+
+
+def test_manual_recording_survives_motion_detection_stop(tmp_path):
+    camera = sc._create_bench_camera(str(tmp_path), preroll_seconds=2, motion_threshold=10 ** 9)
+    try:
+        camera.start_motion_detection()
+        assert camera.preroll_output is not None
+        assert camera.start_recording()
+
+        camera.stop_motion_detection()
+        assert camera.is_recording
+        assert camera.preroll_output is not None  # Gardé pour l'enregistrement manuel
+
+        assert camera.stop_recording()
+        assert camera.preroll_output is None
+    finally:
+        camera.close()
+
+
+def test_motion_recording_stops_with_motion_detection(tmp_path):
+    camera = sc._create_bench_camera(str(tmp_path), preroll_seconds=2, motion_threshold=10 ** 9)
+    try:
+        camera.start_motion_detection()
+        assert camera.start_recording(60, trigger='motion')
+
+        camera.stop_motion_detection()
+        assert not camera.is_recording
+        assert camera.preroll_output is None
+    finally:
+        camera.close()
+
+
+def test_recorded_bitrate_follows_scene_activity(tmp_path):
+    camera = sc._create_bench_camera(str(tmp_path), preroll_seconds=2)
+    width, height = camera.config['lores_size']
+    step, fps, maximum = camera.config['motion_downscale'], camera.config['framerate'], camera.config['bitrate']
+
+    def analyse(indices):
+        for index in indices:
+            scene = camera.picam2._scene(index, (width, height))
+            camera.detect_motion(cv2.cvtColor(scene, cv2.COLOR_BGR2GRAY)[::step, ::step].copy())
+        camera._bitrate_restart.join()
+
+    def recorded_bitrate():
+        written = camera.preroll_output._file_bytes
+        time.sleep(1)
+        return (camera.preroll_output._file_bytes - written) * 8
+
+    try:
+        camera.start_preroll()
+        assert camera.start_recording()
+        analyse([fps * 6] * 20)  # Fond seul : scène calme
+        assert camera.preroll_encoder.bitrate == int(maximum * camera.config['bitrate_min_ratio'])
+        calm = recorded_bitrate()
+        analyse(range(0, 40, 4))  # Le rectangle traverse l'image
+        assert camera.preroll_encoder.bitrate == maximum
+        moving = recorded_bitrate()
+    finally:
+        camera.close()
+
+    assert calm < maximum / 2 < moving
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import surveillance_camera as sc
+
+
+@pytest.fixture
+def library(tmp_path):
+    """20 vidéos de 1000 octets, de la plus ancienne (video_00) à la plus récente"""
+    videos = tmp_path / 'videos'
+    videos.mkdir()
+    for number in range(20):
+        (videos / f'video_{number:02d}.mp4').write_bytes(b'\0' * 1000)
+    index = sc.MediaIndex(str(tmp_path / 'media_index.db'), {'videos': str(videos)})
+    yield index, videos
+    index.close()
+
+
+def make_service(index, videos, protected, **limits):
+    config = {'video_dir': str(videos), 'cleanup_days': 365, 'max_storage_bytes': None, 'min_free_bytes': None,
+              'retention_batch_size': 10, 'retention_batch_pause': 0}
+    config.update(limits)
+    protected_paths = {str(videos / name) for name in protected}
+    return sc.RetentionService(index, config, lambda: protected_paths)
+
+
+def remaining(videos):
+    return sorted(name for name in os.listdir(videos) if name.endswith('.mp4'))
+
+
+def test_quota_removes_oldest_unprotected_first(library):
+    index, videos = library
+    # Un lot entier (et plus) de fichiers protégés en tête : la suppression continue après eux
+    protected = [f'video_{number:02d}.mp4' for number in range(12)]
+    service = make_service(index, videos, protected, max_storage_bytes=15000)
+
+    stats = service.run_once()
+
+    assert stats['deleted_files'] == 5
+    assert stats['reasons']['quota'] == 5
+    assert remaining(videos) == protected + [f'video_{number:02d}.mp4' for number in range(17, 20)]
+    assert index.total_size() <= 15000
+
+
+def test_free_space_removes_oldest_unprotected_first(library):
+    index, videos = library
+    service = make_service(index, videos, ['video_00.mp4'], min_free_bytes=8000)
+    # Disque simulé de 25 000 octets
+    service._free_bytes = lambda: 25000 - index.total_size()
+
+    stats = service.run_once()
+
+    assert stats['reasons']['free_space'] == 3
+    assert remaining(videos) == ['video_00.mp4'] + [f'video_{number:02d}.mp4' for number in range(4, 20)]
+
+
+def test_nothing_removed_under_limits(library):
+    index, videos = library
+    service = make_service(index, videos, [], max_storage_bytes=20000, min_free_bytes=1)
+    service._free_bytes = lambda: 10 ** 9
+
+    assert service.run_once()['deleted_files'] == 0
+    assert len(remaining(videos)) == 20
+
+
+def test_keyframe_index_removed_with_its_video(library, monkeypatch):
+    index, videos = library
+    sidecars = videos / 'keyframes'
+    sidecars.mkdir()
+    for number in (0, 1):
+        (sidecars / f'video_{number:02d}.mp4.kfi').write_bytes(b'KFI1')
+    # Vidéo supprimée entre deux passages de l'index : son index d'images clés ne doit pas rester orphelin
+    index.reconcile()
+    monkeypatch.setattr(index, 'reconcile', lambda: None)
+    (videos / 'video_01.mp4').unlink()
+    service = make_service(index, videos, [], max_storage_bytes=18000)
+
+    service.run_once()
+
+    assert os.listdir(sidecars) == []
+    assert remaining(videos)[0] == 'video_02.mp4'
@@ -0,0 +1,19 @@
+import surveillance_camera as sc
+
+
+def test_bench_camera_does_not_overwrite_app_startup_report(tmp_path, monkeypatch):
+    app_report = sc.StartupReport(publish=True)
+    app_report.record('ready', 12.5)
+    monkeypatch.setattr(sc, 'STARTUP', app_report)
+    published = sc.METRICS.gauge('surveillance_startup_seconds', "Durée des phases de démarrage", {'phase': 'ready'})
+
+    cam = sc._create_bench_camera(str(tmp_path))
+    try:
+        assert cam.startup is not app_report
+        assert set(cam.startup.phases) >= {'camera_open', 'first_frame', 'exposure', 'ready'}
+        assert cam.get_status()['startup']['ready'] == cam.startup.phases['ready']
+    finally:
+        cam.close()
+
+    assert app_report.phases == {'ready': 12.5}
+    assert published.value == 12.5
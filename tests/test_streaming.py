@@ -0,0 +1,77 @@
+import threading
+
+import cv2
+
+import surveillance_camera as sc
+
+
+def test_one_encode_per_frame_for_all_clients(fake_camera):
+    encodes = []
+    lock = threading.Lock()
+
+    def produce_frame():
+        frame = fake_camera.capture_array()
+        _, buffer = cv2.imencode('.jpg', frame)
+        jpeg = buffer.tobytes()
+        with lock:
+            encodes.append(jpeg)
+        return jpeg
+
+    broadcaster = sc.FrameBroadcaster(produce_frame, interval=1 / 30, name='test')
+    clients, frames_per_client = 5, 10
+    received = [[] for _ in range(clients)]
+    ready = threading.Barrier(clients)
+
+    def client(index):
+        ready.wait()
+        frames = broadcaster.frames()
+        for frame in frames:
+            received[index].append(frame)
+            if len(received[index]) == frames_per_client:
+                break
+        frames.close()
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert all(len(frames) == frames_per_client for frames in received)
+    # Chaque frame reçue vient d'un encodage unique, partagé entre les clients
+    assert len(encodes) == broadcaster.frames_produced
+    distinct = {id(frame) for frames in received for frame in frames}
+    assert len(distinct) <= len(encodes) < clients * frames_per_client
+    encoded = {id(frame) for frame in encodes}
+    assert distinct <= encoded
+
+
+def test_clients_of_a_profile_share_one_encoder(fake_camera):
+    hub = sc.StreamHub(fake_camera.capture_array, lambda frame: None)
+    profile = sc.StreamProfile(160, 120, 70, 10)
+    streams = [hub.frames(profile) for _ in range(3)]
+    for stream in streams:
+        next(stream)
+
+    stats = hub.get_stats()
+    assert len(stats) == 1 and stats[0]['clients'] == 3
+    for stream in streams:
+        next(stream)
+    assert hub.get_stats()[0]['frames_encoded'] <= hub.source.frames_produced
+
+    for stream in streams:
+        stream.close()
+    assert hub.get_stats() == []
+
+
+def test_number_of_live_profiles_is_capped(fake_camera):
+    hub = sc.StreamHub(fake_camera.capture_array, lambda frame: None, max_profiles=1)
+    first = hub.frames(sc.StreamProfile(160, 120, 70, 10))
+    next(first)
+    other = sc.StreamProfile(80, 60, 50, 5)
+
+    assert not hub.accepts(other)
+    assert list(hub.frames(other)) == []
+
+    first.close()
+    assert hub.accepts(other)